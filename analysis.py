@@ -0,0 +1,371 @@
+"""
+Vectorized statistics for climate anomaly series.
+Series are stacked into one (years x series) array with NaN for missing
+values, and correlations and trends for all series are computed with a few
+matrix operations instead of per-pair Python loops.
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy.stats import t as t_dist
+
+def _masked(values: np.ndarray):
+    """Presence mask and zero-filled, column-centred copy of a NaN-masked array."""
+    mask = ~np.isnan(values)
+    filled = np.where(mask, values, 0.0)
+    # Column means over the present values; a column with none (or an empty window) is centred on 0
+    count = mask.sum(axis=0)
+    centred = filled - filled.sum(axis=0) / np.where(count > 0, count, 1)
+    return mask.astype(np.float64), np.where(mask, centred, 0.0)
+
+def correlation_p_values(r: np.ndarray, n: np.ndarray) -> np.ndarray:
+    """Two-sided p-values of Pearson correlations r computed from n samples."""
+    df = n - 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_stat = np.abs(r) * np.sqrt(df / np.clip(1.0 - r ** 2, 0.0, None))
+    p = 2 * t_dist.sf(t_stat, np.where(df > 0, df, np.nan))
+    return np.where(np.abs(r) >= 1.0, 0.0, p)
+
+def pairwise_correlations(values: np.ndarray):
+    """Pairwise-complete Pearson correlation matrix of the columns of values.
+
+    Each pair uses only the rows where both columns are present. Returns
+    (r, p_value, n_samples) as (k x k) arrays; r and p are NaN where fewer
+    than three shared samples exist or a series is constant over them.
+    """
+    mask, x = _masked(np.asarray(values, dtype=np.float64))
+
+    # Entry [i, j] sums column i over the rows where column j is present
+    n = mask.T @ mask
+    sum_x = x.T @ mask
+    sum_xx = (x ** 2).T @ mask
+    sum_xy = x.T @ x
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sum_xy - sum_x * sum_x.T / n
+        var_i = sum_xx - sum_x ** 2 / n
+        var_j = var_i.T
+        r = cov / np.sqrt(var_i * var_j)
+    r = np.where((n > 2) & (var_i > 0) & (var_j > 0), np.clip(r, -1.0, 1.0), np.nan)
+
+    return r, correlation_p_values(r, n), n.astype(int)
+
+def linear_trends(years: np.ndarray, values: np.ndarray) -> Dict[str, np.ndarray]:
+    """Ordinary least squares trend of every column of values against years.
+
+    Returns per-column arrays: slope (per year), intercept, r_squared,
+    n_samples and the first/last year with data.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    years = np.asarray(years, dtype=np.float64)
+    mask = ~np.isnan(values)
+    m = mask.astype(np.float64)
+
+    # Centre the years for numerical stability; the intercept is shifted back below
+    x_offset = years.mean() if len(years) else 0.0
+    x = (years - x_offset)[:, None] * m
+    y = np.where(mask, values, 0.0)
+
+    n = m.sum(axis=0)
+    sum_x, sum_y = x.sum(axis=0), y.sum(axis=0)
+    sxx = (x ** 2).sum(axis=0) - sum_x ** 2 / np.where(n > 0, n, 1)
+    syy = (y ** 2).sum(axis=0) - sum_y ** 2 / np.where(n > 0, n, 1)
+    sxy = (x * y).sum(axis=0) - sum_x * sum_y / np.where(n > 0, n, 1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = sxy / sxx
+        intercept = (sum_y - slope * sum_x) / n - slope * x_offset
+        r_squared = np.where(syy > 0, sxy ** 2 / (sxx * syy), 0.0)
+
+    first = np.where(n > 0, np.where(mask, years[:, None], np.inf).min(axis=0, initial=np.inf), np.nan)
+    last = np.where(n > 0, np.where(mask, years[:, None], -np.inf).max(axis=0, initial=-np.inf), np.nan)
+
+    return {
+        'slope': slope,
+        'intercept': intercept,
+        'r_squared': r_squared,
+        'n_samples': n.astype(int),
+        'first_year': first,
+        'last_year': last,
+    }
+
+def _rounded(value: float, digits: int) -> Optional[float]:
+    """Round for JSON output, mapping NaN/inf to None."""
+    return round(float(value), digits) if np.isfinite(value) else None
+
+def analyze_frame(frame: pd.DataFrame, datasets: List[str]) -> Dict:
+    """Correlations and trends for a year x dataset frame, in the /analyze response format."""
+    present = [dataset for dataset in datasets if dataset in frame.columns]
+    years = frame.index.to_numpy()
+    values = frame[present].to_numpy(dtype=np.float64) if present else np.empty((len(years), 0))
+
+    # Calculate correlation matrix
+    correlations = {}
+    if len(datasets) > 1 and present:
+        r, p, n = pairwise_correlations(values)
+        for i, dataset1 in enumerate(present):
+            correlations[dataset1] = {}
+            for j, dataset2 in enumerate(present):
+                if i == j:
+                    continue
+                enough = n[i, j] > 2
+                correlations[dataset1][dataset2] = {
+                    'correlation': _rounded(r[i, j], 4) if enough else None,
+                    'p_value': _rounded(p[i, j], 6) if enough else None,
+                    'n_samples': int(n[i, j])
+                }
+
+    # Calculate trend statistics
+    trends = {}
+    if present:
+        fit = linear_trends(years, values)
+        for i, dataset in enumerate(present):
+            if fit['n_samples'][i] <= 2:
+                continue
+            trends[dataset] = {
+                'slope_per_year': _rounded(fit['slope'][i], 6),
+                'slope_per_decade': _rounded(fit['slope'][i] * 10, 4),
+                'r_squared': _rounded(fit['r_squared'][i], 4),
+                'n_samples': int(fit['n_samples'][i]),
+                'period': f"{int(fit['first_year'][i])}-{int(fit['last_year'][i])}"
+            }
+
+    return {
+        'correlations': correlations,
+        'trends': trends,
+        'period': f"{int(years.min())}-{int(years.max())}" if len(years) else None,
+        'total_years': int(len(years))
+    }
+
+def parse_windows(spec: str) -> List[tuple]:
+    """Parse a window list such as '1900-,1951-1980,1979-,last30'.
+
+    Returns (start, end) tuples where either side may be None for an open
+    bound, or ('last', n) for the most recent n years of data.
+    """
+    windows = []
+    for token in filter(None, (part.strip() for part in spec.split(','))):
+        if token.startswith('last'):
+            windows.append(('last', int(token[len('last'):])))
+            continue
+        start, _, end = token.partition('-')
+        windows.append((int(start) if start else None, int(end) if end else None))
+    return windows
+
+def clamp_window(start: Optional[int], end: Optional[int], min_year: int, max_year: int) -> tuple:
+    """Resolve open bounds and clamp a window to the years that have data."""
+    start = min_year if start is None else max(start, min_year)
+    end = max_year if end is None else min(end, max_year)
+    return start, end
+
+def precompute_windows(frame: pd.DataFrame, windows: List[tuple]) -> List[Dict]:
+    """Analyze every dataset in frame over each window.
+
+    Returns one entry per window with its clamped bounds and a payload that
+    select_precomputed can answer any subset of datasets from.
+    """
+    if frame.empty:
+        return []
+    min_year, max_year = int(frame.index.min()), int(frame.index.max())
+    datasets = list(frame.columns)
+
+    results = []
+    for window in windows:
+        if window[0] == 'last':
+            window = (max_year - window[1] + 1, None)
+        start, end = clamp_window(*window, min_year, max_year)
+        if start > end:
+            continue
+        # Datasets without data in the window stay in, so their correlations report n_samples 0
+        window_frame = frame.loc[start:end].dropna(how='all')
+        analysis = analyze_frame(window_frame, datasets)
+        results.append({
+            'start_year': start,
+            'end_year': end,
+            'payload': {
+                'correlations': analysis['correlations'],
+                'trends': analysis['trends'],
+                'years': {dataset: window_frame[dataset].dropna().index.astype(int).tolist()
+                          for dataset in window_frame.columns},
+                'data_years': [min_year, max_year]
+            }
+        })
+    return results
+
+def select_precomputed(payload: Dict, datasets: List[str]) -> Dict:
+    """Build an /analyze response for a subset of datasets from a precomputed payload."""
+    present = [dataset for dataset in datasets if dataset in payload['years']]
+
+    correlations = {}
+    if len(datasets) > 1:
+        for dataset1 in present:
+            correlations[dataset1] = {dataset2: payload['correlations'][dataset1][dataset2]
+                                      for dataset2 in present if dataset2 != dataset1}
+
+    years = sorted(set().union(*(payload['years'][dataset] for dataset in present)))
+    return {
+        'correlations': correlations,
+        'trends': {dataset: payload['trends'][dataset] for dataset in present if dataset in payload['trends']},
+        'period': f"{years[0]}-{years[-1]}" if years else None,
+        'total_years': len(years)
+    }
+
+class PrefixSumIndex:
+    """Prefix sums of a year x dataset frame for constant-time window statistics.
+
+    The frame is laid out on a dense year axis and cumulative n, sum(x),
+    sum(y), sum(xy), sum(x^2) and sum(y^2) are kept per dataset, plus the
+    pairwise-complete sums needed for correlations. Any [start, end]
+    slope, R^2 or correlation is then a difference of two rows.
+    """
+
+    def __init__(self, frame: pd.DataFrame):
+        self.datasets = list(frame.columns)
+        self.first_year = int(frame.index.min()) if len(frame) else 0
+        self.last_year = int(frame.index.max()) if len(frame) else -1
+        dense = frame.reindex(range(self.first_year, self.last_year + 1))
+        values = dense.to_numpy(dtype=np.float64)
+
+        mask = ~np.isnan(values)
+        m = mask.astype(np.float64)
+        x = (dense.index.to_numpy(dtype=np.float64) - self.first_year)[:, None] * m
+        y = np.where(mask, values, 0.0)
+
+        def cumulative(a):
+            return np.concatenate([np.zeros((1,) + a.shape[1:]), np.cumsum(a, axis=0)])
+
+        self._n, self._x, self._y = cumulative(m), cumulative(x), cumulative(y)
+        self._xx, self._yy, self._xy = cumulative(x ** 2), cumulative(y ** 2), cumulative(x * y)
+
+        # Entry [t, i, j]: sums of series i over the years where series j is also present
+        self._pair_n = cumulative(m[:, :, None] * m[:, None, :])
+        self._pair_y = cumulative(y[:, :, None] * m[:, None, :])
+        self._pair_yy = cumulative((y ** 2)[:, :, None] * m[:, None, :])
+        self._pair_cross = cumulative(y[:, :, None] * y[:, None, :])
+
+    def _bounds(self, start: Optional[int], end: Optional[int]) -> tuple:
+        """Row offsets into the prefix arrays for an inclusive year window.
+
+        Windows outside the indexed years, and any window of an empty index,
+        come out empty (lo == hi) rather than past the end of the arrays.
+        """
+        start, end = clamp_window(start, end, self.first_year, self.last_year)
+        n_rows = len(self._n) - 1
+        lo = min(max(start - self.first_year, 0), n_rows)
+        hi = min(max(end - self.first_year + 1, lo), n_rows)
+        return lo, hi
+
+    def _window(self, prefix: np.ndarray, lo, hi) -> np.ndarray:
+        return prefix[hi] - prefix[lo]
+
+    def trends(self, start: Optional[int] = None, end: Optional[int] = None,
+               lo=None, hi=None) -> Dict[str, np.ndarray]:
+        """OLS slope (per year), intercept, R^2 and n per dataset over a window.
+
+        lo/hi may be arrays of row offsets to evaluate many windows at once.
+        """
+        if lo is None:
+            lo, hi = self._bounds(start, end)
+        n = self._window(self._n, lo, hi)
+        sum_x, sum_y = self._window(self._x, lo, hi), self._window(self._y, lo, hi)
+        safe_n = np.where(n > 0, n, 1)
+        sxx = self._window(self._xx, lo, hi) - sum_x ** 2 / safe_n
+        syy = self._window(self._yy, lo, hi) - sum_y ** 2 / safe_n
+        sxy = self._window(self._xy, lo, hi) - sum_x * sum_y / safe_n
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slope = np.where(n > 2, sxy / sxx, np.nan)
+            intercept = (sum_y - slope * sum_x) / n - slope * self.first_year
+            r_squared = np.where(syy > 0, sxy ** 2 / (sxx * syy), 0.0)
+        return {'slope': slope, 'intercept': intercept, 'r_squared': r_squared, 'n_samples': n.astype(int)}
+
+    def correlations(self, start: Optional[int] = None, end: Optional[int] = None) -> tuple:
+        """Pairwise-complete correlation, p-value and n matrices over a window."""
+        lo, hi = self._bounds(start, end)
+        n = self._window(self._pair_n, lo, hi)
+        sum_y = self._window(self._pair_y, lo, hi)
+        sum_yy = self._window(self._pair_yy, lo, hi)
+        cross = self._window(self._pair_cross, lo, hi)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = cross - sum_y * sum_y.T / n
+            var_i = sum_yy - sum_y ** 2 / n
+            var_j = var_i.T
+            r = cov / np.sqrt(var_i * var_j)
+        # Differences of large prefix sums can leave tiny negative variances for constant series
+        r = np.where((n > 2) & (var_i > 1e-12) & (var_j > 1e-12), np.clip(r, -1.0, 1.0), np.nan)
+        return r, correlation_p_values(r, n), n.astype(int)
+
+    def _year_span(self, counts: np.ndarray, lo: int, hi: int) -> Optional[tuple]:
+        """First and last year with data in [lo, hi) for a prefix count column."""
+        if counts[hi] - counts[lo] <= 0:
+            return None
+        first = int(np.searchsorted(counts, counts[lo], side='right')) - 1
+        last = int(np.searchsorted(counts, counts[hi], side='left')) - 1
+        return self.first_year + first, self.first_year + last
+
+    def analyze(self, datasets: List[str], start: Optional[int] = None, end: Optional[int] = None) -> Dict:
+        """/analyze response for a window, equivalent to analyze_frame on the filtered frame.
+
+        Requested datasets without data in the window still get correlation
+        entries, with n_samples 0, as they do from analyze_frame.
+        """
+        lo, hi = self._bounds(start, end)
+        present = [self.datasets.index(d) for d in datasets if d in self.datasets]
+        names = [self.datasets[i] for i in present]
+
+        correlations = {}
+        if len(datasets) > 1 and present:
+            r, p, n = self.correlations(start, end)
+            for i in present:
+                correlations[self.datasets[i]] = {}
+                for j in present:
+                    if i == j:
+                        continue
+                    enough = n[i, j] > 2
+                    correlations[self.datasets[i]][self.datasets[j]] = {
+                        'correlation': _rounded(r[i, j], 4) if enough else None,
+                        'p_value': _rounded(p[i, j], 6) if enough else None,
+                        'n_samples': int(n[i, j])
+                    }
+
+        trends = {}
+        fit = self.trends(lo=lo, hi=hi)
+        for i, name in zip(present, names):
+            if fit['n_samples'][i] <= 2:
+                continue
+            first, last = self._year_span(self._n[:, i], lo, hi)
+            trends[name] = {
+                'slope_per_year': _rounded(fit['slope'][i], 6),
+                'slope_per_decade': _rounded(fit['slope'][i] * 10, 4),
+                'r_squared': _rounded(fit['r_squared'][i], 4),
+                'n_samples': int(fit['n_samples'][i]),
+                'period': f"{first}-{last}"
+            }
+
+        # Years where any requested dataset has data
+        present_rows = np.zeros(hi - lo, dtype=bool)
+        for i in present:
+            present_rows |= np.diff(self._n[lo:hi + 1, i]) > 0
+        row_years = np.flatnonzero(present_rows) + lo + self.first_year
+        return {
+            'correlations': correlations,
+            'trends': trends,
+            'period': f"{int(row_years[0])}-{int(row_years[-1])}" if len(row_years) else None,
+            'total_years': int(len(row_years))
+        }
+
+    def rolling_trends(self, window: int) -> Dict:
+        """Slope and R^2 of every window of `window` consecutive years, for all datasets at once."""
+        lo = np.arange(0, max(self.last_year - self.first_year + 2 - window, 0))
+        hi = lo + window
+        fit = self.trends(lo=lo, hi=hi)
+        return {
+            'start_years': (lo + self.first_year).tolist(),
+            'end_years': (hi - 1 + self.first_year).tolist(),
+            'slope': fit['slope'],
+            'r_squared': fit['r_squared'],
+            'n_samples': fit['n_samples']
+        }
@@ -17,6 +17,20 @@ class Config:
     DATA_DIR = Path(os.getenv('DATA_DIR', 'data'))
     RAW_DATA_DIR = DATA_DIR / 'raw'
     CLEAN_DATA_DIR = DATA_DIR / 'clean'
+    CACHE_DIR = DATA_DIR / 'cache'  # Parsed GHCN columns keyed by source file hash
+    
+    # GHCN Transform Configuration
+    GHCN_ENGINE = os.getenv('GHCN_ENGINE', 'wide')  # 'wide', 'chunked' (bounded memory) or 'long' (original melt-based path)
+    GHCN_GRID_SIZE = float(os.getenv('GHCN_GRID_SIZE', '5'))  # 1, 2.5 or 5 degrees
+    GHCN_QC_POLICY = os.getenv('GHCN_QC_POLICY', 'drop_any')  # 'drop_any', 'keep_all' or flags to drop, e.g. 'D,K,O'
+    GHCN_MEMORY_BUDGET_MB = int(os.getenv('GHCN_MEMORY_BUDGET_MB', '256'))  # Per-chunk working memory of the chunked engine
+    GHCN_CHUNK_WORKERS = int(os.getenv('GHCN_CHUNK_WORKERS', '1'))  # Processes for the chunked engine's chunks
+    GHCN_INCREMENTAL = os.getenv('GHCN_INCREMENTAL', 'False').lower() in ['true', '1', 'yes']  # Recompute only years whose station records changed
+    TRANSFORM_WORKERS = int(os.getenv('TRANSFORM_WORKERS', '1'))  # >1 runs the dataset transforms in a process pool
+    GHCN_STREAM = os.getenv('GHCN_STREAM', 'False').lower() in ['true', '1', 'yes']  # Parse the archive while downloading, never extracting the .dat
+    
+    # Analysis windows precomputed after each processing run ('start-end', open-ended 'start-', or 'lastN')
+    ANALYSIS_WINDOWS = os.getenv('ANALYSIS_WINDOWS', '1900-,1951-1980,1979-,last30')
     
     # Logging Configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
@@ -26,12 +40,16 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-key-change-in-production')
     DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() in ['true', '1', 'yes']
     
+    # Response Cache Configuration (seconds; 0 keeps /data cached until processing completes)
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+    
     
     @classmethod
     def init_directories(cls):
         """Initialize required directories."""
         cls.RAW_DATA_DIR.mkdir(parents=True, exist_ok=True)
         cls.CLEAN_DATA_DIR.mkdir(parents=True, exist_ok=True)
+        cls.CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
 class DevelopmentConfig(Config):
     """Development configuration."""
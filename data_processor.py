@@ -5,18 +5,28 @@ This module handles downloading, processing, and storing climate data
 independently from the web server.
 """
 
+import glob
+import hashlib
 import logging
+import os
 import sys
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional
+from functools import partial
+from typing import Callable, Dict, Optional
 
-from scripts.raw_data_extract import download_all_data
+from scripts.clean_store import ANOMALY_COLUMN
+from scripts.ghcn_incremental import STATE_FILE
+from scripts.ghcn_reader import DIGEST_SUFFIX, file_digest
+from scripts.raw_data_extract import FAILED, download_all_data
 from scripts.transform_gistemp_adjusted import transform_giss_data
 from scripts.transform_crutem_adjusted import transform_crutem_data
 from scripts.transform_ghcn_raw import transform_ghcn_data
+from analysis import parse_windows, precompute_windows
+from gridded import pack_gridded_products
 from database import get_db_manager
+from response_cache import response_cache
 from config import get_config
 
 # Get configuration
@@ -34,28 +44,70 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Raw inputs of each dataset, as glob patterns under the raw data folder
+RAW_INPUTS = {
+    'giss': ['giss_temp_data.csv'],
+    'crutem': ['crutem_temp_data.txt'],
+    'ghcn': ['ghcnm*/*.dat', 'ghcnm*/*.dat' + DIGEST_SUFFIX, 'ghcnm*/*.inv', 'landmask.dta'],
+}
+
+def input_fingerprints(dataset: str, settings: str = '') -> Dict[str, str]:
+    """Hash of each raw input file of a dataset, plus one of the settings that shape its output."""
+    fingerprints = {'settings': hashlib.sha256(settings.encode()).hexdigest()}
+    for pattern in RAW_INPUTS[dataset]:
+        for path in glob.glob(str(config.RAW_DATA_DIR / pattern)):
+            fingerprints[os.path.relpath(path, config.RAW_DATA_DIR)] = file_digest(path)
+    return fingerprints
+
+def run_transform(transform_func, with_stats: bool = False):
+    """Run one dataset transform and return (frame, stats).
+    
+    Module-level so it can be sent to worker processes; stats collects the
+    transform's counters (such as GHCN QC drops) when with_stats is set.
+    """
+    stats = {}
+    df = transform_func(stats=stats) if with_stats else transform_func()
+    return df, stats
+
 class DataProcessor:
     """Handles all climate data processing operations."""
     
-    def __init__(self, database_url: Optional[str] = None):
+    def __init__(self, database_url: Optional[str] = None,
+                 progress: Optional[Callable[[str, str, Optional[str]], None]] = None):
         self.data_dir = config.DATA_DIR
         self.db_manager = get_db_manager(database_url or config.DATABASE_URL)
+        self.progress = progress  # Called with (stage, status, message) as each stage starts and ends
+        self.last_status = None  # 'success', 'partial' or 'failure' of the last process_all run
+        self.last_message = None
         config.init_directories()
     
-    def download_data(self) -> bool:
-        """Download all climate datasets."""
+    def report(self, stage: str, status: str, message: Optional[str] = None):
+        """Pass stage progress to the progress callback, if any."""
+        if self.progress is not None:
+            try:
+                self.progress(stage, status, message)
+            except Exception as e:
+                logger.warning(f"Progress callback failed for {stage}: {e}")
+    
+    def download_data(self, force: bool = False) -> bool:
+        """Download all climate datasets; with force, unchanged files are fetched again."""
         start_time = datetime.utcnow()
+        self.report('download', 'running')
         try:
             logger.info("Starting data download...")
-            download_all_data()
-            logger.info("Data download completed successfully")
+            results = download_all_data(raw_dir=str(config.RAW_DATA_DIR), ghcn_stream=config.GHCN_STREAM,
+                                        cache_dir=str(config.CACHE_DIR), force=force)
+            summary = ", ".join(f"{name}: {status}" for name, status in results.items())
+            logger.info(f"Data download completed ({summary})")
             
+            # Failed sources that still have a previous copy leave the run partial
             self.db_manager.log_processing_run(
                 process_type='download',
-                status='success',
-                message='All datasets downloaded successfully',
+                status='partial' if FAILED in results.values() else 'success',
+                message=summary,
                 started_at=start_time
             )
+            self.report('download', 'partial' if FAILED in results.values() else 'success', summary)
             return True
             
         except Exception as e:
@@ -66,94 +118,255 @@ class DataProcessor:
                 message=str(e),
                 started_at=start_time
             )
+            self.report('download', 'failure', str(e))
             return False
     
-    def transform_and_store_data(self) -> Dict[str, bool]:
-        """Transform all downloaded datasets and store in database."""
+    def transform_and_store_data(self, workers: int = 1, force: bool = False) -> Dict[str, bool]:
+        """Transform all downloaded datasets and store in database.
+        
+        With workers > 1 the transforms run concurrently in a process pool;
+        their frames are stored one at a time in this process. Datasets whose
+        raw inputs and settings match the fingerprint of their last stored
+        run are skipped unless force is set.
+        """
+        # Settings folded into the raw fingerprints; the year cutoff moves every January
+        latest_year = datetime.utcnow().year - 1
+        settings = {
+            'giss': f'latest_year={latest_year}',
+            'crutem': f'latest_year={latest_year}',
+            'ghcn': f'latest_year={latest_year};grid_size={config.GHCN_GRID_SIZE};qc_policy={config.GHCN_QC_POLICY};'
+                    f'engine={config.GHCN_ENGINE}',
+        }
+        fingerprints = {dataset_name: input_fingerprints(dataset_name, dataset_settings)
+                        for dataset_name, dataset_settings in settings.items()}
+        # The GHCN transform reuses the file hashes instead of reading the files again
+        ghcn_digests = {str(config.RAW_DATA_DIR / source): digest
+                        for source, digest in fingerprints['ghcn'].items() if source != 'settings'}
+        
+        # Transforms read the same raw folder the fingerprints hash and write where the server reads
+        dirs = {'raw_dir': str(config.RAW_DATA_DIR), 'clean_dir': str(config.CLEAN_DATA_DIR)}
         transformations = [
-            ("giss", transform_giss_data, "data/clean/giss_anomalies_clean.csv"),
-            ("crutem", transform_crutem_data, "data/clean/crutem_anomalies_clean.csv"),
-            ("ghcn", transform_ghcn_data, "data/clean/ghcnm_anomalies_clean.csv")
+            ("giss", partial(transform_giss_data, **dirs), False),
+            ("crutem", partial(transform_crutem_data, **dirs), False),
+            ("ghcn", partial(transform_ghcn_data, grid_size=config.GHCN_GRID_SIZE, engine=config.GHCN_ENGINE,
+                             qc_policy=config.GHCN_QC_POLICY, memory_budget_mb=config.GHCN_MEMORY_BUDGET_MB,
+                             workers=config.GHCN_CHUNK_WORKERS, incremental=config.GHCN_INCREMENTAL and not force,
+                             cache_dir=str(config.CACHE_DIR), digests=ghcn_digests, **dirs), True)
         ]
         
         results = {}
         total_records = 0
+        started = {}
+        pending = {}
         
-        for dataset_name, transform_func, csv_path in transformations:
-            start_time = datetime.utcnow()
-            try:
-                logger.info(f"Transforming {dataset_name.upper()} data...")
-                
-                # Run transformation
-                transform_func()
-                
-                # Load the transformed data
-                df = pd.read_csv(csv_path)
-                
-                # Handle different column names for anomaly data
-                anomaly_col = 'anomaly (deg C)'
-                if anomaly_col not in df.columns:
-                    # Try alternative column names
-                    possible_cols = [col for col in df.columns if 'anomaly' in col.lower()]
-                    if possible_cols:
-                        anomaly_col = possible_cols[0]
+        published = self.db_manager.get_published_versions()
+        for dataset_name, _, _ in transformations:
+            stored = self.db_manager.get_fingerprints(dataset_name)
+            if force or dataset_name not in published or fingerprints[dataset_name] != stored:
+                continue
+            
+            logger.info(f"{dataset_name.upper()} inputs unchanged since the last run; skipping")
+            self.report(f'transform:{dataset_name}', 'skipped', 'Inputs unchanged')
+            results[dataset_name] = True
+            self.db_manager.log_processing_run(
+                process_type='transform',
+                status='skipped',
+                message=f'{dataset_name.upper()} inputs unchanged'
+            )
+        order = [entry[0] for entry in transformations]
+        transformations = [entry for entry in transformations if entry[0] not in results]
+        
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(transformations))) \
+            if workers > 1 and transformations else None
+        
+        try:
+            if pool is not None:
+                for dataset_name, transform_func, with_stats in transformations:
+                    logger.info(f"Transforming {dataset_name.upper()} data in a worker process...")
+                    self.report(f'transform:{dataset_name}', 'running')
+                    started[dataset_name] = datetime.utcnow()
+                    pending[dataset_name] = pool.submit(run_transform, transform_func, with_stats)
+            
+            for dataset_name, transform_func, with_stats in transformations:
+                start_time = started.get(dataset_name, datetime.utcnow())
+                try:
+                    # Run transformation, or collect it from its worker
+                    if pool is not None:
+                        df, stats = pending[dataset_name].result()
                     else:
-                        raise ValueError(f"No anomaly column found in {csv_path}")
-                
-                # Store in database
-                success = self.db_manager.store_climate_data(
-                    dataset=dataset_name,
-                    df=df,
-                    anomaly_col=anomaly_col
-                )
-                
-                if success:
-                    records_count = len(df)
-                    total_records += records_count
-                    logger.info(f"{dataset_name.upper()} data transformation and storage completed successfully ({records_count} records)")
-                    results[dataset_name] = True
+                        logger.info(f"Transforming {dataset_name.upper()} data...")
+                        self.report(f'transform:{dataset_name}', 'running')
+                        df, stats = run_transform(transform_func, with_stats)
+                    if 'qc_dropped' in stats:
+                        self.log_qc_report(dataset_name, stats['qc_dropped'], start_time)
+                    
+                    # Every transform returns its series in the clean store's fixed schema
+                    anomaly_col = ANOMALY_COLUMN
+                    
+                    # Store in database; an incremental run only writes the years it recomputed
+                    if 'changed_years' in stats:
+                        logger.info(f"{dataset_name.upper()} years recomputed incrementally: {stats['changed_years']}")
+                        success = self.db_manager.store_climate_updates(
+                            dataset=dataset_name,
+                            df=df,
+                            years=stats['changed_years'],
+                            anomaly_col=anomaly_col
+                        )
+                    else:
+                        success = self.db_manager.store_climate_data(
+                            dataset=dataset_name,
+                            df=df,
+                            anomaly_col=anomaly_col
+                        )
+                    
+                    if success:
+                        # Fingerprints only once every product is stored, so a failed store is retried next run
+                        if 'gridded' not in stats or \
+                                self.store_gridded_products(dataset_name, stats, published.get(dataset_name)):
+                            self.db_manager.store_fingerprints(dataset_name, fingerprints[dataset_name])
+                        else:
+                            # The incremental state would make the retry recompute no years; start it afresh
+                            state_path = config.CACHE_DIR / STATE_FILE
+                            if state_path.exists():
+                                state_path.unlink()
+                        records_count = len(df)
+                        total_records += records_count
+                        logger.info(f"{dataset_name.upper()} data transformation and storage completed successfully ({records_count} records)")
+                        results[dataset_name] = True
+                        self.report(f'transform:{dataset_name}', 'success', f'{records_count} records')
+                        
+                        self.db_manager.log_processing_run(
+                            process_type='transform',
+                            status='success',
+                            message=f'{dataset_name.upper()} data processed successfully',
+                            records_processed=records_count,
+                            started_at=start_time
+                        )
+                    else:
+                        raise Exception("Database storage failed")
+                        
+                except Exception as e:
+                    logger.error(f"{dataset_name.upper()} data transformation failed: {e}")
+                    results[dataset_name] = False
+                    self.report(f'transform:{dataset_name}', 'failure', str(e))
                     
                     self.db_manager.log_processing_run(
                         process_type='transform',
-                        status='success',
-                        message=f'{dataset_name.upper()} data processed successfully',
-                        records_processed=records_count,
+                        status='failure',
+                        message=f'{dataset_name.upper()}: {str(e)}',
                         started_at=start_time
                     )
-                else:
-                    raise Exception("Database storage failed")
-                    
-            except Exception as e:
-                logger.error(f"{dataset_name.upper()} data transformation failed: {e}")
-                results[dataset_name] = False
-                
-                self.db_manager.log_processing_run(
-                    process_type='transform',
-                    status='failure',
-                    message=f'{dataset_name.upper()}: {str(e)}',
-                    started_at=start_time
-                )
+        finally:
+            if pool is not None:
+                pool.shutdown()
         
-        return results
+        return {dataset_name: results[dataset_name] for dataset_name in order}
     
-    def process_all(self) -> bool:
-        """Run the complete data processing pipeline."""
+    def store_gridded_products(self, dataset_name: str, stats: Dict, previous_version: Optional[int]) -> bool:
+        """Store a transform's gridbox and monthly products under the dataset's published version.
+        
+        After an incremental run only the recomputed years are written; the
+        grids of the other years are carried over from previous_version. A
+        failure is logged but leaves the stored annual series in place.
+        """
+        gridded = stats['gridded']
+        version = self.db_manager.get_published_versions().get(dataset_name)
+        rows = pack_gridded_products(gridded['boxes'], gridded['monthly'], gridded['grid_size'])
+        years = stats.get('changed_years')
+        
+        stored = version is not None and self.db_manager.store_gridded_anomalies(
+            dataset_name, version, rows, years=years,
+            copy_from=previous_version if years is not None else None,
+            cell_countries=gridded.get('cell_countries')
+        )
+        if not stored:
+            logger.warning(f"{dataset_name.upper()} gridded products could not be stored")
+        return stored
+    
+    def log_qc_report(self, dataset_name: str, qc_dropped: Dict[str, int], started_at: datetime):
+        """Record how many values the QC flag policy dropped, per flag."""
+        total_dropped = sum(qc_dropped.values())
+        counts = ", ".join(f"{flag}={count}" for flag, count in sorted(qc_dropped.items())) or "none"
+        logger.info(f"{dataset_name.upper()} QC policy '{config.GHCN_QC_POLICY}' dropped {total_dropped} values ({counts})")
+        
+        self.db_manager.log_processing_run(
+            process_type='qc',
+            status='success',
+            message=f'{dataset_name.upper()} values dropped by QC flag: {counts}',
+            records_processed=total_dropped,
+            started_at=started_at
+        )
+    
+    def precompute_analysis(self, force: bool = False) -> bool:
+        """Compute and persist trends and correlations for the configured analysis windows.
+        
+        Nothing is recomputed if results for the published data already exist, unless force is set.
+        """
+        start_time = datetime.utcnow()
+        self.report('analysis', 'running')
+        try:
+            data_version = self.db_manager.get_data_version()
+            if not force and self.db_manager.get_analysis_results(data_version):
+                logger.info(f"Analysis windows for {data_version} are up to date")
+                self.report('analysis', 'skipped', 'Results up to date')
+                return True
+            windows = parse_windows(config.ANALYSIS_WINDOWS)
+            results = precompute_windows(self.db_manager.get_climate_frame(), windows)
+            
+            if not self.db_manager.store_analysis_results(data_version, results):
+                raise Exception("Database storage failed")
+            
+            self.db_manager.log_processing_run(
+                process_type='analysis',
+                status='success',
+                message=f'Precomputed {len(results)} analysis windows for {data_version}',
+                records_processed=len(results),
+                started_at=start_time
+            )
+            self.report('analysis', 'success', f'{len(results)} windows')
+            return True
+            
+        except Exception as e:
+            logger.error(f"Analysis precomputation failed: {e}")
+            self.db_manager.log_processing_run(
+                process_type='analysis',
+                status='failure',
+                message=str(e),
+                started_at=start_time
+            )
+            self.report('analysis', 'failure', str(e))
+            return False
+    
+    def finish_pipeline(self, status: str, message: str, started_at: datetime):
+        """Record the outcome of a process_all run, in the log table and on the processor."""
+        self.last_status, self.last_message = status, message
+        self.db_manager.log_processing_run(
+            process_type='complete',
+            status=status,
+            message=message,
+            started_at=started_at
+        )
+    
+    def process_all(self, workers: Optional[int] = None, force: bool = False) -> bool:
+        """Run the complete data processing pipeline.
+        
+        Unchanged sources are neither downloaded, transformed nor stored again unless force is set.
+        """
         start_time = datetime.utcnow()
         logger.info("Starting complete data processing pipeline")
         
         try:
             # Step 1: Download data
-            if not self.download_data():
-                self.db_manager.log_processing_run(
-                    process_type='complete',
-                    status='failure',
-                    message='Pipeline failed at download stage',
-                    started_at=start_time
-                )
+            if not self.download_data(force):
+                self.finish_pipeline('failure', 'Pipeline failed at download stage', start_time)
                 return False
             
             # Step 2: Transform and store data
-            results = self.transform_and_store_data()
+            results = self.transform_and_store_data(workers or config.TRANSFORM_WORKERS, force)
+            
+            # Step 3: Precompute standard /analyze windows for the published data
+            if any(results.values()):
+                self.precompute_analysis(force)
             
             # Determine overall success
             successful_datasets = [name for name, success in results.items() if success]
@@ -161,41 +374,28 @@ class DataProcessor:
             
             if all(results.values()):
                 logger.info("Complete data processing pipeline completed successfully")
-                self.db_manager.log_processing_run(
-                    process_type='complete',
-                    status='success',
-                    message=f'All datasets processed successfully: {", ".join(successful_datasets)}',
-                    started_at=start_time
-                )
+                self.finish_pipeline('success',
+                                     f'All datasets processed successfully: {", ".join(successful_datasets)}',
+                                     start_time)
                 return True
             elif successful_datasets:
                 logger.warning(f"Pipeline completed with partial success. Failed: {', '.join(failed_datasets)}")
-                self.db_manager.log_processing_run(
-                    process_type='complete',
-                    status='partial',
-                    message=f'Successful: {", ".join(successful_datasets)}. Failed: {", ".join(failed_datasets)}',
-                    started_at=start_time
-                )
+                self.finish_pipeline('partial',
+                                     f'Successful: {", ".join(successful_datasets)}. Failed: {", ".join(failed_datasets)}',
+                                     start_time)
                 return False
             else:
                 logger.error("Pipeline failed - no datasets processed successfully")
-                self.db_manager.log_processing_run(
-                    process_type='complete',
-                    status='failure',
-                    message='No datasets processed successfully',
-                    started_at=start_time
-                )
+                self.finish_pipeline('failure', 'No datasets processed successfully', start_time)
                 return False
                 
         except Exception as e:
             logger.error(f"Unexpected error in processing pipeline: {e}")
-            self.db_manager.log_processing_run(
-                process_type='complete',
-                status='failure',
-                message=f'Unexpected error: {str(e)}',
-                started_at=start_time
-            )
+            self.finish_pipeline('failure', f'Unexpected error: {str(e)}', start_time)
             return False
+        finally:
+            # Cached /data responses are stale once a run has completed
+            response_cache.invalidate()
 
 def main():
     """Entry point for standalone data processing."""
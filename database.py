@@ -3,13 +3,14 @@ Database models and operations for climate data storage.
 Supports SQLite for development and PostgreSQL for production (AWS RDS).
 """
 
+import json
 import logging
 from datetime import datetime
 from typing import List, Dict, Optional
-from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, Index
+from sqlalchemy import create_engine, Column, Integer, Float, String, Text, DateTime, LargeBinary, UniqueConstraint, delete, func, insert, inspect, literal, select, text, update
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 import pandas as pd
 
 logger = logging.getLogger(__name__)
@@ -22,14 +23,85 @@ class ClimateData(Base):
     
     id = Column(Integer, primary_key=True)
     dataset = Column(String(50), nullable=False)  # 'giss', 'crutem', 'ghcn'
+    version = Column(Integer, nullable=False, default=1)  # Processing run that wrote the row
     year = Column(Integer, nullable=False)
     anomaly = Column(Float, nullable=False)  # Temperature anomaly in degrees C
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    # Add indexes for performance
+    # One row per dataset version and year; also serves as the lookup index
     __table_args__ = (
-        Index('idx_dataset_year', 'dataset', 'year'),
+        UniqueConstraint('dataset', 'version', 'year', name='uq_dataset_version_year'),
+    )
+
+class DatasetVersion(Base):
+    """Model for tracking each stored version of a dataset."""
+    __tablename__ = 'dataset_versions'
+    
+    id = Column(Integer, primary_key=True)
+    dataset = Column(String(50), nullable=False)
+    version = Column(Integer, nullable=False)
+    records = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    published_at = Column(DateTime)  # Last time this version was made current
+    
+    __table_args__ = (
+        UniqueConstraint('dataset', 'version', name='uq_dataset_version'),
+    )
+
+class PublishedDataset(Base):
+    """Pointer to the version of each dataset that readers see."""
+    __tablename__ = 'published_datasets'
+    
+    dataset = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False)
+    published_at = Column(DateTime, default=datetime.utcnow)
+
+class GriddedAnomaly(Base):
+    """Model for one year of a gridded anomaly product, stored as packed arrays (see gridded.py)."""
+    __tablename__ = 'gridded_anomalies'
+    
+    id = Column(Integer, primary_key=True)
+    dataset = Column(String(50), nullable=False)
+    version = Column(Integer, nullable=False)  # Dataset version the grid belongs to
+    year = Column(Integer, nullable=False)
+    grid_size = Column(Float, nullable=False)  # Cell size in degrees
+    cells = Column(LargeBinary, nullable=False)  # int32 ids of the cells with data, ascending
+    values = Column(LargeBinary, nullable=False)  # float32 (cells x 12) monthly anomalies, NaN if missing
+    weights = Column(LargeBinary, nullable=False)  # float32 area and land weight of each cell
+    monthly = Column(LargeBinary, nullable=False)  # float32 global mean anomaly of each month
+    
+    __table_args__ = (
+        UniqueConstraint('dataset', 'version', 'year', name='uq_gridded_dataset_version_year'),
+    )
+
+class GridCellCountry(Base):
+    """Model for the grid cells holding stations of each country, used for regional queries."""
+    __tablename__ = 'grid_cell_countries'
+    
+    id = Column(Integer, primary_key=True)
+    dataset = Column(String(50), nullable=False)
+    version = Column(Integer, nullable=False)
+    country_code = Column(String(2), nullable=False)  # GHCN country prefix of the station ids
+    cell = Column(Integer, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint('dataset', 'version', 'country_code', 'cell', name='uq_grid_cell_country'),
+    )
+
+class AnalysisResult(Base):
+    """Model for precomputed /analyze results of a standard year window."""
+    __tablename__ = 'analysis_results'
+    
+    id = Column(Integer, primary_key=True)
+    data_version = Column(String(200), nullable=False)  # Published dataset versions the results were computed from
+    start_year = Column(Integer, nullable=False)
+    end_year = Column(Integer, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON trends, correlations and years per dataset
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint('data_version', 'start_year', 'end_year', name='uq_analysis_window'),
     )
 
 class ProcessingLog(Base):
@@ -37,18 +109,55 @@ class ProcessingLog(Base):
     __tablename__ = 'processing_logs'
     
     id = Column(Integer, primary_key=True)
-    process_type = Column(String(50), nullable=False)  # 'download', 'transform', 'complete'
-    status = Column(String(20), nullable=False)  # 'success', 'failure', 'partial'
+    process_type = Column(String(50), nullable=False)  # 'download', 'transform', 'qc', 'analysis', 'complete'
+    status = Column(String(20), nullable=False)  # 'success', 'failure', 'partial', 'skipped'
     message = Column(String(500))
     started_at = Column(DateTime, nullable=False)
     completed_at = Column(DateTime)
     records_processed = Column(Integer, default=0)
 
+class ProcessingJob(Base):
+    """Model for a background processing run requested through the API."""
+    __tablename__ = 'processing_jobs'
+    
+    id = Column(String(36), primary_key=True)  # UUID handed back to the caller
+    status = Column(String(20), nullable=False)  # 'queued', 'running', 'success', 'failure', 'partial'
+    stage = Column(String(50))  # Stage currently running
+    stages = Column(Text)  # JSON {stage: {'status': ..., 'message': ...}}
+    message = Column(String(500))
+    force = Column(Integer, default=0)
+    # 1 while the job is queued or running, NULL afterwards; the unique
+    # constraint lets only one job hold the slot across all server processes
+    active_slot = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)  # Refreshed while running; a stale heartbeat frees the slot
+    completed_at = Column(DateTime)
+    
+    __table_args__ = (
+        UniqueConstraint('active_slot', name='uq_processing_job_active'),
+    )
+
+class SourceFingerprint(Base):
+    """Content hash of one input or output of a dataset as of its last stored run."""
+    __tablename__ = 'source_fingerprints'
+    
+    id = Column(Integer, primary_key=True)
+    dataset = Column(String(50), nullable=False)
+    source = Column(String(200), nullable=False)  # Raw file path under the raw data folder, or 'settings'
+    digest = Column(String(64), nullable=False)  # sha256 hex digest
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint('dataset', 'source', name='uq_source_fingerprint'),
+    )
+
 class DatabaseManager:
     """Manages database connections and operations."""
     
-    def __init__(self, database_url: str = "sqlite:///climate_data.db"):
+    def __init__(self, database_url: str = "sqlite:///climate_data.db", keep_versions: int = 3):
         self.database_url = database_url
+        self.keep_versions = keep_versions  # Versions kept per dataset for rollback, including the published one
         self.engine = create_engine(database_url)
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
         
@@ -56,77 +165,598 @@ class DatabaseManager:
         """Create all database tables."""
         try:
             Base.metadata.create_all(bind=self.engine)
+            self._migrate_climate_data()
             logger.info("Database tables created successfully")
         except SQLAlchemyError as e:
             logger.error(f"Failed to create database tables: {e}")
             raise
     
+    def _migrate_climate_data(self):
+        """Bring climate_data tables from before dataset versioning up to date.
+        
+        The table gets the version column and the (dataset, version, year)
+        unique constraint, duplicate (dataset, year) rows are collapsed to the
+        most recent one, and the existing rows are published as version 1.
+        SQLite cannot drop a table constraint, so there the table is rebuilt;
+        elsewhere it is altered in place, which keeps the id sequence and the
+        primary key of the existing table.
+        """
+        columns = {column['name'] for column in inspect(self.engine).get_columns('climate_data')}
+        if 'version' in columns:
+            return
+        
+        with self.engine.begin() as conn:
+            if self.engine.dialect.name == 'sqlite':
+                self._rebuild_climate_data(conn)
+            else:
+                self._alter_climate_data(conn)
+            
+            now = datetime.utcnow()
+            counts = conn.execute(
+                select(ClimateData.dataset, func.count()).group_by(ClimateData.dataset)
+            ).all()
+            for dataset, count in counts:
+                conn.execute(DatasetVersion.__table__.insert().values(
+                    dataset=dataset, version=1, records=count, created_at=now, published_at=now))
+                conn.execute(PublishedDataset.__table__.insert().values(
+                    dataset=dataset, version=1, published_at=now))
+        logger.info("Migrated climate_data to versioned datasets")
+    
+    @staticmethod
+    def _rebuild_climate_data(conn):
+        """Recreate climate_data from the current model and copy the newest row of each (dataset, year)."""
+        conn.execute(text('ALTER TABLE climate_data RENAME TO climate_data_unversioned'))
+        ClimateData.__table__.create(conn)
+        # SQLite hands out new ids after the largest one, so copying ids keeps them unique
+        conn.execute(text(
+            'INSERT INTO climate_data (id, dataset, version, year, anomaly, created_at, updated_at) '
+            'SELECT id, dataset, 1, year, anomaly, created_at, updated_at FROM climate_data_unversioned '
+            'WHERE id IN (SELECT MAX(id) FROM climate_data_unversioned GROUP BY dataset, year)'
+        ))
+        conn.execute(text('DROP TABLE climate_data_unversioned'))
+    
+    @staticmethod
+    def _alter_climate_data(conn):
+        """Add the version column to climate_data in place and swap the (dataset, year) uniqueness."""
+        conn.execute(text('DELETE FROM climate_data WHERE id NOT IN '
+                          '(SELECT MAX(id) FROM climate_data GROUP BY dataset, year)'))
+        conn.execute(text('ALTER TABLE climate_data ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+        
+        # The unversioned table had a (dataset, year) unique constraint, unique index or plain index
+        for constraint in inspect(conn).get_unique_constraints('climate_data'):
+            if constraint['column_names'] == ['dataset', 'year']:
+                conn.execute(text(f'ALTER TABLE climate_data DROP CONSTRAINT {constraint["name"]}'))
+        for index in inspect(conn).get_indexes('climate_data'):
+            if index['column_names'] == ['dataset', 'year']:
+                conn.execute(text(f'DROP INDEX {index["name"]}'))
+        conn.execute(text('CREATE UNIQUE INDEX uq_dataset_version_year ON climate_data (dataset, version, year)'))
+    
     def get_session(self) -> Session:
         """Get a database session."""
         return self.SessionLocal()
     
     def store_climate_data(self, dataset: str, df: pd.DataFrame, year_col: str = 'year', 
-                          anomaly_col: str = 'anomaly (deg C)') -> bool:
-        """Store climate data from a pandas DataFrame."""
+                          anomaly_col: str = 'anomaly (deg C)', bulk: bool = True) -> bool:
+        """Store climate data from a pandas DataFrame as a new dataset version.
+        
+        The rows are written under a new version number while readers keep
+        seeing the published one, then the version is published with a
+        single pointer update. Loads identical to the published version are
+        skipped. A new version never holds rows yet, so with bulk=True the
+        rows go in as one plain executemany INSERT; otherwise they are added
+        through the ORM.
+        """
+        # Convert the frame to records once; rows without an anomaly cannot be stored
+        values = df[[year_col, anomaly_col]].dropna()
+        rows = {int(year): float(anomaly) for year, anomaly in values.itertuples(index=False, name=None)}
+        
         try:
             with self.get_session() as session:
-                # Clear existing data for this dataset
-                session.query(ClimateData).filter(ClimateData.dataset == dataset).delete()
+                if rows == self._published_rows(session, dataset):
+                    logger.info(f"Dataset {dataset} unchanged ({len(rows)} records), keeping published version")
+                    return True
                 
-                # Insert new data
-                records = []
-                for _, row in df.iterrows():
-                    record = ClimateData(
-                        dataset=dataset,
-                        year=int(row[year_col]),
-                        anomaly=float(row[anomaly_col])
-                    )
-                    records.append(record)
+                version = (session.scalar(
+                    select(func.max(DatasetVersion.version)).where(DatasetVersion.dataset == dataset)
+                ) or 0) + 1
+                now = datetime.utcnow()
+                records = [
+                    {'dataset': dataset, 'version': version, 'year': year, 'anomaly': anomaly,
+                     'created_at': now, 'updated_at': now}
+                    for year, anomaly in rows.items()
+                ]
                 
-                session.add_all(records)
+                if bulk and records:
+                    session.execute(insert(ClimateData), records)
+                else:
+                    session.add_all([ClimateData(**record) for record in records])
+                session.add(DatasetVersion(dataset=dataset, version=version, records=len(records), created_at=now))
                 session.commit()
+            
+            if not self.publish_version(dataset, version):
+                return False
+            self.prune_versions(dataset)
+            
+            logger.info(f"Stored {len(records)} records for dataset {dataset} (version {version})")
+            return True
+                
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to store climate data for {dataset}: {e}")
+            return False
+    
+    def store_climate_updates(self, dataset: str, df: pd.DataFrame, years: List[int], year_col: str = 'year',
+                              anomaly_col: str = 'anomaly (deg C)') -> bool:
+        """Store a new dataset version that differs from the published one only in `years`.
+        
+        The published rows of every other year are copied into the new version
+        inside the database; only the rows of `years` found in df are sent,
+        and published years missing from them are dropped. The whole
+        frame is stored instead if there is no published version or if the
+        published rows outside `years` do not match df.
+        """
+        years = sorted({int(year) for year in years})
+        values = df[[year_col, anomaly_col]].dropna()
+        frame_rows = {int(year): float(anomaly) for year, anomaly in values.itertuples(index=False, name=None)}
+        rows = {year: anomaly for year, anomaly in frame_rows.items() if year in years}
+        
+        published = self.get_published_versions().get(dataset)
+        if published is None:
+            return self.store_climate_data(dataset, df, year_col, anomaly_col)
+        
+        try:
+            with self.get_session() as session:
+                current = self._published_rows(session, dataset)
+                untouched = {year: anomaly for year, anomaly in frame_rows.items() if year not in rows}
+                if untouched != {year: anomaly for year, anomaly in current.items() if year not in years}:
+                    # The published version is not the one the update was computed against
+                    logger.warning(f"Published {dataset} rows differ outside the updated years; storing all rows")
+                    session.close()
+                    return self.store_climate_data(dataset, df, year_col, anomaly_col)
+                if all(current.get(year) == rows.get(year) for year in years):
+                    logger.info(f"Dataset {dataset} unchanged in {len(years)} updated years, keeping published version")
+                    return True
+                
+                version = (session.scalar(
+                    select(func.max(DatasetVersion.version)).where(DatasetVersion.dataset == dataset)
+                ) or 0) + 1
+                now = datetime.utcnow()
+                
+                # Copy the untouched years server-side, then write the updated ones
+                copied = select(
+                    ClimateData.dataset, literal(version), ClimateData.year, ClimateData.anomaly,
+                    literal(now), literal(now)
+                ).where(ClimateData.dataset == dataset, ClimateData.version == published,
+                        ClimateData.year.not_in(years))
+                session.execute(insert(ClimateData).from_select(
+                    ['dataset', 'version', 'year', 'anomaly', 'created_at', 'updated_at'], copied))
+                if rows:
+                    session.execute(insert(ClimateData), [
+                        {'dataset': dataset, 'version': version, 'year': year, 'anomaly': anomaly,
+                         'created_at': now, 'updated_at': now}
+                        for year, anomaly in rows.items()
+                    ])
                 
-                logger.info(f"Stored {len(records)} records for dataset {dataset}")
+                records = len(current) - sum(year in current for year in years) + len(rows)
+                session.add(DatasetVersion(dataset=dataset, version=version, records=records, created_at=now))
+                session.commit()
+            
+            if not self.publish_version(dataset, version):
+                return False
+            self.prune_versions(dataset)
+            
+            logger.info(f"Stored {len(rows)} updated records for dataset {dataset} (version {version})")
+            return True
+                
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to store climate data updates for {dataset}: {e}")
+            return False
+    
+    def _published_rows(self, session: Session, dataset: str) -> Dict[int, float]:
+        """Year -> anomaly mapping of the published version of a dataset."""
+        rows = session.execute(
+            select(ClimateData.year, ClimateData.anomaly)
+            .join(PublishedDataset, (PublishedDataset.dataset == ClimateData.dataset) &
+                  (PublishedDataset.version == ClimateData.version))
+            .where(ClimateData.dataset == dataset)
+        ).all()
+        return dict(rows)
+    
+    def publish_version(self, dataset: str, version: int) -> bool:
+        """Make a stored version the one readers see."""
+        try:
+            with self.get_session() as session:
+                if session.scalar(select(DatasetVersion.id).where(
+                        DatasetVersion.dataset == dataset, DatasetVersion.version == version)) is None:
+                    logger.error(f"Cannot publish unknown version {version} of dataset {dataset}")
+                    return False
+                
+                now = datetime.utcnow()
+                pointer = session.get(PublishedDataset, dataset)
+                if pointer is None:
+                    session.add(PublishedDataset(dataset=dataset, version=version, published_at=now))
+                else:
+                    pointer.version = version
+                    pointer.published_at = now
+                session.execute(update(DatasetVersion).where(
+                    DatasetVersion.dataset == dataset, DatasetVersion.version == version
+                ).values(published_at=now))
+                session.commit()
+                
+                logger.info(f"Published version {version} of dataset {dataset}")
                 return True
                 
         except SQLAlchemyError as e:
-            logger.error(f"Failed to store climate data for {dataset}: {e}")
+            logger.error(f"Failed to publish version {version} of {dataset}: {e}")
             return False
     
-    def get_climate_data(self, datasets: Optional[List[str]] = None) -> Dict:
-        """Retrieve climate data for visualization."""
+    def rollback_dataset(self, dataset: str, version: Optional[int] = None) -> bool:
+        """Republish an older version of a dataset (by default the one before the current)."""
+        try:
+            with self.get_session() as session:
+                if version is None:
+                    current = session.scalar(select(PublishedDataset.version).where(PublishedDataset.dataset == dataset))
+                    version = session.scalar(
+                        select(func.max(DatasetVersion.version))
+                        .where(DatasetVersion.dataset == dataset, DatasetVersion.version < (current or 0))
+                    )
+                if version is None:
+                    logger.error(f"No earlier version of dataset {dataset} to roll back to")
+                    return False
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to roll back dataset {dataset}: {e}")
+            return False
+        
+        return self.publish_version(dataset, version)
+    
+    def prune_versions(self, dataset: str) -> int:
+        """Delete all but the newest keep_versions versions of a dataset, never the published one."""
+        try:
+            with self.get_session() as session:
+                published = session.scalar(select(PublishedDataset.version).where(PublishedDataset.dataset == dataset))
+                versions = session.scalars(
+                    select(DatasetVersion.version).where(DatasetVersion.dataset == dataset)
+                    .order_by(DatasetVersion.version.desc())
+                ).all()
+                stale = [version for version in versions[self.keep_versions:] if version != published]
+                if not stale:
+                    return 0
+                
+                session.execute(delete(ClimateData).where(
+                    ClimateData.dataset == dataset, ClimateData.version.in_(stale)))
+                session.execute(delete(GriddedAnomaly).where(
+                    GriddedAnomaly.dataset == dataset, GriddedAnomaly.version.in_(stale)))
+                session.execute(delete(GridCellCountry).where(
+                    GridCellCountry.dataset == dataset, GridCellCountry.version.in_(stale)))
+                session.execute(delete(DatasetVersion).where(
+                    DatasetVersion.dataset == dataset, DatasetVersion.version.in_(stale)))
+                session.commit()
+                
+                logger.info(f"Pruned {len(stale)} old versions of dataset {dataset}")
+                return len(stale)
+                
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to prune versions of {dataset}: {e}")
+            return 0
+    
+    def get_published_versions(self) -> Dict[str, int]:
+        """Currently published version of each dataset."""
+        try:
+            with self.get_session() as session:
+                return dict(session.execute(select(PublishedDataset.dataset, PublishedDataset.version)).all())
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to get published versions: {e}")
+            return {}
+    
+    def get_data_version(self) -> str:
+        """Key identifying the currently published versions of all datasets."""
+        return ','.join(f"{dataset}:{version}" for dataset, version in sorted(self.get_published_versions().items()))
+    
+    def store_gridded_anomalies(self, dataset: str, version: int, rows: List[Dict],
+                                years: Optional[List[int]] = None, copy_from: Optional[int] = None,
+                                cell_countries: Optional[Dict[str, List[int]]] = None) -> bool:
+        """Store the gridded product of a dataset version, one packed row per year.
+        
+        By default rows replace every stored year of the version. With years,
+        only those years are replaced and the grids of all other years are
+        kept, or copied inside the database from version copy_from when the
+        update went into a new version. cell_countries, if given, replaces
+        the version's country -> cells mapping.
+        """
+        table = GriddedAnomaly.__table__
+        columns = ['dataset', 'version', 'year', 'grid_size', 'cells', 'values', 'weights', 'monthly']
         try:
             with self.get_session() as session:
-                query = session.query(ClimateData)
+                in_version = (GriddedAnomaly.dataset == dataset) & (GriddedAnomaly.version == version)
+                if years is None or (copy_from is not None and copy_from != version):
+                    session.execute(delete(GriddedAnomaly).where(in_version))
+                else:
+                    session.execute(delete(GriddedAnomaly).where(in_version, GriddedAnomaly.year.in_(years)))
                 
-                if datasets:
-                    query = query.filter(ClimateData.dataset.in_(datasets))
+                if years is not None and copy_from is not None and copy_from != version:
+                    copied = select(
+                        table.c.dataset, literal(version), table.c.year, table.c.grid_size,
+                        table.c.cells, table.c['values'], table.c.weights, table.c.monthly
+                    ).where(table.c.dataset == dataset, table.c.version == copy_from, table.c.year.not_in(years))
+                    session.execute(insert(GriddedAnomaly).from_select(columns, copied))
                 
-                results = query.order_by(ClimateData.year).all()
+                if rows:
+                    session.execute(insert(GriddedAnomaly), [
+                        {'dataset': dataset, 'version': version, **row} for row in rows
+                    ])
                 
-                # Organize data by dataset
-                data = {}
-                years = set()
+                if cell_countries is not None:
+                    session.execute(delete(GridCellCountry).where(
+                        GridCellCountry.dataset == dataset, GridCellCountry.version == version))
+                    records = [
+                        {'dataset': dataset, 'version': version, 'country_code': country, 'cell': int(cell)}
+                        for country, cells in cell_countries.items() for cell in cells
+                    ]
+                    if records:
+                        session.execute(insert(GridCellCountry), records)
+                session.commit()
                 
-                for record in results:
-                    if record.dataset not in data:
-                        data[record.dataset] = {}
-                    data[record.dataset][record.year] = record.anomaly
-                    years.add(record.year)
+                logger.info(f"Stored {len(rows)} gridded years for dataset {dataset} (version {version})")
+                return True
                 
-                # Convert to format expected by frontend
-                sorted_years = sorted(list(years))
-                response = {'years': sorted_years}
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to store gridded anomalies for {dataset}: {e}")
+            return False
+    
+    def get_gridded_anomalies(self, dataset: str) -> List[Dict]:
+        """Packed gridded rows of the published version of a dataset, ordered by year."""
+        try:
+            with self.get_session() as session:
+                rows = session.execute(
+                    select(GriddedAnomaly.year, GriddedAnomaly.grid_size, GriddedAnomaly.cells,
+                           GriddedAnomaly.values, GriddedAnomaly.weights, GriddedAnomaly.monthly)
+                    .join(PublishedDataset, (PublishedDataset.dataset == GriddedAnomaly.dataset) &
+                          (PublishedDataset.version == GriddedAnomaly.version))
+                    .where(GriddedAnomaly.dataset == dataset)
+                    .order_by(GriddedAnomaly.year)
+                ).all()
+                return [row._asdict() for row in rows]
                 
-                for dataset in data:
-                    response[dataset] = [data[dataset].get(year) for year in sorted_years]
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to get gridded anomalies for {dataset}: {e}")
+            return []
+    
+    def get_grid_cell_countries(self, dataset: str) -> Dict[str, List[int]]:
+        """Grid cells holding stations of each country in the published version of a dataset."""
+        try:
+            with self.get_session() as session:
+                rows = session.execute(
+                    select(GridCellCountry.country_code, GridCellCountry.cell)
+                    .join(PublishedDataset, (PublishedDataset.dataset == GridCellCountry.dataset) &
+                          (PublishedDataset.version == GridCellCountry.version))
+                    .where(GridCellCountry.dataset == dataset)
+                    .order_by(GridCellCountry.country_code, GridCellCountry.cell)
+                ).all()
+                countries = {}
+                for country, cell in rows:
+                    countries.setdefault(country, []).append(cell)
+                return countries
+                
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to get grid cell countries for {dataset}: {e}")
+            return {}
+    
+    def store_analysis_results(self, data_version: str, results: List[Dict]) -> bool:
+        """Replace the precomputed analysis windows with results for data_version."""
+        try:
+            with self.get_session() as session:
+                # Results of any other data version are stale
+                session.query(AnalysisResult).delete()
+                session.add_all([
+                    AnalysisResult(
+                        data_version=data_version,
+                        start_year=result['start_year'],
+                        end_year=result['end_year'],
+                        payload=json.dumps(result['payload'])
+                    )
+                    for result in results
+                ])
+                session.commit()
+                
+                logger.info(f"Stored {len(results)} precomputed analysis windows for {data_version}")
+                return True
                 
-                return response
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to store analysis results: {e}")
+            return False
+    
+    def get_analysis_results(self, data_version: str) -> List[Dict]:
+        """Precomputed analysis windows for data_version."""
+        try:
+            with self.get_session() as session:
+                rows = session.query(AnalysisResult).filter(AnalysisResult.data_version == data_version).all()
+                return [
+                    {'start_year': row.start_year, 'end_year': row.end_year, 'payload': json.loads(row.payload)}
+                    for row in rows
+                ]
+                
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to get analysis results: {e}")
+            return []
+    
+    def get_climate_frame(self, datasets: Optional[List[str]] = None, start_year: Optional[int] = None,
+                          end_year: Optional[int] = None) -> pd.DataFrame:
+        """Published anomalies as a year x dataset DataFrame (NaN where missing).
+        
+        Only (dataset, year, anomaly) is selected through Core, without
+        building ORM entities, and the optional year bounds are applied in
+        SQL. Raises SQLAlchemyError on database failures.
+        """
+        # Only the published version of each dataset is visible
+        stmt = select(ClimateData.dataset, ClimateData.year, ClimateData.anomaly).join(
+            PublishedDataset,
+            (PublishedDataset.dataset == ClimateData.dataset) &
+            (PublishedDataset.version == ClimateData.version)
+        )
+        if datasets:
+            stmt = stmt.where(ClimateData.dataset.in_(datasets))
+        if start_year is not None:
+            stmt = stmt.where(ClimateData.year >= start_year)
+        if end_year is not None:
+            stmt = stmt.where(ClimateData.year <= end_year)
+        
+        with self.engine.connect() as conn:
+            rows = conn.execute(stmt).all()
+        
+        frame = pd.DataFrame.from_records(rows, columns=['dataset', 'year', 'anomaly'])
+        return frame.pivot(index='year', columns='dataset', values='anomaly').sort_index()
+    
+    def get_climate_data(self, datasets: Optional[List[str]] = None, start_year: Optional[int] = None,
+                         end_year: Optional[int] = None) -> Dict:
+        """Retrieve climate data for visualization."""
+        try:
+            frame = self.get_climate_frame(datasets, start_year, end_year)
+            
+            # Convert to format expected by frontend, with None for missing years
+            response = {'years': frame.index.astype(int).tolist()}
+            for dataset in frame.columns:
+                values = frame[dataset].to_numpy()
+                response[dataset] = [None if value != value else float(value) for value in values]
+            
+            return response
                 
         except SQLAlchemyError as e:
             logger.error(f"Failed to retrieve climate data: {e}")
             return {'years': [], 'error': str(e)}
     
+    def claim_job(self, job_id: str, force: bool = False, stale_after: int = 300) -> Optional[Dict]:
+        """Register a queued job if no other job is active.
+        
+        Returns the new job, or None if another job holds the active slot.
+        A job whose heartbeat is older than stale_after seconds is assumed to
+        have died with its process and is marked failed first.
+        """
+        try:
+            with self.get_session() as session:
+                now = datetime.utcnow()
+                active = session.query(ProcessingJob).filter(ProcessingJob.active_slot == 1).first()
+                if active is not None and (now - (active.heartbeat_at or active.created_at)).total_seconds() > stale_after:
+                    logger.warning(f"Processing job {active.id} stopped reporting; marking it failed")
+                    active.status = 'failure'
+                    active.message = 'Job stopped reporting progress'
+                    active.active_slot = None
+                    active.completed_at = now
+                    session.commit()
+                
+                job = ProcessingJob(id=job_id, status='queued', stages=json.dumps({}), force=int(force),
+                                    active_slot=1, created_at=now, heartbeat_at=now)
+                session.add(job)
+                session.commit()
+                return self._job_dict(job)
+                
+        except IntegrityError:
+            return None
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to claim processing job: {e}")
+            raise
+    
+    def update_job(self, job_id: str, stage: Optional[str] = None, stage_status: Optional[str] = None,
+                   stage_message: Optional[str] = None, status: Optional[str] = None,
+                   message: Optional[str] = None) -> bool:
+        """Record job progress; also refreshes the heartbeat. A final status releases the active slot."""
+        try:
+            with self.get_session() as session:
+                job = session.get(ProcessingJob, job_id)
+                if job is None:
+                    return False
+                
+                now = datetime.utcnow()
+                job.heartbeat_at = now
+                if stage is not None:
+                    stages = json.loads(job.stages or '{}')
+                    stages[stage] = {'status': stage_status, 'message': stage_message}
+                    job.stages = json.dumps(stages)
+                    job.stage = stage
+                if status is not None:
+                    job.status = status
+                    if status == 'running' and job.started_at is None:
+                        job.started_at = now
+                    if status not in ('queued', 'running'):
+                        job.active_slot = None
+                        job.completed_at = now
+                        job.stage = None
+                if message is not None:
+                    job.message = message[:500]
+                session.commit()
+                return True
+                
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to update processing job {job_id}: {e}")
+            return False
+    
+    def get_job(self, job_id: Optional[str] = None) -> Optional[Dict]:
+        """A processing job by id; without an id the active job, else the most recent one."""
+        try:
+            with self.get_session() as session:
+                query = session.query(ProcessingJob)
+                if job_id is not None:
+                    job = query.filter(ProcessingJob.id == job_id).first()
+                else:
+                    job = query.filter(ProcessingJob.active_slot == 1).first() \
+                        or query.order_by(ProcessingJob.created_at.desc()).first()
+                return self._job_dict(job) if job is not None else None
+                
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to get processing job: {e}")
+            return None
+    
+    @staticmethod
+    def _job_dict(job: ProcessingJob) -> Dict:
+        def iso(value):
+            return value.isoformat() if value else None
+        
+        return {
+            'job_id': job.id,
+            'status': job.status,
+            'stage': job.stage,
+            'stages': json.loads(job.stages or '{}'),
+            'message': job.message,
+            'force': bool(job.force),
+            'created_at': iso(job.created_at),
+            'started_at': iso(job.started_at),
+            'heartbeat_at': iso(job.heartbeat_at),
+            'completed_at': iso(job.completed_at)
+        }
+    
+    def get_fingerprints(self, dataset: str) -> Dict[str, str]:
+        """Stored fingerprints of a dataset, keyed by source."""
+        try:
+            with self.get_session() as session:
+                return dict(session.execute(
+                    select(SourceFingerprint.source, SourceFingerprint.digest)
+                    .where(SourceFingerprint.dataset == dataset)
+                ).all())
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to get fingerprints of {dataset}: {e}")
+            return {}
+    
+    def store_fingerprints(self, dataset: str, fingerprints: Dict[str, str]) -> bool:
+        """Replace the fingerprints of a dataset with those of its latest stored run."""
+        try:
+            with self.get_session() as session:
+                existing = {
+                    row.source: row for row in
+                    session.query(SourceFingerprint).filter(SourceFingerprint.dataset == dataset).all()
+                }
+                for source, digest in fingerprints.items():
+                    if source in existing:
+                        existing.pop(source).digest = digest
+                    else:
+                        session.add(SourceFingerprint(dataset=dataset, source=source, digest=digest))
+                # Inputs that no longer exist, such as a superseded GHCN release
+                for row in existing.values():
+                    session.delete(row)
+                session.commit()
+                return True
+                
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to store fingerprints of {dataset}: {e}")
+            return False
+    
     def log_processing_run(self, process_type: str, status: str, message: str = None, 
                           records_processed: int = 0, started_at: datetime = None) -> bool:
         """Log a data processing run."""
@@ -0,0 +1,159 @@
+"""
+Storage format and in-memory index for gridded anomaly products.
+Each year of a gridded dataset is stored as packed arrays: the occupied
+cell ids, a (cells x 12) block of monthly box anomalies, the cells' area
+and land weights and the global monthly means. The GridStore unpacks all
+years into one dense (years x cells x 12) array so that map and drill-down
+queries are plain array indexing, and keeps per-cell weighted sums so that
+a regional series is one masked reduction.
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from scripts.gridding import cell_centers, grid_indices, grid_shape
+
+# Packed array dtypes (little-endian so blobs read the same on any host)
+CELL_DTYPE = '<i4'
+VALUE_DTYPE = '<f4'
+
+def _annual_mean(monthly: np.ndarray) -> np.ndarray:
+    # Mean over the months present in the last axis, NaN where none are
+    present = ~np.isnan(monthly)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(present, monthly, 0.0).sum(axis=-1) / present.sum(axis=-1)
+
+def pack_gridded_products(boxes: pd.DataFrame, monthly: pd.DataFrame, grid_size: float) -> List[Dict]:
+    """One row of packed arrays per year from aggregation.grid_reduce products."""
+    monthly_by_year = {
+        year: group for year, group in monthly.groupby('year')
+    }
+    rows = []
+    for year, group in boxes.groupby('year'):
+        cells, inverse = np.unique(group['cell'].to_numpy(), return_inverse=True)
+        values = np.full((len(cells), 12), np.nan, dtype=VALUE_DTYPE)
+        values[inverse, group['month'].to_numpy() - 1] = group['anomaly'].to_numpy()
+        weights = np.zeros(len(cells), dtype=VALUE_DTYPE)
+        weights[inverse] = group['weight'].to_numpy()
+
+        global_monthly = np.full(12, np.nan, dtype=VALUE_DTYPE)
+        if year in monthly_by_year:
+            months = monthly_by_year[year]
+            global_monthly[months['month'].to_numpy() - 1] = months['anomaly'].to_numpy()
+
+        rows.append({
+            'year': int(year),
+            'grid_size': float(grid_size),
+            'cells': cells.astype(CELL_DTYPE).tobytes(),
+            'values': values.tobytes(),
+            'weights': weights.tobytes(),
+            'monthly': global_monthly.tobytes(),
+        })
+    return rows
+
+class GridStore:
+    """All stored years of one gridded dataset, unpacked into dense arrays."""
+
+    def __init__(self, rows: List[Dict], countries: Optional[Dict[str, List[int]]] = None):
+        rows = sorted(rows, key=lambda row: row['year'])
+        self.grid_size = rows[0]['grid_size']
+        self.years = np.array([row['year'] for row in rows])
+        cells = [np.frombuffer(row['cells'], dtype=CELL_DTYPE) for row in rows]
+        self.cells = np.unique(np.concatenate(cells))
+
+        n_lat, n_lon = grid_shape(self.grid_size)
+        self.lat, self.lon = cell_centers(self.cells // n_lon, self.cells % n_lon, self.grid_size)
+
+        # values[year, cell, month]; a cell's weight depends only on its area and land fraction
+        self.values = np.full((len(rows), len(self.cells), 12), np.nan, dtype=np.float32)
+        self.weights = np.zeros(len(self.cells), dtype=np.float32)
+        self.monthly = np.full((len(rows), 12), np.nan, dtype=np.float32)
+        for i, (row, row_cells) in enumerate(zip(rows, cells)):
+            idx = np.searchsorted(self.cells, row_cells)
+            self.values[i, idx] = np.frombuffer(row['values'], dtype=VALUE_DTYPE).reshape(-1, 12)
+            self.weights[idx] = np.maximum(self.weights[idx], np.frombuffer(row['weights'], dtype=VALUE_DTYPE))
+            self.monthly[i] = np.frombuffer(row['monthly'], dtype=VALUE_DTYPE)
+
+        # Regional index: per (year, cell) sums of weight * anomaly and of weight over the
+        # months with data, so a region's annual mean weights its boxes as the global one does
+        present = ~np.isnan(self.values)
+        self.weighted_sums = np.where(present, self.values, 0.0).sum(axis=2, dtype=np.float64) * self.weights
+        self.weight_sums = present.sum(axis=2) * self.weights.astype(np.float64)
+
+        # Country code -> positions of the cells holding that country's stations
+        self.countries = {
+            country: np.flatnonzero(np.isin(self.cells, cells)) for country, cells in (countries or {}).items()
+        }
+
+    def cell_at(self, lat: float, lon: float) -> int:
+        """Cell id containing a coordinate, or -1 outside the grid."""
+        lat_idx, lon_idx = grid_indices([lat], [lon], self.grid_size)
+        if lat_idx[0] < 0:
+            return -1
+        return int(lat_idx[0]) * grid_shape(self.grid_size)[1] + int(lon_idx[0])
+
+    def year_grid(self, year: int, month: Optional[int] = None) -> Optional[Dict]:
+        """Anomaly of every cell with data in a year (annual mean of its months, or one month)."""
+        i = np.searchsorted(self.years, year)
+        if i >= len(self.years) or self.years[i] != year:
+            return None
+
+        anomaly = self.values[i, :, month - 1] if month else _annual_mean(self.values[i])
+        present = ~np.isnan(anomaly)
+        return {
+            'cells': self.cells[present],
+            'lat': self.lat[present],
+            'lon': self.lon[present],
+            'anomaly': anomaly[present],
+            'weight': self.weights[present],
+        }
+
+    def cell_series(self, cell: int) -> Optional[Dict]:
+        """Monthly and annual-mean anomalies of one cell for every stored year."""
+        j = np.searchsorted(self.cells, cell)
+        if j >= len(self.cells) or self.cells[j] != cell:
+            return None
+
+        monthly = self.values[:, j]
+        return {
+            'lat': float(self.lat[j]),
+            'lon': float(self.lon[j]),
+            'weight': float(self.weights[j]),
+            'years': self.years,
+            'annual': _annual_mean(monthly),
+            'monthly': monthly,
+        }
+
+    def region_mask(self, bbox: Optional[Sequence[float]] = None, lat_band: Optional[Sequence[float]] = None,
+                    countries: Optional[Sequence[str]] = None) -> np.ndarray:
+        """Cells whose centre lies in a bounding box and latitude band and that hold stations of the countries.
+
+        bbox is (west, south, east, north) in degrees; west > east selects a
+        box across the antimeridian. Every given criterion must hold.
+        """
+        mask = np.ones(len(self.cells), dtype=bool)
+        if bbox is not None:
+            west, south, east, north = bbox
+            in_lon = (self.lon >= west) & (self.lon <= east) if west <= east else (self.lon >= west) | (self.lon <= east)
+            mask &= in_lon & (self.lat >= south) & (self.lat <= north)
+        if lat_band is not None:
+            mask &= (self.lat >= lat_band[0]) & (self.lat <= lat_band[1])
+        if countries is not None:
+            in_countries = np.zeros(len(self.cells), dtype=bool)
+            for country in countries:
+                in_countries[self.countries.get(country, [])] = True
+            mask &= in_countries
+        return mask
+
+    def region_series(self, mask: np.ndarray) -> Dict:
+        """Weighted annual anomaly of the cells in mask for every stored year."""
+        weight = self.weight_sums @ mask
+        with np.errstate(invalid='ignore', divide='ignore'):
+            anomaly = (self.weighted_sums @ mask) / weight
+        return {
+            'years': self.years,
+            'anomaly': np.where(weight > 0, anomaly, np.nan),
+            'cells': (self.weight_sums[:, mask] > 0).sum(axis=1),
+        }
@@ -0,0 +1,68 @@
+"""
+Background processing jobs started through the API.
+A job runs the full pipeline on a worker thread and records its per-stage
+progress in the processing_jobs table. Only one job can be active at a
+time across all server processes; the database enforces this.
+"""
+
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A running job refreshes its heartbeat this often (seconds); a job that has
+# not reported for JOB_STALE_AFTER seconds is presumed dead and loses its slot
+HEARTBEAT_INTERVAL = 30
+JOB_STALE_AFTER = 300
+
+# One pipeline at a time in this process; the active slot covers the others
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='processing-job')
+
+def submit_processing_job(db_manager, force: bool = False) -> Tuple[Optional[Dict], bool]:
+    """Start a processing job unless one is already active.
+
+    Returns (job, created): the new job and True, or the job already in
+    progress and False.
+    """
+    job = db_manager.claim_job(str(uuid.uuid4()), force, JOB_STALE_AFTER)
+    if job is None:
+        return db_manager.get_job(), False
+
+    _executor.submit(run_processing_job, db_manager, job['job_id'], force)
+    logger.info(f"Queued processing job {job['job_id']}")
+    return job, True
+
+def run_processing_job(db_manager, job_id: str, force: bool = False):
+    """Run the pipeline for a claimed job, recording progress as it goes."""
+    # Imported here so the web server does not load the pipeline until it is needed
+    from data_processor import DataProcessor
+
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            db_manager.update_job(job_id)
+
+    def progress(stage, status, message=None):
+        db_manager.update_job(job_id, stage=stage, stage_status=status, stage_message=message)
+
+    threading.Thread(target=heartbeat, daemon=True, name=f'job-heartbeat-{job_id[:8]}').start()
+    db_manager.update_job(job_id, status='running')
+    try:
+        processor = DataProcessor(progress=progress)
+        ok = processor.process_all(force=force)
+
+        # This run's own summary decides between success, partial and failure; another
+        # process may have logged a newer run in the meantime
+        status = 'success' if ok else (processor.last_status or 'failure')
+        db_manager.update_job(job_id, status=status, message=processor.last_message)
+        logger.info(f"Processing job {job_id} finished: {status}")
+
+    except Exception as e:
+        logger.error(f"Processing job {job_id} failed: {e}")
+        db_manager.update_job(job_id, status='failure', message=str(e))
+    finally:
+        stop.set()
@@ -14,6 +14,10 @@ def main():
     parser = argparse.ArgumentParser(description='GHCN Climate Data Analysis')
     parser.add_argument('--process-data', action='store_true',
                        help='Run data processing (annual update)')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Worker processes for the dataset transforms (default: TRANSFORM_WORKERS)')
+    parser.add_argument('--force', action='store_true',
+                       help='Reprocess every dataset even if its sources are unchanged')
     parser.add_argument('--env', choices=['development', 'production', 'testing'],
                        default='development', help='Environment to run in')
     
@@ -36,7 +40,7 @@ def main():
         logger.info("Running data processing pipeline...")
         try:
             processor = DataProcessor()
-            success = processor.process_all()
+            success = processor.process_all(workers=args.workers, force=args.force)
             if not success:
                 logger.error("Data processing failed")
                 sys.exit(1)
@@ -0,0 +1,132 @@
+"""
+In-process cache of pre-serialized API responses and derived in-memory indexes.
+Entries hold the JSON body, its gzip encoding and a strong ETag, and are
+dropped when a processing run completes.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+class CachedResponse(NamedTuple):
+    """A serialized response body ready to be sent as-is."""
+    body: bytes
+    gzip_body: bytes
+    etag: str
+    mimetype: str
+    created: float
+
+def make_etag(*parts) -> str:
+    """Strong ETag derived from the given version markers."""
+    digest = hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return digest[:32]
+
+class ResponseCache:
+    """Thread-safe store of serialized responses keyed by name.
+
+    Each key is built at most once at a time, under its own lock, so a slow
+    build only holds back requests for the same key. The shared lock only
+    guards the dict lookups and inserts.
+    """
+
+    def __init__(self, ttl: float = 0):
+        self.ttl = ttl  # Seconds before an entry is rebuilt; 0 keeps entries until invalidated
+        self._entries: Dict[str, CachedResponse] = {}
+        self._values: Dict[str, tuple] = {}  # key -> (created, value) for objects built from the data
+        self._lock = threading.Lock()
+        self._build_locks: Dict[tuple, threading.Lock] = {}
+        self._generation = 0  # Bumped by invalidate, so builds started before it are not stored
+
+    def _build_lock(self, key: tuple) -> threading.Lock:
+        with self._lock:
+            return self._build_locks.setdefault(key, threading.Lock())
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.ttl) and time.monotonic() - created > self.ttl
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Return a live entry, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or self._expired(entry.created):
+            return None
+        return entry
+
+    def get_or_build(self, key: str, builder: Callable[[], Optional[tuple]],
+                     mimetype: str = 'application/json') -> Optional[CachedResponse]:
+        """Return the cached entry for key, building it if needed.
+
+        The builder returns (payload, etag) or None when the response should
+        not be cached (for example on a database error). Dict payloads are
+        serialized as compact JSON; bytes are stored unchanged.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+
+        with self._build_lock(('response', key)):
+            # Another request may have built the entry while we waited
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+
+            generation = self._generation
+            built = builder()
+            if built is None:
+                return None
+            payload, etag = built
+            body = payload if isinstance(payload, bytes) else json.dumps(payload, separators=(',', ':')).encode()
+            entry = CachedResponse(
+                body=body,
+                gzip_body=gzip.compress(body),
+                etag=etag,
+                mimetype=mimetype,
+                created=time.monotonic()
+            )
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = entry
+            logger.info(f"Cached response '{key}' ({len(body)} bytes, {len(entry.gzip_body)} gzipped)")
+            return entry
+
+    def get_or_build_value(self, key: str, builder: Callable[[], Any]) -> Any:
+        """Return an in-memory object derived from the data, building it if needed.
+
+        Values share the responses' TTL and invalidation. A builder result of
+        None is not cached.
+        """
+        with self._lock:
+            cached = self._values.get(key)
+        if cached is not None and not self._expired(cached[0]):
+            return cached[1]
+
+        with self._build_lock(('value', key)):
+            with self._lock:
+                cached = self._values.get(key)
+            if cached is not None and not self._expired(cached[0]):
+                return cached[1]
+
+            generation = self._generation
+            value = builder()
+            if value is not None:
+                with self._lock:
+                    if generation == self._generation:
+                        self._values[key] = (time.monotonic(), value)
+            return value
+
+    def invalidate(self):
+        """Drop every cached response and value."""
+        with self._lock:
+            self._entries.clear()
+            self._values.clear()
+            self._generation += 1
+        logger.info("Response cache invalidated")
+
+# Global response cache shared by the web server and in-process data processing
+response_cache = ResponseCache()
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+from scripts.gridding import grid_shape
+
+
+def weighted_mean(keys, values, weights=None):
+    """
+    Closed-form sum(w * a) / sum(w) for every distinct key.
+
+    Returns the sorted unique keys, the weighted means and the weight sums.
+    Each call is one segmented sum via np.bincount, so there is no Python
+    callback per group. Without weights this is a plain group mean. NaN
+    values are skipped like groupby().mean() does; a key whose values are
+    all NaN gets a NaN mean and a zero weight sum.
+    """
+    keys = np.asarray(keys)
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)
+    present = ~np.isnan(values)
+    weights = np.where(present, weights, 0.0)
+    values = np.where(present, values, 0.0)
+
+    groups, inverse = np.unique(keys, return_inverse=True)
+    weight_sums = np.bincount(inverse, weights=weights, minlength=len(groups))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.bincount(inverse, weights=weights * values, minlength=len(groups)) / weight_sums
+    return groups, means, weight_sums
+
+
+# Box keys encode (cell, month, year) as (cell * 12 + month - 1) * BOX_YEAR_SPAN + year
+# so partial sums from separate chunks share keys and can be merged directly
+BOX_YEAR_SPAN = 10000
+
+
+def box_sums(cell, month, year, values, weights):
+    """
+    Per-(cell, month, year) box sums of values and weights plus counts.
+
+    The sums are additive, so partials computed over separate chunks of
+    observations are combined with merge_box_sums before grid_reduce_sums.
+    """
+    keys = ((np.asarray(cell, dtype=np.int64) * 12 + (np.asarray(month, dtype=np.int64) - 1)) * BOX_YEAR_SPAN
+            + np.asarray(year, dtype=np.int64))
+    groups, inverse = np.unique(keys, return_inverse=True)
+    return {
+        'key': groups,
+        'sum': np.bincount(inverse, weights=np.asarray(values, dtype=np.float64), minlength=len(groups)),
+        'weight': np.bincount(inverse, weights=np.asarray(weights, dtype=np.float64), minlength=len(groups)),
+        'count': np.bincount(inverse, minlength=len(groups)).astype(np.float64),
+    }
+
+
+def merge_box_sums(parts):
+    # Add up partial box sums that may share keys
+    keys = np.concatenate([part['key'] for part in parts])
+    groups, inverse = np.unique(keys, return_inverse=True)
+    merged = {'key': groups}
+    for column in ('sum', 'weight', 'count'):
+        merged[column] = np.bincount(inverse, weights=np.concatenate([part[column] for part in parts]),
+                                     minlength=len(groups))
+    return merged
+
+
+def grid_reduce_sums(sums, grid_size=5.0):
+    """
+    Reduce box sums to box, monthly, annual and hemispheric series.
+
+    Each box's anomaly and weight are the plain means of its observations;
+    the boxes are then averaged with their weights per year-month, per year
+    and per hemisphere-year.
+    """
+    n_lat, n_lon = grid_shape(grid_size)
+
+    # Level 1: unweighted mean over the observations in each box
+    with np.errstate(invalid='ignore', divide='ignore'):
+        box_anom = sums['sum'] / sums['count']
+        box_weight = sums['weight'] / sums['count']
+    box_year = sums['key'] % BOX_YEAR_SPAN
+    box_month = (sums['key'] // BOX_YEAR_SPAN) % 12 + 1
+    box_cell = sums['key'] // (BOX_YEAR_SPAN * 12)
+
+    # Level 2: weighted means of the boxes
+    years, annual, _ = weighted_mean(box_year, box_anom, box_weight)
+    year_months, monthly, _ = weighted_mean(box_year * 12 + (box_month - 1), box_anom, box_weight)
+    north = box_cell // n_lon >= n_lat // 2
+    hemi_keys, hemi, _ = weighted_mean(box_year * 2 + north, box_anom, box_weight)
+
+    hemispheric = pd.DataFrame({'year': hemi_keys // 2, 'north': (hemi_keys % 2).astype(bool), 'anomaly': hemi})
+    hemispheric = hemispheric.pivot(index='year', columns='north', values='anomaly')
+    hemispheric = hemispheric.rename(columns={True: 'nh', False: 'sh'}).reindex(columns=['nh', 'sh'])
+
+    return {
+        'boxes': pd.DataFrame({'cell': box_cell, 'month': box_month, 'year': box_year,
+                               'anomaly': box_anom, 'weight': box_weight}),
+        'monthly': pd.DataFrame({'year': year_months // 12, 'month': year_months % 12 + 1,
+                                 'anomaly': monthly}),
+        'annual': pd.DataFrame({'year': years, 'anomaly (deg C)': annual}),
+        'hemispheric': hemispheric.reset_index().rename_axis(columns=None),
+    }
+
+
+def grid_reduce(cell, month, year, values, weights, grid_size=5.0):
+    """
+    Reduce gridded observations to box, monthly, annual and hemispheric series.
+
+    `cell`, `month` (1-12), `year`, `values` and `weights` are parallel 1-D
+    arrays with one entry per observation. Observations are first averaged
+    per (cell, month, year) box; the boxes are then averaged with their
+    weights per year-month, per year and per hemisphere-year.
+    """
+    return grid_reduce_sums(box_sums(cell, month, year, values, weights), grid_size)
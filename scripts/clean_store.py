@@ -0,0 +1,176 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+
+CLEAN_DIR = os.path.join('data', 'clean')
+
+# Column holding the annual anomaly in every dataset series
+ANOMALY_COLUMN = 'anomaly (deg C)'
+
+# Fixed schema of each table as (column, dtype); 'float32[12]' is one
+# (rows, 12) column of monthly values
+SERIES_SCHEMA = (('year', 'int32'), (ANOMALY_COLUMN, 'float64'))
+SCHEMAS = {
+    'giss': SERIES_SCHEMA,
+    'crutem': SERIES_SCHEMA,
+    'ghcn': SERIES_SCHEMA,
+    # QC-masked monthly values of every GHCN station-year, sorted by station and year
+    'ghcn_records': (('station', 'S11'), ('year', 'int16'), ('values', 'float32[12]')),
+    # Grid cell, weight and 1961-1990 monthly baselines of every GHCN station
+    'ghcn_stations': (('station', 'S11'), ('cell', 'int32'), ('grid_weight', 'float64'),
+                      ('baselines', 'float32[12]')),
+}
+
+# Arrow IPC files (uncompressed, so they can be memory-mapped) when pyarrow
+# is installed, uncompressed .npz otherwise
+ARROW_SUFFIX = '.arrow'
+NPZ_SUFFIX = '.npz'
+
+
+def _split_dtype(dtype):
+    # 'float32[12]' -> ('float32', 12); 'int16' -> ('int16', None)
+    if dtype.endswith(']'):
+        base, width = dtype[:-1].split('[')
+        return base, int(width)
+    return dtype, None
+
+
+def conform(name, data):
+    """
+    Cast a frame or dict of arrays to the fixed schema of table `name`.
+
+    Returns a dict of NumPy arrays in schema order. Raises ValueError if a
+    column is missing or the columns have different lengths.
+    """
+    schema = SCHEMAS[name]
+    missing = [column for column, _ in schema if column not in data]
+    if missing:
+        raise ValueError(f"{name} table is missing columns {missing}")
+
+    columns = {}
+    for column, dtype in schema:
+        base, width = _split_dtype(dtype)
+        values = np.asarray(data[column], dtype=base)
+        if width is not None:
+            values = values.reshape(-1, width)
+        columns[column] = values
+    if len({len(values) for values in columns.values()}) > 1:
+        raise ValueError(f"{name} table columns have different lengths")
+    return columns
+
+
+def _to_arrow(values, dtype):
+    base, width = _split_dtype(dtype)
+    if base.startswith('S'):
+        return pa.array(values, type=pa.binary(int(base[1:])))
+    if width is not None:
+        return pa.FixedSizeListArray.from_arrays(pa.array(values.ravel()), width)
+    return pa.array(values)
+
+
+def _from_arrow(array, dtype):
+    # Views of the Arrow buffers; nothing is copied for a single-chunk column
+    base, width = _split_dtype(dtype)
+    if base.startswith('S'):
+        if len(array) == 0:
+            return np.empty(0, dtype=base)
+        values = np.frombuffer(array.buffers()[1], dtype=base, count=len(array) + array.offset)
+        return values[array.offset:]
+    if width is not None:
+        values = array.flatten().to_numpy(zero_copy_only=True)
+        return values.reshape(-1, width)
+    return array.to_numpy(zero_copy_only=True)
+
+
+def table_path(name, clean_dir=CLEAN_DIR, suffix=None):
+    # File of a table in the format this environment writes
+    suffix = suffix or (ARROW_SUFFIX if pa is not None else NPZ_SUFFIX)
+    return os.path.join(clean_dir, name + suffix)
+
+
+def write_table(name, data, clean_dir=CLEAN_DIR):
+    """
+    Write a table with its fixed schema and return the conformed columns.
+
+    The file is written under a temporary name and renamed into place, and
+    a copy of the table in the other format is removed so readers never see
+    a stale one.
+    """
+    columns = conform(name, data)
+    os.makedirs(clean_dir, exist_ok=True)
+    path = table_path(name, clean_dir)
+    tmp_path = path + '.tmp'
+
+    if pa is not None:
+        table = pa.table({column: _to_arrow(columns[column], dtype) for column, dtype in SCHEMAS[name]})
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    else:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **columns)
+    os.replace(tmp_path, path)
+
+    for suffix in (ARROW_SUFFIX, NPZ_SUFFIX):
+        other = table_path(name, clean_dir, suffix)
+        if other != path and os.path.exists(other):
+            os.remove(other)
+    return columns
+
+
+def remove_table(name, clean_dir=CLEAN_DIR):
+    # Delete a table in either format; readers then see it as never written
+    for suffix in (ARROW_SUFFIX, NPZ_SUFFIX):
+        path = table_path(name, clean_dir, suffix)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def read_columns(name, clean_dir=CLEAN_DIR):
+    """
+    Read a table as a dict of NumPy arrays, or None if it was never written.
+
+    Arrow files are memory-mapped and the arrays are views of the mapping,
+    so opening even the station tables costs almost nothing until the
+    values are touched. The .npz fallback is read into memory.
+    """
+    arrow_path = table_path(name, clean_dir, ARROW_SUFFIX)
+    if pa is not None and os.path.exists(arrow_path):
+        table = ipc.open_file(pa.memory_map(arrow_path, 'r')).read_all()
+        columns = {}
+        for column, dtype in SCHEMAS[name]:
+            chunked = table.column(column)
+            array = chunked.chunk(0) if chunked.num_chunks == 1 else chunked.combine_chunks()
+            columns[column] = _from_arrow(array, dtype)
+        return columns
+
+    npz_path = table_path(name, clean_dir, NPZ_SUFFIX)
+    if os.path.exists(npz_path):
+        with np.load(npz_path) as stored:
+            return {column: stored[column] for column, _ in SCHEMAS[name]}
+    return None
+
+
+def as_frame(columns):
+    # Flat DataFrame of a table; monthly columns become '<column>_01' .. '<column>_12'
+    flat = {}
+    for column, values in columns.items():
+        if values.ndim == 2:
+            for month in range(values.shape[1]):
+                flat[f'{column}_{month + 1:02d}'] = values[:, month]
+        else:
+            flat[column] = values
+    return pd.DataFrame(flat)
+
+
+def read_table(name, clean_dir=CLEAN_DIR):
+    # DataFrame of a table, or None if it was never written
+    columns = read_columns(name, clean_dir)
+    return None if columns is None else as_frame(columns)
@@ -0,0 +1,177 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scripts.aggregation import box_sums, grid_reduce_sums, merge_box_sums
+from scripts.ghcn_reader import RECORD_WIDTH, apply_qc_policy, decode_buffer, exact_degrees
+from scripts.ghcn_wide import BASELINE_END, BASELINE_START
+
+# Rough peak working memory per record while a chunk is decoded and reduced
+# (raw bytes, int32 digit arrays, float values, flags and long-form indices)
+BYTES_PER_RECORD = 2048
+
+
+# Per-station arrays set in each worker (or this process) by _init_worker
+_worker_state = {}
+
+
+def chunk_ranges(path, memory_budget_mb=256):
+    """
+    Split a .dat file into (offset, length) byte ranges of whole lines.
+
+    Each range holds at most as many records as fit in the memory budget,
+    so peak memory per chunk does not grow with the size of the file.
+    """
+    records = max(1, memory_budget_mb * 1024 * 1024 // BYTES_PER_RECORD)
+    target = records * (RECORD_WIDTH + 1)
+    size = os.path.getsize(path)
+
+    ranges = []
+    with open(path, 'rb') as f:
+        start = 0
+        while start < size:
+            # Extend each range to the end of the line it would cut
+            f.seek(min(start + target, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end - start))
+            start = end
+    return ranges
+
+
+def _read_chunk(path, offset, length, station_ids, qc_policy):
+    # Decode one byte range and look up each record's station in the sorted metadata ids
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        columns = decode_buffer(np.frombuffer(f.read(length), dtype=np.uint8))
+
+    qc_dropped = apply_qc_policy(columns['values'], columns['qcflag'], qc_policy)
+    if len(station_ids) == 0:
+        # No station was gridded (none inside the landmask), so no record is kept
+        no_records = np.zeros(0, dtype=np.int64)
+        return no_records, no_records, exact_degrees(columns['values'][:0]), qc_dropped
+
+    pos = np.searchsorted(station_ids, columns['station'])
+    pos = np.minimum(pos, len(station_ids) - 1)
+    known = station_ids[pos] == columns['station']
+    values = exact_degrees(columns['values'][known])
+    return pos[known], columns['year'][known].astype(np.int64), values, qc_dropped
+
+
+def baseline_sums(path, offset, length, station_ids, qc_policy,
+                  start=BASELINE_START, end=BASELINE_END):
+    """
+    First pass over one chunk: per-station, per-month baseline sums and counts.
+
+    Returns two (n_stations, 12) arrays that are added across chunks and
+    the chunk's first and last year.
+    """
+    station_idx, years, values, _ = _read_chunk(path, offset, length, station_ids, qc_policy)
+    in_base = (years >= start) & (years <= end)
+    base_values = values[in_base]
+    present = ~np.isnan(base_values)
+
+    keys = (station_idx[in_base][:, None] * 12 + np.arange(12)).ravel()
+    n = len(station_ids) * 12
+    sums = np.bincount(keys, weights=np.where(present, base_values, 0.0).ravel(), minlength=n)
+    counts = np.bincount(keys, weights=present.ravel(), minlength=n)
+    year_range = (int(years.min()), int(years.max())) if len(years) else None
+    return sums.reshape(-1, 12), counts.reshape(-1, 12), year_range
+
+
+def anomaly_box_sums(path, offset, length, station_ids, baselines, station_cell, station_weight, qc_policy):
+    """
+    Second pass over one chunk: anomalies reduced to (cell, month, year) box sums.
+
+    Returns the box sums (see aggregation.box_sums) and the QC drop counts.
+    """
+    station_idx, years, values, qc_dropped = _read_chunk(path, offset, length, station_ids, qc_policy)
+    anomalies = values - baselines[station_idx]
+    rec, month = np.nonzero(~np.isnan(anomalies))
+    station_idx = station_idx[rec]
+
+    sums = box_sums(station_cell[station_idx], month + 1, years[rec], anomalies[rec, month],
+                    station_weight[station_idx])
+    return sums, qc_dropped
+
+
+def _init_worker(station_ids, baselines, station_cell, station_weight):
+    # Ship the per-station arrays once per worker rather than once per chunk
+    _worker_state.update(station_ids=station_ids, baselines=baselines,
+                         station_cell=station_cell, station_weight=station_weight)
+
+
+def _worker_baseline_sums(path, offset, length, qc_policy):
+    return baseline_sums(path, offset, length, _worker_state['station_ids'], qc_policy)
+
+
+def _worker_anomaly_box_sums(path, offset, length, qc_policy):
+    state = _worker_state
+    return anomaly_box_sums(path, offset, length, state['station_ids'], state['baselines'],
+                            state['station_cell'], state['station_weight'], qc_policy)
+
+
+def _map_chunks(func, path, ranges, qc_policy, workers, initargs):
+    # Yield one result per chunk, in order, from this process or a worker pool
+    if workers <= 1:
+        _init_worker(*initargs)
+        for offset, length in ranges:
+            yield func(path, offset, length, qc_policy)
+        _worker_state.clear()
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+        futures = [pool.submit(func, path, offset, length, qc_policy) for offset, length in ranges]
+        for future in futures:
+            yield future.result()
+
+
+def chunked_anomalies(dat_path, station_ids, station_cell, station_weight, grid_size=5.0,
+                      qc_policy='keep_all', stats=None, memory_budget_mb=256, workers=1):
+    """
+    Gridded anomalies from a .dat file read in bounded-memory chunks.
+
+    station_ids must be the sorted S11 ids of the gridded stations, with
+    their cells and weights in the same order. Pass 1 accumulates station
+    baselines; pass 2 reduces each chunk's anomalies to box sums, which are
+    merged into running totals as they arrive. Only per-station arrays and
+    the totals of the occupied (cell, month, year) boxes are held for the
+    whole file, so memory is set by the budget and the boxes with data
+    rather than the number of records. Chunks run on up to `workers`
+    processes.
+
+    Returns the same products as aggregation.grid_reduce.
+    """
+    ranges = chunk_ranges(dat_path, memory_budget_mb)
+    n_stations = len(station_ids)
+
+    sums = np.zeros((n_stations, 12))
+    counts = np.zeros((n_stations, 12))
+    has_records = False
+    initargs = (station_ids, None, station_cell, station_weight)
+    for chunk_sums, chunk_counts, year_range in _map_chunks(_worker_baseline_sums, dat_path, ranges,
+                                                            qc_policy, workers, initargs):
+        sums += chunk_sums
+        counts += chunk_counts
+        has_records = has_records or year_range is not None
+    with np.errstate(invalid='ignore', divide='ignore'):
+        baselines = sums / counts
+    merged = box_sums([], [], [], [], [])
+    if not has_records:
+        if stats is not None:
+            stats.update(qc_dropped={}, chunks=len(ranges))
+        return grid_reduce_sums(merged, grid_size)
+
+    qc_dropped = {}
+    initargs = (station_ids, baselines, station_cell, station_weight)
+    for chunk_box_sums, chunk_dropped in _map_chunks(_worker_anomaly_box_sums, dat_path, ranges,
+                                                     qc_policy, workers, initargs):
+        merged = merge_box_sums([merged, chunk_box_sums])
+        for flag, count in chunk_dropped.items():
+            qc_dropped[flag] = qc_dropped.get(flag, 0) + count
+
+    if stats is not None:
+        stats['qc_dropped'] = qc_dropped
+        stats['chunks'] = len(ranges)
+    return grid_reduce_sums(merged, grid_size)
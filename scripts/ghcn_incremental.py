@@ -0,0 +1,86 @@
+import hashlib
+import os
+
+import numpy as np
+
+from scripts.ghcn_wide import BASELINE_END, BASELINE_START
+
+# State of the last wide GHCN run, kept next to the parsed-column cache
+STATE_FILE = 'ghcn_state.npz'
+
+
+def inputs_key(file_digests, *settings):
+    # Everything besides the station records that the baselines and weights depend on:
+    # the sha256 of the metadata and landmask files, and the settings
+    digest = hashlib.sha256('|'.join(str(setting) for setting in settings).encode())
+    for file_hash in file_digests:
+        digest.update(file_hash.encode())
+    return digest.hexdigest()
+
+
+def year_digests(years, station, values):
+    """
+    sha256 of each year's station records.
+
+    Returns the sorted distinct years and an S64 array of hex digests, one
+    per year, covering the station ids and (QC-masked) values of that year
+    in file order.
+    """
+    if len(years) == 0:
+        return np.asarray(years)[:0], np.empty(0, dtype='S64')
+    order = np.argsort(years, kind='stable')
+    sorted_years = years[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_years)) + 1]
+    ends = np.r_[starts[1:], len(sorted_years)]
+
+    station = station[order]
+    values = values[order]
+    digests = []
+    for start, end in zip(starts, ends):
+        digest = hashlib.sha256(station[start:end].tobytes())
+        digest.update(values[start:end].tobytes())
+        digests.append(digest.hexdigest())
+    return sorted_years[starts], np.array(digests, dtype='S64')
+
+
+def load_state(path):
+    # None if there is no usable state from an earlier run
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as state:
+        return {key: state[key] for key in state.files}
+
+
+def save_state(path, **arrays):
+    # Write under a temporary name so an interrupted run never leaves a partial state
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def changed_years(state, key, years, digests, latest_year):
+    """
+    Years whose records differ from the stored state, including added and removed years.
+
+    Years up to latest_year that the stored run excluded as incomplete (the
+    year cutoff moves every January) count as changed too, so they are
+    published even if their records are unchanged.
+
+    Returns None when the stored state cannot be reused: there is none, it
+    holds no stations (an empty release), it was built from different
+    metadata, landmask or settings, or a changed year falls in the baseline
+    period, so the station baselines themselves would change.
+    """
+    if state is None or 'latest_year' not in state or len(state['stations']) == 0 \
+            or str(state['inputs_key']) != key:
+        return None
+
+    previous = dict(zip(state['digest_years'].tolist(), state['digests'].tolist()))
+    current = dict(zip(years.tolist(), digests.tolist()))
+    newly_eligible = {year for year in current if int(state['latest_year']) < year <= latest_year}
+    changed = sorted(year for year in previous.keys() | current.keys()
+                     if previous.get(year) != current.get(year) or year in newly_eligible)
+    if any(BASELINE_START <= year <= BASELINE_END for year in changed):
+        return None
+    return changed
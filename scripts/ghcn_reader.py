@@ -0,0 +1,381 @@
+import contextlib
+import glob
+import hashlib
+import os
+import queue
+import shutil
+import tarfile
+import threading
+import urllib.request
+
+import numpy as np
+
+# GHCN-M v4 .dat layout: ID (11) YEAR (4) ELEMENT (4), then for each month
+# VALUE (5) DMFLAG (1) QCFLAG (1) DSFLAG (1), 115 bytes in total
+RECORD_WIDTH = 115
+VALUE_OFFSET = 19
+MONTH_WIDTH = 8
+MISSING_VALUE = -9999
+FLAG_NAMES = ('dmflag', 'qcflag', 'dsflag')
+
+# Decoded columns of a .dat are cached as 'ghcnm_<digest>.npz'; only the
+# release being read is kept
+CACHE_PREFIX = 'ghcnm_'
+
+# Written in place of a streamed .dat: '<name>.dat.sha256' holds the digest
+# of the .dat, whose decoded columns live in the cache
+DIGEST_SUFFIX = '.sha256'
+
+# QC flag policies: keep every value, drop any value with a QC flag, or
+# drop values whose QC flag is in an explicit set such as 'DKO'
+KEEP_ALL = 'keep_all'
+DROP_ANY = 'drop_any'
+
+_MONTH_STARTS = VALUE_OFFSET + MONTH_WIDTH * np.arange(12)
+_VALUE_COLUMNS = _MONTH_STARTS[:, None] + np.arange(5)
+_DIGIT_PLACES = np.array([10000, 1000, 100, 10, 1], dtype=np.int32)
+_YEAR_PLACES = np.array([1000, 100, 10, 1], dtype=np.int32)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    # sha256 of a file, read in chunks so large files never sit in memory
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def decode_records(rows):
+    """
+    Decode an (n, >=115) uint8 array of fixed-width records into columns.
+
+    Values are returned in degrees C as float32 with NaN for missing months.
+    Records with a malformed year are dropped.
+    """
+    station = np.ascontiguousarray(rows[:, :11]).view('S11').ravel()
+
+    year_chars = rows[:, 11:15].astype(np.int32) - 48
+    year_ok = ((year_chars >= 0) & (year_chars <= 9)).all(axis=1)
+    year = (year_chars @ _YEAR_PLACES).astype(np.int16)
+
+    # Right-aligned signed integers in hundredths of a degree
+    chars = rows[:, _VALUE_COLUMNS]
+    digits = chars.astype(np.int32) - 48
+    digits = np.where((digits >= 0) & (digits <= 9), digits, 0)
+    hundredths = digits @ _DIGIT_PLACES
+    hundredths = np.where((chars == ord('-')).any(axis=2), -hundredths, hundredths)
+
+    values = hundredths.astype(np.float32) / np.float32(100)
+    values[hundredths == MISSING_VALUE] = np.nan
+
+    columns = {'station': station[year_ok], 'year': year[year_ok], 'values': values[year_ok]}
+    for offset, flag in enumerate(FLAG_NAMES):
+        columns[flag] = rows[:, _MONTH_STARTS + 5 + offset][year_ok]
+    return columns
+
+
+def exact_degrees(values):
+    """
+    Widen decoded float32 values to float64 equal to the file's hundredths / 100.
+
+    The decoded columns stay float32 to halve their memory and cache size;
+    the engines widen them with this before any baseline or anomaly math,
+    so they compute on the same values as a float64 parse of the file.
+    """
+    return np.round(values.astype(np.float64) * 100) / 100
+
+
+def _concat(parts):
+    # No parts (an empty .dat) still gives typed, zero-length columns
+    if not parts:
+        return decode_records(np.zeros((0, RECORD_WIDTH), dtype=np.uint8))
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+def decode_buffer(buf):
+    """
+    Decode a uint8 buffer holding whole GHCN-M v4 .dat lines.
+
+    Every record has the same width, so the buffer is viewed as a 2-D byte
+    array and all fields are decoded with vectorized slicing. Buffers whose
+    lines are not uniformly sized fall back to padding each line.
+    """
+    if len(buf) == 0:
+        return decode_records(np.zeros((0, RECORD_WIDTH), dtype=np.uint8))
+
+    newlines = np.flatnonzero(buf[:RECORD_WIDTH + 2] == ord('\n'))
+    stride = int(newlines[0]) + 1 if len(newlines) else len(buf) + 1
+    n_full = len(buf) // stride
+
+    if stride > RECORD_WIDTH and (buf[stride - 1:n_full * stride:stride] == ord('\n')).all():
+        parts = [decode_records(buf[:n_full * stride].reshape(n_full, stride))]
+        tail = bytes(buf[n_full * stride:]).rstrip(b'\r\n')
+        if tail:
+            parts.append(decode_records(np.frombuffer(tail.ljust(stride), dtype=np.uint8).reshape(1, stride)))
+        return _concat(parts)
+
+    # Ragged lines: pad each to the record width
+    lines = [line.ljust(RECORD_WIDTH)[:RECORD_WIDTH] for line in bytes(buf).splitlines() if line.strip()]
+    rows = np.frombuffer(b''.join(lines), dtype=np.uint8).reshape(len(lines), RECORD_WIDTH)
+    return decode_records(rows)
+
+
+def parse_dat(path):
+    # Decode a .dat file through a memory-mapped byte buffer
+    if os.path.getsize(path) == 0:
+        return decode_buffer(np.zeros(0, dtype=np.uint8))
+    return decode_buffer(np.memmap(path, dtype=np.uint8, mode='r'))
+
+
+def iter_dat_chunks(f, chunk_records=100_000, digest=None):
+    """
+    Decode a .dat byte stream in chunks of whole lines.
+
+    Yields column dicts as produced by decode_records, so records are parsed
+    while the rest of the stream is still being read. If a hashlib object
+    is passed as digest it is updated with every byte read.
+    """
+    chunk_bytes = chunk_records * (RECORD_WIDTH + 1)
+    carry = b''
+    while True:
+        block = f.read(chunk_bytes)
+        if not block:
+            break
+        if digest is not None:
+            digest.update(block)
+        block = carry + block
+        end = block.rfind(b'\n') + 1
+        carry = block[end:]
+        if end:
+            yield decode_buffer(np.frombuffer(block, dtype=np.uint8, count=end))
+    if carry.strip():
+        yield decode_buffer(np.frombuffer(carry, dtype=np.uint8))
+
+
+class _Prefetcher:
+    """
+    File-like wrapper that reads a raw stream on a background thread.
+
+    Network reads fill a bounded queue while the consumer decompresses and
+    parses earlier blocks, so the transfer overlaps with decoding. The
+    consumer must call close() when it stops reading, also on errors, so
+    the thread does not stay blocked on a full queue.
+    """
+
+    def __init__(self, raw, block_size=1 << 20, depth=16):
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._buffer = b''
+        self._pos = 0
+        self._done = False
+        self._thread = threading.Thread(target=self._fill, args=(raw, block_size), daemon=True,
+                                        name='ghcn-prefetch')
+        self._thread.start()
+
+    def _put(self, item):
+        # Wait for room in the queue, giving up once close() is called
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fill(self, raw, block_size):
+        try:
+            for block in iter(lambda: raw.read(block_size), b''):
+                if not self._put(block):
+                    return
+            self._put(b'')
+        except Exception as e:
+            self._put(e)
+
+    def read(self, size=-1):
+        while not self._done and (size < 0 or len(self._buffer) - self._pos < size):
+            block = self._queue.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self._done = True
+            self._buffer = self._buffer[self._pos:] + block
+            self._pos = 0
+        end = len(self._buffer) if size < 0 else min(self._pos + size, len(self._buffer))
+        data = self._buffer[self._pos:end]
+        self._pos = end
+        return data
+
+    def close(self):
+        # Stop the reader thread and wait for it, so it never outlives the raw stream
+        self._stop.set()
+        self._thread.join()
+
+
+def read_ghcn_tar(source, out_dir, cache_dir, chunk_records=100_000):
+    """
+    Ingest a GHCN-M v4 .tar.gz straight from its compressed stream.
+
+    source is a URL, a local tarball path or a readable binary file object.
+    The archive is read sequentially ('r|gz'), so the .dat member is decoded
+    chunk by chunk while the download is still in progress and is never
+    written out uncompressed. The small .inv metadata is written under
+    out_dir; in place of the .dat a '<name>.dat.sha256' pointer holding the
+    digest of the .dat is written next to it, and the decoded columns are
+    stored in cache_dir under that digest exactly as read_ghcn_dat would
+    cache them.
+
+    Returns the path of the pointer file.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    if isinstance(source, str) and source.startswith(('http://', 'https://')):
+        stream = urllib.request.urlopen(source, timeout=60)
+    elif isinstance(source, (str, os.PathLike)):
+        stream = open(source, 'rb')
+    else:
+        stream = contextlib.nullcontext(source)
+
+    with stream as raw:
+        prefetcher = _Prefetcher(raw)
+        try:
+            return _ingest_archive(prefetcher, out_dir, cache_dir, chunk_records)
+        finally:
+            prefetcher.close()
+
+
+def _ingest_archive(fileobj, out_dir, cache_dir, chunk_records):
+    # Decode the .dat and copy the .inv of a sequential tar stream; returns the pointer path
+    pointer_path = None
+    with tarfile.open(fileobj=fileobj, mode='r|gz') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            target = os.path.join(out_dir, os.path.normpath(member.name).lstrip(os.sep))
+            if not os.path.abspath(target).startswith(os.path.abspath(out_dir) + os.sep):
+                raise ValueError(f"Unsafe path in GHCN archive: {member.name}")
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            if member.name.endswith('.dat'):
+                digest = hashlib.sha256()
+                columns = _concat(list(iter_dat_chunks(archive.extractfile(member), chunk_records, digest)))
+                cache_path = _cache_path(cache_dir, digest.hexdigest())
+                _save_columns(cache_path, columns)
+                pointer_path = target + DIGEST_SUFFIX
+                with open(pointer_path, 'w') as f:
+                    f.write(digest.hexdigest() + '\n')
+            elif member.name.endswith('.inv'):
+                with open(target, 'wb') as f:
+                    shutil.copyfileobj(archive.extractfile(member), f)
+
+    if pointer_path is None:
+        raise ValueError("GHCN archive does not contain a .dat file")
+    return pointer_path
+
+
+def _cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, f"{CACHE_PREFIX}{digest[:16]}.npz")
+
+
+def prune_cache(cache_dir, keep_path):
+    # Remove the cached columns of every other release; each is roughly the size of the .dat
+    for path in glob.glob(os.path.join(cache_dir, CACHE_PREFIX + '*.npz*')):
+        if os.path.abspath(path) != os.path.abspath(keep_path):
+            os.remove(path)
+
+
+def _save_columns(cache_path, columns):
+    # Write under a temporary name so an interrupted run never leaves a partial cache
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **columns)
+    os.replace(tmp_path, cache_path)
+
+
+def parse_qc_policy(policy):
+    """
+    Normalise 'keep_all', 'drop_any', or a string/iterable of flag characters ('D,K' or 'DK').
+
+    QC flags are single upper-case letters, so anything else, such as a
+    mistyped policy name, raises ValueError instead of becoming a flag set.
+    """
+    if policy in (None, KEEP_ALL, DROP_ANY):
+        return policy or KEEP_ALL
+    flags = policy.replace(',', '').replace(' ', '') if isinstance(policy, str) else policy
+    flags = frozenset(flags)
+    if not flags or any(len(flag) != 1 or not ('A' <= flag <= 'Z') for flag in flags):
+        raise ValueError(f"Invalid QC flag policy {policy!r}; expected {KEEP_ALL!r}, {DROP_ANY!r} "
+                         f"or QC flag letters such as 'D,K,O'")
+    return flags
+
+
+def apply_qc_policy(values, qcflag, policy):
+    """
+    Mask values in place according to a QC flag policy.
+
+    Returns the number of non-missing values dropped for each QC flag.
+    """
+    policy = parse_qc_policy(policy)
+    if policy == KEEP_ALL:
+        return {}
+
+    flagged = qcflag != ord(' ')
+    if policy != DROP_ANY:
+        flagged &= np.isin(qcflag, np.frombuffer(''.join(sorted(policy)).encode(), dtype=np.uint8))
+    dropped = flagged & ~np.isnan(values)
+
+    codes, counts = np.unique(qcflag[dropped], return_counts=True)
+    values[dropped] = np.nan
+    return {chr(code): int(count) for code, count in zip(codes, counts)}
+
+
+def read_ghcn_dat(path, keep_flags=False, cache_dir=None, qc_policy=KEEP_ALL, stats=None, digest=None):
+    """
+    Read a GHCN-M v4 .dat file into NumPy columns.
+
+    Returns a dict with 'station' (S11), 'year' (int16) and 'values'
+    ((n, 12) float32 in degrees C); with keep_flags the 'dmflag', 'qcflag'
+    and 'dsflag' (n, 12) uint8 arrays are included as well. When cache_dir
+    is given the decoded columns are stored there as an .npz keyed by the
+    sha256 of the source file, and later reads of the same file skip text
+    parsing entirely. The cached columns of other releases are removed.
+
+    path may also be a digest pointer written by read_ghcn_tar, in which
+    case the columns are loaded from cache_dir. A caller that has already
+    hashed the file passes its sha256 as digest to skip hashing it again.
+
+    Values are masked to NaN according to qc_policy before they are returned.
+    The cache always holds the unfiltered values, so changing the policy
+    does not require a reparse. If a stats dict is passed, the number of
+    values dropped per QC flag is stored under 'qc_dropped'.
+    """
+    cache_path = None
+    columns = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        if path.endswith(DIGEST_SUFFIX):
+            with open(path) as f:
+                digest = f.read().strip()
+        elif digest is None:
+            digest = file_digest(path)
+        cache_path = _cache_path(cache_dir, digest)
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                columns = {key: cached[key] for key in cached.files}
+
+    if columns is None:
+        if path.endswith(DIGEST_SUFFIX):
+            raise FileNotFoundError(f"No cached columns for streamed GHCN data {path}")
+        columns = parse_dat(path)
+        if cache_path is not None:
+            _save_columns(cache_path, columns)
+    if cache_path is not None:
+        prune_cache(cache_dir, cache_path)
+
+    qc_dropped = apply_qc_policy(columns['values'], columns['qcflag'], qc_policy)
+    if stats is not None:
+        stats['qc_dropped'] = qc_dropped
+
+    if not keep_flags:
+        for flag in FLAG_NAMES:
+            columns.pop(flag, None)
+    return columns
@@ -0,0 +1,53 @@
+import numpy as np
+
+from scripts.aggregation import grid_reduce
+
+# Reference period for station baselines
+BASELINE_START = 1961
+BASELINE_END = 1990
+
+
+def station_baselines(station_idx, years, values, n_stations,
+                      start=BASELINE_START, end=BASELINE_END):
+    """
+    Mean of each station's calendar months over the baseline period.
+
+    `values` is the wide (records, 12) array of monthly means with NaN for
+    missing months and `station_idx` gives the station of each record. The
+    result is a (n_stations, 12) array, NaN where a station has no data for
+    that month in the baseline period.
+    """
+    in_base = (years >= start) & (years <= end)
+    base_values = values[in_base]
+    present = ~np.isnan(base_values)
+
+    # One bincount over the flattened station/month key instead of a groupby
+    keys = (station_idx[in_base][:, None] * 12 + np.arange(12)).ravel()
+    sums = np.bincount(keys, weights=np.where(present, base_values, 0.0).ravel(),
+                       minlength=n_stations * 12)
+    counts = np.bincount(keys, weights=present.ravel(), minlength=n_stations * 12)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        baselines = sums / counts
+    return baselines.reshape(n_stations, 12)
+
+
+def station_anomalies(station_idx, values, baselines):
+    # Broadcast each record's station baseline over its 12 months
+    return values - baselines[station_idx]
+
+
+def gridded_anomalies(station_idx, years, anomalies, station_cell, station_weight, grid_size=5.0):
+    """
+    Reduce wide station anomalies to gridded and global series.
+
+    Only the non-missing values of stations with a grid cell (cell >= 0)
+    are unrolled; see aggregation.grid_reduce for the returned products.
+    """
+    cell = station_cell[station_idx]
+    keep = cell >= 0
+    anomalies = anomalies[keep]
+    rec, month = np.nonzero(~np.isnan(anomalies))
+
+    return grid_reduce(cell[keep][rec], month + 1, years[keep][rec], anomalies[rec, month],
+                       station_weight[station_idx[keep]][rec], grid_size)
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+# Grid resolutions (in degrees) that divide both the 180 degree latitude and
+# 360 degree longitude ranges evenly
+SUPPORTED_GRID_SIZES = (1.0, 2.5, 5.0)
+
+# The landmask file is published on a fixed 5 degree grid
+LANDMASK_GRID_SIZE = 5.0
+
+
+def grid_shape(grid_size=5.0):
+    # Number of latitude bands and longitude columns for a grid size
+    if float(grid_size) not in SUPPORTED_GRID_SIZES:
+        raise ValueError(f"Unsupported grid size {grid_size}; expected one of {SUPPORTED_GRID_SIZES}")
+    return int(round(180 / grid_size)), int(round(360 / grid_size))
+
+
+def grid_indices(lat, lon, grid_size=5.0):
+    """
+    Assign latitude/longitude points to integer grid cells in one pass.
+
+    Cells are half-open ([x, x + grid_size)), so a point on a band edge belongs
+    to exactly one cell. The north pole and the antimeridian are folded into
+    the last band/column. Points outside the valid coordinate range get -1.
+    """
+    n_lat, n_lon = grid_shape(grid_size)
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+
+    lat_idx = np.floor_divide(lat + 90.0, grid_size)
+    lon_idx = np.floor_divide(lon + 180.0, grid_size)
+    lat_idx = np.where(lat == 90.0, n_lat - 1, lat_idx)
+    lon_idx = np.where(lon == 180.0, n_lon - 1, lon_idx)
+
+    valid = (lat_idx >= 0) & (lat_idx < n_lat) & (lon_idx >= 0) & (lon_idx < n_lon)
+    lat_idx = np.where(valid, lat_idx, -1).astype(np.int32)
+    lon_idx = np.where(valid, lon_idx, -1).astype(np.int32)
+    return lat_idx, lon_idx
+
+
+def cell_id(lat_idx, lon_idx, grid_size=5.0):
+    # Flatten a (lat_idx, lon_idx) pair into a single integer key
+    _, n_lon = grid_shape(grid_size)
+    lat_idx = np.asarray(lat_idx)
+    lon_idx = np.asarray(lon_idx)
+    return np.where(lat_idx >= 0, lat_idx * n_lon + lon_idx, -1)
+
+
+def cell_centers(lat_idx, lon_idx, grid_size=5.0):
+    # Latitude/longitude of the centre of each cell
+    lat_center = -90.0 + (np.asarray(lat_idx) + 0.5) * grid_size
+    lon_center = -180.0 + (np.asarray(lon_idx) + 0.5) * grid_size
+    return lat_center, lon_center
+
+
+def band_weights(lat_idx, grid_size=5.0):
+    # Relative area of a cell: sin(northern edge) - sin(southern edge)
+    south = np.deg2rad(-90.0 + np.asarray(lat_idx) * grid_size)
+    north = south + np.deg2rad(grid_size)
+    return np.sin(north) - np.sin(south)
+
+
+def load_landmask(landmask_path, grid_size=5.0):
+    """
+    Load the 5 degree landmask keyed by integer (lat_idx, lon_idx).
+
+    The source file identifies cells by a 'gridbox' string such as
+    '-87.5 lat -177.5 lon'. For finer grids each cell inherits the land
+    fraction of the 5 degree cell that contains its centre.
+    """
+    lndmsk = pd.read_stata(landmask_path)
+    coords = lndmsk['gridbox'].str.extract(r'(?P<lat>-?[\d.]+) lat (?P<lon>-?[\d.]+) lon').astype(float)
+
+    coarse_lat, coarse_lon = grid_indices(coords['lat'], coords['lon'], LANDMASK_GRID_SIZE)
+    coarse_nlat, coarse_nlon = grid_shape(LANDMASK_GRID_SIZE)
+    land = np.full((coarse_nlat, coarse_nlon), np.nan)
+    ocean = np.full((coarse_nlat, coarse_nlon), np.nan)
+    valid = coarse_lat >= 0
+    land[coarse_lat[valid], coarse_lon[valid]] = lndmsk['land_percent'].to_numpy()[valid]
+    ocean[coarse_lat[valid], coarse_lon[valid]] = lndmsk['ocean_percent'].to_numpy()[valid]
+
+    n_lat, n_lon = grid_shape(grid_size)
+    lat_idx, lon_idx = np.meshgrid(np.arange(n_lat), np.arange(n_lon), indexing='ij')
+    lat_idx = lat_idx.ravel()
+    lon_idx = lon_idx.ravel()
+    lat_center, lon_center = cell_centers(lat_idx, lon_idx, grid_size)
+    parent_lat, parent_lon = grid_indices(lat_center, lon_center, LANDMASK_GRID_SIZE)
+
+    mask = pd.DataFrame({
+        'lat_idx': lat_idx.astype(np.int32),
+        'lon_idx': lon_idx.astype(np.int32),
+        'land_percent': land[parent_lat, parent_lon],
+        'ocean_percent': ocean[parent_lat, parent_lon],
+    })
+    return mask[mask['land_percent'].notnull()].reset_index(drop=True)
+
+
+def grid_stations(stn_meta, landmask, grid_size=5.0):
+    """
+    Attach grid cells and land-weighted area weights to station metadata.
+
+    Stations whose cell is missing from the landmask are dropped, matching
+    the inner join the transforms have always used.
+    """
+    lat_idx, lon_idx = grid_indices(stn_meta['lat'], stn_meta['lon'], grid_size)
+    gridded = stn_meta.assign(lat_idx=lat_idx, lon_idx=lon_idx)
+    gridded = gridded.merge(landmask, on=['lat_idx', 'lon_idx'])
+    gridded['cell'] = cell_id(gridded['lat_idx'].to_numpy(), gridded['lon_idx'].to_numpy(), grid_size)
+    gridded['grid_weight'] = band_weights(gridded['lat_idx'].to_numpy(), grid_size) * gridded['land_percent']
+    return gridded
@@ -1,58 +1,225 @@
 import urllib.request
+import urllib.error
 import tarfile
 import glob
 import gdown
 import shutil
 import os
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
-def clean_previous_data():
-    # Recursively delete files and folders in ./data folder
-    shutil.rmtree('data/raw', ignore_errors=True)
-    shutil.rmtree('data/clean', ignore_errors=True)
-    # Recreate the data folders
-    os.makedirs('data/raw', exist_ok=True)
-    os.makedirs('data/clean', exist_ok=True)
-
-def download_ghcn_data():
-    try:
-        ghcn_url = 'https://www1.ncdc.noaa.gov/pub/data/ghcn/v4/ghcnm.tavg.latest.qcu.tar.gz'
-        with urllib.request.urlopen(ghcn_url) as ftpstream:
-            thetarfile = tarfile.open(fileobj=ftpstream, mode="r|gz")
-            thetarfile.extractall(path='data/raw/')
-        print("Downloaded GHCN data successfully.")
-    except Exception as e:
-        print(f"Failed to download GHCN data: {e}")
+from scripts.ghcn_reader import DIGEST_SUFFIX, read_ghcn_tar
+
+logger = logging.getLogger(__name__)
+
+RAW_DATA_DIR = os.path.join('data', 'raw')
+CACHE_DIR = os.path.join('data', 'cache')
+
+# Remote sources fetched with conditional GETs, keyed by dataset
+# (the GHCN archive is kept for its validators; its name must not match the ghcnm* folder glob)
+SOURCES = {
+    'ghcn': ('https://www1.ncdc.noaa.gov/pub/data/ghcn/v4/ghcnm.tavg.latest.qcu.tar.gz', 'ghcn_latest.qcu.tar.gz'),
+    'giss': ('https://data.giss.nasa.gov/gistemp/graphs_v4/graph_data/Monthly_Mean_Global_Surface_Temperature/graph.csv', 'giss_temp_data.csv'),
+    'crutem': ('https://crudata.uea.ac.uk/cru/data/temperature/CRUTEM5.0_gl.txt', 'crutem_temp_data.txt'),
+}
+LANDMASK_URL = 'https://drive.google.com/uc?id=1nSDlTfMbyquCQflAvScLM6K4dvgQ7JBj'
+
+# ETag/Last-Modified of each downloaded file, used for If-None-Match/If-Modified-Since
+VALIDATORS_FILE = '.http_validators.json'
+
+# Download outcomes
+DOWNLOADED = 'downloaded'
+NOT_MODIFIED = 'not-modified'
+FAILED = 'failed'
+
+# HTTP statuses worth retrying
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    pass
+
+
+def fetch(url, dest, validators=None, retries=3, backoff=1.0, timeout=60, consume=None):
+    """
+    Download url to dest with a conditional GET, retries and an atomic rename.
+
+    Returns (status, validators) where status is DOWNLOADED or NOT_MODIFIED
+    and validators holds the response's ETag/Last-Modified. The body is
+    written to a temporary file next to dest and renamed over it only once
+    complete, so dest is never left partially written. If consume is given
+    it is called with the open response instead and dest is not written.
+    """
+    headers = {}
+    if validators and (consume is not None or os.path.exists(dest)):
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    for attempt in range(retries + 1):
+        tmp_path = f"{dest}.{os.getpid()}.part"
+        try:
+            request = urllib.request.Request(url, headers=headers)
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                if consume is not None:
+                    consume(response)
+                else:
+                    with open(tmp_path, 'wb') as f:
+                        shutil.copyfileobj(response, f, 1 << 20)
+                    os.replace(tmp_path, dest)
+                return DOWNLOADED, {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                }
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return NOT_MODIFIED, validators
+            if e.code not in RETRY_STATUSES or attempt == retries:
+                raise
+            error = e
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+            if attempt == retries:
+                raise
+            error = e
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        delay = backoff * 2 ** attempt
+        logger.warning(f"Fetching {url} failed ({error}); retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+def _swap_in_ghcn(scratch, raw_dir):
+    # Move the ghcnm.* folder from scratch into raw_dir, replacing older releases
+    previous = [path for path in glob.glob(os.path.join(raw_dir, 'ghcnm*')) if os.path.isdir(path)]
+    for extracted in glob.glob(os.path.join(scratch, 'ghcnm*')):
+        target = os.path.join(raw_dir, os.path.basename(extracted))
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(extracted, target)
+        previous = [path for path in previous if os.path.abspath(path) != os.path.abspath(target)]
+    shutil.rmtree(scratch, ignore_errors=True)
+
+    # Older releases would otherwise shadow the new one in the transform's glob
+    for path in previous:
+        shutil.rmtree(path, ignore_errors=True)
+
+def extract_ghcn_archive(archive_path, raw_dir=RAW_DATA_DIR):
+    # Extract into a scratch folder, then swap the ghcnm.* folder into place
+    scratch = os.path.join(raw_dir, '.ghcn_extract')
+    shutil.rmtree(scratch, ignore_errors=True)
+    with tarfile.open(archive_path, mode="r:gz") as thetarfile:
+        thetarfile.extractall(path=scratch)
+    _swap_in_ghcn(scratch, raw_dir)
+
+def stream_ghcn_archive(source, raw_dir=RAW_DATA_DIR, cache_dir=CACHE_DIR):
+    """
+    Parse the GHCN archive from its compressed stream without extracting the .dat.
+
+    source is the archive URL, a local tarball or an open response. Only the
+    .inv and a digest pointer to the cached columns are written to raw_dir;
+    see ghcn_reader.read_ghcn_tar.
+    """
+    scratch = os.path.join(raw_dir, '.ghcn_stream')
+    shutil.rmtree(scratch, ignore_errors=True)
+    read_ghcn_tar(source, scratch, cache_dir)
+    _swap_in_ghcn(scratch, raw_dir)
+
+def _ghcn_present(raw_dir):
+    # An extracted .dat or the digest pointer of a streamed one
+    return bool(glob.glob(os.path.join(raw_dir, 'ghcnm*', '*.dat'))
+                or glob.glob(os.path.join(raw_dir, 'ghcnm*', '*.dat' + DIGEST_SUFFIX)))
 
 def download_landmask(landmask_output='./data/raw/landmask.dta'):
-    try:
-        if not glob.glob(landmask_output):
-            landmask_url = 'https://drive.google.com/uc?id=1nSDlTfMbyquCQflAvScLM6K4dvgQ7JBj'
-            gdown.download(landmask_url, landmask_output, quiet=False)  
-    except Exception as e:
-        print(f"Failed to download landmask data: {e}")        
-
-def download_giss_data():
-    try:    
-        giss_url = 'https://data.giss.nasa.gov/gistemp/graphs_v4/graph_data/Monthly_Mean_Global_Surface_Temperature/graph.csv'
-        # Adjust the path according to the raw data directory
-        urllib.request.urlretrieve(giss_url, 'data/raw/giss_temp_data.csv')
-    except Exception as e:
-        print(f"Failed to download GISS data: {e}")
-
-def download_crutem_data():
-    try:
-        crutem_url = 'https://crudata.uea.ac.uk/cru/data/temperature/CRUTEM5.0_gl.txt'
-        # Adjust the path according to the raw data directory
-        urllib.request.urlretrieve(crutem_url, 'data/raw/crutem_temp_data.txt')
-    except Exception as e:
-        print(f"Failed to download CRUTEM data: {e}")
-
-def download_all_data():
-    clean_previous_data()
-    download_ghcn_data()
-    download_landmask()
-    download_giss_data()
-    download_crutem_data()
+    # The landmask never changes upstream; fetch it only once
+    if glob.glob(landmask_output):
+        return NOT_MODIFIED
+    tmp_path = landmask_output + '.part'
+    gdown.download(LANDMASK_URL, tmp_path, quiet=True)
+    os.replace(tmp_path, landmask_output)
+    return DOWNLOADED
+
+def _load_validators(raw_dir):
+    path = os.path.join(raw_dir, VALIDATORS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _save_validators(raw_dir, validators):
+    path = os.path.join(raw_dir, VALIDATORS_FILE)
+    with open(path + '.part', 'w') as f:
+        json.dump(validators, f, indent=2)
+    os.replace(path + '.part', path)
+
+def download_all_data(sources=None, raw_dir=RAW_DATA_DIR, workers=4, retries=3, backoff=1.0,
+                      include_landmask=True, ghcn_stream=False, cache_dir=CACHE_DIR, force=False):
+    """
+    Fetch every source concurrently and return {name: status}.
+
+    Unchanged sources are skipped through conditional GETs. A failed source
+    keeps its previous copy and is reported as FAILED; DownloadError is
+    raised only if a failed source has no previous copy to fall back on.
+    With ghcn_stream the GHCN archive is parsed while it downloads and
+    neither the archive nor its .dat is written to disk. With force every
+    source is fetched again regardless of its validators.
+    """
+    sources = SOURCES if sources is None else sources
+    os.makedirs(raw_dir, exist_ok=True)
+    validators = {} if force else _load_validators(raw_dir)
+    paths = {name: os.path.join(raw_dir, filename) for name, (_, filename) in sources.items()}
+
+    def have_copy(name):
+        if name == 'ghcn' and ghcn_stream:
+            return _ghcn_present(raw_dir)
+        return os.path.exists(paths[name])
+
+    def fetch_source(name):
+        if name == 'ghcn' and ghcn_stream:
+            status, new_validators = fetch(sources[name][0], paths[name],
+                                           validators.get(name) if have_copy(name) else None,
+                                           retries=retries, backoff=backoff,
+                                           consume=lambda response: stream_ghcn_archive(response, raw_dir, cache_dir))
+        else:
+            status, new_validators = fetch(sources[name][0], paths[name], validators.get(name),
+                                           retries=retries, backoff=backoff)
+            if name == 'ghcn' and (status == DOWNLOADED or not _ghcn_present(raw_dir)):
+                extract_ghcn_archive(paths[name], raw_dir)
+        validators[name] = new_validators
+        return status
+
+    results = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(fetch_source, name) for name in sources}
+        if include_landmask:
+            paths['landmask'] = os.path.join(raw_dir, 'landmask.dta')
+            futures['landmask'] = pool.submit(download_landmask, paths['landmask'])
+
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+                logger.info(f"{name}: {results[name]}")
+            except Exception as e:
+                results[name] = FAILED
+                errors[name] = e
+                logger.error(f"Failed to download {name} data: {e}")
+
+    _save_validators(raw_dir, validators)
+
+    # A failed source can fall back on its previous copy
+    missing = [name for name in errors if not have_copy(name)]
+    if missing:
+        raise DownloadError("; ".join(f"{name}: {errors[name]}" for name in missing))
+    return results
 
 if __name__ == '__main__':
-    download_all_data()
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1:
+        # Offline ingestion of a local GHCN tarball: python -m scripts.raw_data_extract ghcnm.tar.gz
+        stream_ghcn_archive(sys.argv[1])
+    else:
+        print(download_all_data())
@@ -1,9 +1,11 @@
 import pandas as pd
 import os
 
-def transform_crutem_data():
-    # Adjust the file path for the raw data according to the new structure
-    data_file_path = os.path.join('data', 'raw', 'crutem_temp_data.txt')
+from scripts.clean_store import CLEAN_DIR, write_table
+
+def transform_crutem_data(raw_dir=os.path.join('data', 'raw'), clean_dir=CLEAN_DIR):
+    # raw_dir is the folder the downloads were saved to
+    data_file_path = os.path.join(raw_dir, 'crutem_temp_data.txt')
     crutem = pd.read_csv(data_file_path, skiprows=1, header=None)
 
     # Separate columns by whitespace
@@ -26,9 +28,8 @@ def transform_crutem_data():
     # Retain only the data from 1900 to the latest year
     crutem = crutem.loc[crutem['year'].between(1900, latest_year)]
 
-    # Export the data to a new csv file in the clean directory, ignore index column
-    output_file_path = os.path.join('data', 'clean', 'crutem_anomalies_clean.csv')
-    crutem.to_csv(output_file_path, index=False)
+    # Export the data to the clean store with the fixed series schema
+    return pd.DataFrame(write_table('crutem', crutem, clean_dir))
 
 if __name__ == '__main__':
     transform_crutem_data()
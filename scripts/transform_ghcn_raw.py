@@ -1,18 +1,24 @@
 import pandas as pd
 import numpy as np
 import glob
+import logging
 import os
 
-def transform_ghcn_data():
-    # Adjust file paths for raw data and landmask
-    data_file_path = os.path.join('data', 'raw')
-    name = glob.glob(data_file_path + "/ghcnm*")
+from scripts.gridding import grid_stations, load_landmask
+from scripts.aggregation import grid_reduce
+from scripts.clean_store import CLEAN_DIR, remove_table, write_table
+from scripts.ghcn_reader import DIGEST_SUFFIX, KEEP_ALL, exact_degrees, file_digest, parse_qc_policy, read_ghcn_dat
+from scripts.ghcn_chunked import chunked_anomalies
+from scripts.ghcn_incremental import STATE_FILE, changed_years, inputs_key, load_state, save_state, year_digests
+from scripts.ghcn_wide import gridded_anomalies, station_anomalies, station_baselines
 
-    GHCNDat = glob.glob(name[0] + "/*.dat")
-    GHCNmeta = glob.glob(name[0] + "/*.inv")
-    landmask = os.path.join('data', 'raw', 'landmask.dta')
+logger = logging.getLogger(__name__)
 
-    # load the GHCNV4 monthly with column names
+# Station-level tables of the clean store, written only by the wide engine
+STATION_TABLES = ('ghcn_records', 'ghcn_stations')
+
+def _ghcn_colspecs():
+    # fixed-width layout of the GHCNV4 monthly .dat records
     colspecs = [(0, 2), (0, 11), (11, 15), (15, 19)]
     names = ['country_code', 'station', 'year', 'variable']
     i = 19
@@ -25,41 +31,28 @@ def transform_ghcn_data():
         names.append(names_tmp)
 
         i = i + 8
+    return colspecs, names
 
-    ghcnv4 = pd.read_fwf(GHCNDat[0],
-                        colspecs=colspecs, names=names)
-
-    # load landmask
-    lndmsk = pd.read_stata(landmask)
-
-
-    # Load station metadata
-    stnMeta = pd.read_fwf(GHCNmeta[0], colspecs=[(0, 2), (0, 12), (12, 21), (21, 31),
-                                            (31, 38), (38, 69)],
-                        names=['country_code', 'station',
-                                'lat', 'lon', 'elev', 'name'])
-    
-    # create grids
-    grid_size = 5
-    count = -90 + (grid_size / 2)
-    stnMeta['latgrid'] = 0.0
-
-    for x in range(-90, 90, 5):
-        stnMeta.loc[stnMeta['lat'].between(x, x+5), 'latgrid'] = count
-        count = count + grid_size
-
-    count = -180 + (grid_size / 2)
-    stnMeta['longrid'] = 0.0
+def find_ghcn_files(data_file_path):
+    # .dat and .inv of the extracted GHCN release; a streamed archive leaves a
+    # digest pointer to the cached columns instead of the .dat
+    name = glob.glob(data_file_path + "/ghcnm*")
+    GHCNDat = glob.glob(name[0] + "/*.dat") or glob.glob(name[0] + "/*.dat" + DIGEST_SUFFIX)
+    GHCNmeta = glob.glob(name[0] + "/*.inv")
+    return GHCNDat[0], GHCNmeta[0]
 
-    for x in range(-180, 180, 5):
-        stnMeta.loc[stnMeta['lon'].between(x, x+5), 'longrid'] = count
-        count = count + grid_size
+def read_station_metadata(inv_path):
+    # fixed-width layout of the GHCNV4 .inv station metadata
+    return pd.read_fwf(inv_path, colspecs=[(0, 2), (0, 12), (12, 21), (21, 31),
+                                           (31, 38), (38, 69)],
+                       names=['country_code', 'station',
+                              'lat', 'lon', 'elev', 'name'])
 
-    stnMeta['gridbox'] = stnMeta['latgrid'].map(str) + " lat " + stnMeta['longrid'].map(str) + " lon"
-    stnMetaGrid = stnMeta.merge(lndmsk, on='gridbox')
-    stnMetaGrid['grid_weight'] = np.sin((stnMetaGrid['latgrid'] + grid_size / 2) * np.pi / 180) - np.sin(
-        (stnMetaGrid['latgrid'] - grid_size / 2) * np.pi / 180)
-    stnMetaGrid['grid_weight'] = stnMetaGrid['grid_weight'] * stnMetaGrid['land_percent']
+def _long_anomalies(dat_path, stnMetaGrid, grid_size):
+    # load the GHCNV4 monthly with column names
+    colspecs, names = _ghcn_colspecs()
+    ghcnv4 = pd.read_fwf(dat_path,
+                        colspecs=colspecs, names=names)
 
     # clean ghcn and create anomalies
     ghcnv4NoNullYears =  ghcnv4.replace(-9999, np.nan)
@@ -85,24 +78,172 @@ def transform_ghcn_data():
     # merge on the metadata
     ghcnAnomsGrid = ghcnAnoms.merge(stnMetaGrid, on=['station'])
     ghcnAnomsGrid = ghcnAnomsGrid[ghcnAnomsGrid.anomalies.notnull()]
-    ghcnAnomsGrid = ghcnAnomsGrid.drop(columns=['baseline', 'station', 'name', 'lat', 'lon', 'elev', 'latgrid', 'longrid', 'land_percent',
-                                                'ocean_percent', 'value', 'country_code'])
+    month = ghcnAnomsGrid['variable'].str[len('VALUE'):].astype(int)
+
+    # mean of the anomalies per gridbox, month, and year, then weighted by grid_weight per year
+    return grid_reduce(ghcnAnomsGrid['cell'], month, ghcnAnomsGrid['year'], ghcnAnomsGrid['anomalies'],
+                       ghcnAnomsGrid['grid_weight'], grid_size)
+
+def _wide_anomalies(dat_path, stnMetaGrid, grid_size, qc_policy, stats, cache_dir, clean_dir, latest_year,
+                    key=None, incremental=False, dat_digest=None):
+    # decode the fixed-width records straight into arrays, reusing the columnar cache when the file is unchanged;
+    # values rejected by the QC flag policy are masked before any baseline or anomaly math
+    ghcnv4 = read_ghcn_dat(dat_path, cache_dir=cache_dir, qc_policy=qc_policy, stats=stats, digest=dat_digest)
+    values = ghcnv4['values']
+    years = ghcnv4['year'].astype(np.int64)
+    digest_years, digests = year_digests(years, ghcnv4['station'], values)
+
+    # station-level cache of the QC-masked records for later runs, the API and notebooks
+    order = np.lexsort((years, ghcnv4['station']))
+    write_table('ghcn_records', {'station': ghcnv4['station'][order], 'year': years[order], 'values': values[order]},
+                clean_dir)
+    del order
+    stations, station_idx = np.unique(ghcnv4['station'], return_inverse=True)
+    del ghcnv4
+    values = exact_degrees(values)
+
+    state_path = os.path.join(cache_dir, STATE_FILE)
+    state = load_state(state_path) if incremental else None
+    changed = changed_years(state, key, digest_years, digests, latest_year)
+
+    if changed is not None:
+        # baselines and gridbox weights come from the previous run; only records of changed years are reduced
+        pos = np.minimum(np.searchsorted(state['stations'], stations), len(state['stations']) - 1)
+        known = state['stations'][pos] == stations
+        baselines = np.where(known[:, None], state['baselines'][pos], np.nan)
+        station_cell = np.where(known, state['station_cell'][pos], -1)
+        station_weight = np.where(known, state['station_weight'][pos], 0.0)
+
+        in_changed = np.isin(years, changed)
+        if in_changed.any():
+            anomalies = station_anomalies(station_idx[in_changed], values[in_changed], baselines)
+            products = gridded_anomalies(station_idx[in_changed], years[in_changed], anomalies,
+                                         station_cell, station_weight, grid_size)
+        else:
+            products = grid_reduce([], [], [], [], [], grid_size)
+
+        # splice the recomputed years into the previous annual series
+        kept = ~np.isin(state['annual_years'], changed)
+        annual = pd.concat([pd.DataFrame({'year': state['annual_years'][kept],
+                                          'anomaly (deg C)': state['annual_values'][kept]}),
+                            products['annual']]).sort_values('year', ignore_index=True)
+        products['annual'] = annual
+        stations, baselines = state['stations'], state['baselines']
+        station_cell, station_weight = state['station_cell'], state['station_weight']
+        if stats is not None:
+            stats['changed_years'] = changed
+    else:
+        stations = stations.astype(str)
+
+        # baselines and anomalies stay in the (records, 12) layout
+        baselines = station_baselines(station_idx, years, values, len(stations))
+        anomalies = station_anomalies(station_idx, values, baselines)
+        del values
+
+        # look up each station's grid cell and weight, -1 for stations outside the landmask
+        meta_idx = pd.Index(stnMetaGrid['station']).get_indexer(stations)
+        station_cell = np.where(meta_idx >= 0, stnMetaGrid['cell'].to_numpy()[meta_idx], -1)
+        station_weight = np.where(meta_idx >= 0, stnMetaGrid['grid_weight'].to_numpy()[meta_idx], 0.0)
+
+        products = gridded_anomalies(station_idx, years, anomalies, station_cell, station_weight, grid_size)
+        stations = stations.astype('S11')
+
+    write_table('ghcn_stations', {'station': stations, 'cell': station_cell,
+                                  'grid_weight': station_weight, 'baselines': baselines}, clean_dir)
+
+    # keep what the next incremental run needs
+    save_state(state_path, inputs_key=np.array(key or ''), latest_year=np.array(latest_year),
+               stations=stations, baselines=baselines,
+               station_cell=station_cell, station_weight=station_weight,
+               digest_years=digest_years, digests=digests,
+               annual_years=products['annual']['year'].to_numpy(),
+               annual_values=products['annual']['anomaly (deg C)'].to_numpy())
+    return products
+
+def _chunked_anomalies(dat_path, stnMetaGrid, grid_size, qc_policy, stats, memory_budget_mb, workers):
+    # sorted station ids let each chunk find its stations with a binary search
+    stnMetaGrid = stnMetaGrid.sort_values('station')
+    station_ids = stnMetaGrid['station'].to_numpy().astype('S11')
+    return chunked_anomalies(dat_path, station_ids, stnMetaGrid['cell'].to_numpy(),
+                             stnMetaGrid['grid_weight'].to_numpy(), grid_size, qc_policy, stats,
+                             memory_budget_mb, workers)
+
+def transform_ghcn_data(grid_size=5, engine='wide', qc_policy=KEEP_ALL, stats=None,
+                        memory_budget_mb=256, workers=1, incremental=False, cache_dir=os.path.join('data', 'cache'),
+                        raw_dir=os.path.join('data', 'raw'), clean_dir=CLEAN_DIR, digests=None):
+    # reject a malformed QC policy before any data is read
+    policy = parse_qc_policy(qc_policy)
+
+    # sha256 of raw files the caller has already hashed, keyed by path, so no file is hashed twice
+    known = {os.path.normpath(path): digest for path, digest in (digests or {}).items()}
+
+    def digest_of(path):
+        return known.get(os.path.normpath(path)) or file_digest(path)
+
+    # the current year isn't over yet; the incremental state records this cutoff
+    latest_year = pd.Timestamp.now().year-1
 
-    # take the mean of the anomalies grouped by gridbox, variable, and year
-    ghcnAnomsGrid = ghcnAnomsGrid.groupby(['gridbox', 'variable', 'year']).mean().reset_index()
+    # raw data and landmask in the folder the downloads were saved to
+    dat_path, inv_path = find_ghcn_files(raw_dir)
+    landmask = os.path.join(raw_dir, 'landmask.dta')
 
-    # take weighted average of anomalies using the grid_weight column as weights
-    ghcnAnomsWtd = ghcnAnomsGrid.groupby(['year']).apply(lambda x: np.average(x['anomalies'], weights=x['grid_weight'])).reset_index()
+    # load landmask keyed by integer grid cell
+    lndmsk = load_landmask(landmask, grid_size)
 
-    # rename the columns
-    ghcnAnomsWtd.columns = ['year', 'anomaly (deg C)']
 
-    # filter to only years between 1900 and current year - 1 (current year isn't over yet)
-    latest_year = pd.Timestamp.now().year-1
+    # Load station metadata
+    stnMeta = read_station_metadata(inv_path)
+    
+    # assign each station to a grid cell and weight the cell by area and land fraction
+    stnMetaGrid = grid_stations(stnMeta, lndmsk, grid_size)
+
+    # 'wide' keeps the station-year rows as a (records, 12) array, 'long' melts them into one row per month,
+    # 'chunked' streams the file in two passes with memory bounded by memory_budget_mb
+    if engine == 'wide':
+        # with incremental, years whose records are unchanged keep their previous results
+        key = inputs_key([digest_of(inv_path), digest_of(landmask)], float(grid_size),
+                         policy if isinstance(policy, str) else sorted(policy))
+        # a digest pointer is read by read_ghcn_dat itself; its own hash is not the columns' digest
+        dat_digest = None if dat_path.endswith(DIGEST_SUFFIX) else digest_of(dat_path)
+        products = _wide_anomalies(dat_path, stnMetaGrid, grid_size, qc_policy, stats, cache_dir, clean_dir,
+                                   latest_year, key, incremental, dat_digest)
+    elif dat_path.endswith(DIGEST_SUFFIX):
+        raise ValueError(f"The {engine} engine needs the extracted .dat file; use the wide engine for streamed data")
+    elif engine == 'chunked':
+        products = _chunked_anomalies(dat_path, stnMetaGrid, grid_size, qc_policy, stats,
+                                      memory_budget_mb, workers)
+    elif engine == 'long':
+        if policy != KEEP_ALL:
+            logger.warning(f"QC flag policy {qc_policy!r} is not applied by the long engine; keeping all values")
+        products = _long_anomalies(dat_path, stnMetaGrid, grid_size)
+    else:
+        raise ValueError(f"Unknown GHCN engine: {engine}")
+
+    if engine != 'wide':
+        # station tables left by an earlier wide run no longer match the data; without them
+        # readers fall back on the raw .dat
+        for name in STATION_TABLES:
+            remove_table(name, clean_dir)
+
+    ghcnAnomsWtd = products['annual']
+
+    # filter to only years between 1900 and current year - 1
     ghcnAnomsWtd = ghcnAnomsWtd[ghcnAnomsWtd['year'].between(1900, latest_year)]
 
-    output_file_path = os.path.join('data', 'clean', 'ghcnm_anomalies_clean.csv')
-    ghcnAnomsWtd.to_csv(output_file_path, index=False)
+    # hand the gridbox and monthly products of the same years to the caller for storage
+    # (after an incremental run they only cover the changed years)
+    if stats is not None and 'boxes' in products:
+        stats['gridded'] = {
+            'boxes': products['boxes'][products['boxes']['year'].between(1900, latest_year)],
+            'monthly': products['monthly'][products['monthly']['year'].between(1900, latest_year)],
+            'grid_size': float(grid_size),
+            # cells holding each country's stations, for regional queries by country code
+            'cell_countries': {country: np.unique(group.to_numpy()).tolist()
+                               for country, group in stnMetaGrid.groupby('country_code')['cell']},
+        }
+
+    # save to the clean store with the fixed series schema
+    return pd.DataFrame(write_table('ghcn', ghcnAnomsWtd, clean_dir))
 
 if __name__ == '__main__':
     transform_ghcn_data()
\ No newline at end of file
@@ -1,9 +1,12 @@
 import os
 import pandas as pd
 
-def transform_giss_data():
-    # Assuming this script is in the `scripts` directory, adjust paths accordingly
-    data_file_path = os.path.join('data', 'raw', 'giss_temp_data.csv')
+from scripts.aggregation import weighted_mean
+from scripts.clean_store import CLEAN_DIR, write_table
+
+def transform_giss_data(raw_dir=os.path.join('data', 'raw'), clean_dir=CLEAN_DIR):
+    # raw_dir is the folder the downloads were saved to
+    data_file_path = os.path.join(raw_dir, 'giss_temp_data.csv')
 
     giss = pd.read_csv(data_file_path, skiprows=2, header=None)
     giss.columns = ['Year+Month', 'Station','Land+Ocean','Land_Only','Open_Ocean']
@@ -12,21 +15,15 @@ def transform_giss_data():
     giss['year'] = giss['Year+Month'].astype(str).str[:4].astype(int)
 
     # Calculate the average of the 'Land_Only' column, grouping by year
-    giss = giss.groupby('year').mean()
-
-    
-
-    # Drop all columns except year and Land_Only, rename Land_Only to 'anomaly (deg C)'
-    giss = giss.drop(columns=['Land+Ocean','Open_Ocean', 'Year+Month', 'Station'])
-    giss = giss.rename(columns={'Land_Only': 'anomaly (deg C)'})
+    years, annual, _ = weighted_mean(giss['year'], giss['Land_Only'])
+    giss = pd.DataFrame({'anomaly (deg C)': annual}, index=pd.Index(years, name='year'))
     
     latest_year = pd.Timestamp.now().year-1
     # Retain only the data from 1900 to the latest year
     giss = giss.loc[1900:latest_year]
     
-    output_file_path = os.path.join('data', 'clean', 'giss_anomalies_clean.csv')
-    # Save the data to a new csv file
-    giss.to_csv(output_file_path)
+    # Save the data to the clean store with the fixed series schema
+    return pd.DataFrame(write_table('giss', giss.reset_index(), clean_dir))
 
 # If you want to keep the script runnable as a standalone for testing
 if __name__ == '__main__':
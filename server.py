@@ -1,7 +1,14 @@
+import importlib.util
+import json
 import logging
-from flask import Flask, render_template, jsonify
+import struct
+import numpy as np
+from flask import Flask, Response, render_template, jsonify, request
+from sqlalchemy.exc import SQLAlchemyError
 from database import get_db_manager
+from jobs import submit_processing_job
 from config import get_config
+from response_cache import make_etag, response_cache
 
 # Get configuration
 config = get_config()
@@ -20,6 +27,7 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = config.SECRET_KEY
+response_cache.ttl = config.RESPONSE_CACHE_TTL
 
 # Initialize database with error handling
 try:
@@ -40,26 +48,116 @@ def health():
     """Simple health check endpoint for Railway."""
     return jsonify({'status': 'healthy', 'message': 'Climate app is running'})
 
-@app.route('/process-data')
+@app.route('/process-data', methods=['GET', 'POST'])
 def trigger_data_processing():
-    """Manually trigger data processing."""
+    """Start data processing in the background and return its job id."""
     try:
         if db_manager is None:
             return jsonify({'error': 'Database not initialized'}), 503
-            
-        from data_processor import DataProcessor
-        processor = DataProcessor()
-        success = processor.process_all()
         
-        if success:
-            return jsonify({'status': 'success', 'message': 'Data processing completed'})
-        else:
-            return jsonify({'status': 'error', 'message': 'Data processing failed'}), 500
+        force = request.args.get('force', 'false').lower() in ['true', '1', 'yes']
+        job, created = submit_processing_job(db_manager, force=force)
+        if job is None:
+            return jsonify({'error': 'Processing job could not be started'}), 500
+        
+        response = jsonify({
+            **job,
+            'message': 'Data processing started' if created else 'Data processing already in progress',
+            'status_url': f"/status?job_id={job['job_id']}"
+        })
+        response.status_code = 202
+        response.headers['Location'] = f"/status?job_id={job['job_id']}"
+        return response
             
     except Exception as e:
-        logger.error(f"Error in data processing: {e}")
+        logger.error(f"Error starting data processing: {e}")
         return jsonify({'error': f'Data processing failed: {str(e)}'}), 500
 
+# Datasets served by /data, in column order
+DATA_DATASETS = ['giss', 'crutem', 'ghcn']
+
+# Binary /data representations. The packed format is the magic bytes, the
+# header length (uint32 LE), a JSON header padded to 4 bytes with spaces,
+# then years as int32 LE and one float32 LE column per dataset with NaN for
+# missing values, so every array can be viewed in place as a typed array
+PACKED_MIMETYPE = 'application/vnd.climate.f32'
+PACKED_MAGIC = b'CLF1'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+ARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+def data_etag(*parts):
+    """ETag of a /data representation; it changes whenever a run completes or a version is published."""
+    latest = db_manager.get_latest_processing_status() or {}
+    return make_etag(latest.get('completed_at'), sorted(db_manager.get_published_versions().items()), *parts)
+
+def build_data_payload():
+    """Load the /data payload and its ETag from the database, or None on failure."""
+    data = db_manager.get_climate_data(DATA_DATASETS)
+
+    if 'error' in data:
+        logger.error(f"Database error: {data['error']}")
+        return None
+
+    # Ensure all datasets are present and handle missing data
+    for dataset in DATA_DATASETS:
+        if dataset not in data:
+            data[dataset] = [None] * len(data.get('years', []))
+
+    logger.info(f"Successfully retrieved data for {len(data.get('years', []))} years")
+    return data, data_etag()
+
+def load_data_frame():
+    """Published /data series as a year x dataset frame with every dataset column, or None on failure."""
+    try:
+        return db_manager.get_climate_frame(DATA_DATASETS).reindex(columns=DATA_DATASETS)
+    except SQLAlchemyError as e:
+        logger.error(f"Database error: {e}")
+        return None
+
+def build_packed_data_payload():
+    """The /data series as packed little-endian int32/float32 arrays, or None on failure."""
+    frame = load_data_frame()
+    if frame is None:
+        return None
+
+    header = json.dumps({'n': len(frame), 'columns': DATA_DATASETS}, separators=(',', ':')).encode()
+    header += b' ' * (-len(header) % 4)
+    arrays = [frame.index.to_numpy().astype('<i4')]
+    arrays += [frame[dataset].to_numpy().astype('<f4') for dataset in DATA_DATASETS]
+    body = b''.join([PACKED_MAGIC, struct.pack('<I', len(header)), header] + [array.tobytes() for array in arrays])
+    return body, data_etag(PACKED_MIMETYPE)
+
+def build_arrow_data_payload():
+    """The /data series as an Arrow IPC stream (nulls for missing values), or None on failure."""
+    import pyarrow as pa
+
+    frame = load_data_frame()
+    if frame is None:
+        return None
+
+    columns = {'year': pa.array(frame.index.to_numpy().astype('int32'))}
+    for dataset in DATA_DATASETS:
+        columns[dataset] = pa.array(frame[dataset].to_numpy().astype('float32'), from_pandas=True)
+    table = pa.table(columns)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes(), data_etag(ARROW_MIMETYPE)
+
+def cached_response(entry):
+    """Send a cached entry, answering If-None-Match with 304 and gzip when accepted."""
+    if request.if_none_match.contains(entry.etag):
+        response = Response(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = Response(entry.gzip_body, mimetype=entry.mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(entry.body, mimetype=entry.mimetype)
+
+    response.set_etag(entry.etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.get('/data')
 def dataset():
     """Get climate data for visualization."""
@@ -67,20 +165,23 @@ def dataset():
         if db_manager is None:
             return jsonify({'error': 'Database not initialized', 'years': [], 'giss': [], 'crutem': [], 'ghcn': []}), 500
             
-        # Get data from database
-        data = db_manager.get_climate_data(['giss', 'crutem', 'ghcn'])
-
-        if 'error' in data:
-            logger.error(f"Database error: {data['error']}")
+        # JSON unless the client prefers a binary representation
+        offered = ['application/json', PACKED_MIMETYPE] + ([ARROW_MIMETYPE] if ARROW_AVAILABLE else [])
+        mimetype = request.accept_mimetypes.best_match(offered, default='application/json')
+
+        # Served from memory; the database is only read when the cache is empty
+        if mimetype == PACKED_MIMETYPE:
+            entry = response_cache.get_or_build('data:packed', build_packed_data_payload, mimetype=PACKED_MIMETYPE)
+        elif mimetype == ARROW_MIMETYPE:
+            entry = response_cache.get_or_build('data:arrow', build_arrow_data_payload, mimetype=ARROW_MIMETYPE)
+        else:
+            entry = response_cache.get_or_build('data', build_data_payload)
+        if entry is None:
             return jsonify({'error': 'Failed to retrieve data'}), 500
 
-        # Ensure all datasets are present and handle missing data
-        for dataset in ['giss', 'crutem', 'ghcn']:
-            if dataset not in data:
-                data[dataset] = [None] * len(data.get('years', []))
-
-        logger.info(f"Successfully retrieved data for {len(data.get('years', []))} years")
-        return jsonify(data)
+        response = cached_response(entry)
+        response.vary.add('Accept')
+        return response
 
     except Exception as e:
         logger.error(f"Unexpected error in /data endpoint: {e}")
@@ -88,14 +189,22 @@ def dataset():
 
 @app.get('/status')
 def processing_status():
-    """Get the status of the most recent data processing run."""
+    """Get the status of a processing job, or of the most recent run and job."""
     try:
         if db_manager is None:
             return jsonify({'message': 'Database not initialized'}), 503
+        
+        job_id = request.args.get('job_id')
+        if job_id:
+            job = db_manager.get_job(job_id)
+            if job is None:
+                return jsonify({'message': f'No processing job {job_id}'}), 404
+            return jsonify(job)
             
         status = db_manager.get_latest_processing_status()
-        if status:
-            return jsonify(status)
+        job = db_manager.get_job()
+        if status or job:
+            return jsonify({**(status or {}), 'job': job})
         else:
             return jsonify({'message': 'No processing runs found'}), 404
 
@@ -103,13 +212,56 @@ def processing_status():
         logger.error(f"Error getting processing status: {e}")
         return jsonify({'error': 'Failed to get processing status'}), 500
 
+def build_prefix_index():
+    """Build the prefix-sum index over all published series, or None on failure."""
+    from analysis import PrefixSumIndex
+
+    try:
+        frame = db_manager.get_climate_frame()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to build prefix-sum index: {e}")
+        return None
+    logger.info(f"Built prefix-sum index for {len(frame.columns)} datasets over {len(frame)} years")
+    return PrefixSumIndex(frame)
+
+def get_prefix_index():
+    """Prefix-sum index held in memory until the next processing run completes."""
+    return response_cache.get_or_build_value('prefix_index', build_prefix_index)
+
+def load_analysis_windows():
+    """Precomputed /analyze windows of the published data, keyed by their clamped bounds."""
+    data_version = db_manager.get_data_version()
+    results = db_manager.get_analysis_results(data_version)
+    logger.info(f"Loaded {len(results)} precomputed analysis windows for {data_version}")
+    return {
+        # Every window was clamped to the same span of published years
+        'data_years': results[0]['payload']['data_years'] if results else None,
+        'windows': {(result['start_year'], result['end_year']): result['payload'] for result in results}
+    }
+
+def get_analysis_windows():
+    """Precomputed windows held in memory, like the prefix index, until the next processing run completes."""
+    return response_cache.get_or_build_value('analysis_windows', load_analysis_windows)
+
+def find_precomputed_analysis(datasets, start_year, end_year):
+    """Answer an /analyze request from the precomputed windows, or None if none matches."""
+    from analysis import clamp_window, select_precomputed
+
+    precomputed = get_analysis_windows()
+    if precomputed['data_years'] is None:
+        return None
+    window = clamp_window(start_year, end_year, *precomputed['data_years'])
+    payload = precomputed['windows'].get(window)
+    if payload is None:
+        return None
+    logger.info(f"Serving /analyze from precomputed window {window[0]}-{window[1]}")
+    return select_precomputed(payload, datasets)
+
 @app.post('/analyze')
 def analyze_datasets():
     """Perform statistical analysis on selected datasets."""
     try:
-        from flask import request
-        import numpy as np
-        from scipy.stats import pearsonr
+        from analysis import analyze_frame
 
         data = request.get_json()
         datasets = data.get('datasets', [])
@@ -119,106 +271,36 @@ def analyze_datasets():
         if not datasets:
             return jsonify({'error': 'No datasets specified'}), 400
 
-        # Get filtered data
-        climate_data = db_manager.get_climate_data(datasets)
-
-        if 'error' in climate_data:
-            return jsonify({'error': climate_data['error']}), 500
-
-        # Filter by year range if specified
-        if start_year and end_year:
-            filtered_years = []
-            filtered_data = {}
-
-            for i, year in enumerate(climate_data['years']):
-                if start_year <= year <= end_year:
-                    filtered_years.append(year)
-                    for dataset in datasets:
-                        if dataset not in filtered_data:
-                            filtered_data[dataset] = []
-                        if dataset in climate_data:
-                            filtered_data[dataset].append(climate_data[dataset][i])
-
-            climate_data['years'] = filtered_years
-            climate_data.update(filtered_data)
-
-        # Calculate correlation matrix
-        correlations = {}
-        if len(datasets) > 1:
-            for i, dataset1 in enumerate(datasets):
-                if dataset1 not in climate_data:
-                    continue
-                correlations[dataset1] = {}
-
-                for j, dataset2 in enumerate(datasets):
-                    if dataset2 not in climate_data:
-                        continue
-
-                    if i != j:
-                        # Filter out None values
-                        data1 = climate_data[dataset1]
-                        data2 = climate_data[dataset2]
-
-                        valid_pairs = [(d1, d2) for d1, d2 in zip(data1, data2)
-                                     if d1 is not None and d2 is not None]
-
-                        if len(valid_pairs) > 2:
-                            vals1, vals2 = zip(*valid_pairs)
-                            correlation, p_value = pearsonr(vals1, vals2)
-                            correlations[dataset1][dataset2] = {
-                                'correlation': round(correlation, 4),
-                                'p_value': round(p_value, 6),
-                                'n_samples': len(valid_pairs)
-                            }
-                        else:
-                            correlations[dataset1][dataset2] = {
-                                'correlation': None,
-                                'p_value': None,
-                                'n_samples': len(valid_pairs)
-                            }
-
-        # Calculate trend statistics
-        trends = {}
-        for dataset in datasets:
-            if dataset in climate_data and climate_data[dataset]:
-                years = climate_data['years']
-                values = climate_data[dataset]
-
-                # Filter valid data points
-                valid_data = [(year, val) for year, val in zip(years, values)
-                            if val is not None]
-
-                if len(valid_data) > 2:
-                    years_valid, values_valid = zip(*valid_data)
-
-                    # Calculate linear trend
-                    years_array = np.array(years_valid)
-                    values_array = np.array(values_valid)
-
-                    coefficients = np.polyfit(years_array, values_array, 1)
-                    slope_per_year = coefficients[0]
-                    slope_per_decade = slope_per_year * 10
-
-                    # Calculate R-squared
-                    trend_line = coefficients[0] * years_array + coefficients[1]
-                    ss_res = np.sum((values_array - trend_line) ** 2)
-                    ss_tot = np.sum((values_array - np.mean(values_array)) ** 2)
-                    r_squared = 1 - (ss_res / ss_tot) if ss_tot != 0 else 0
-
-                    trends[dataset] = {
-                        'slope_per_year': round(slope_per_year, 6),
-                        'slope_per_decade': round(slope_per_decade, 4),
-                        'r_squared': round(r_squared, 4),
-                        'n_samples': len(valid_data),
-                        'period': f"{min(years_valid)}-{max(years_valid)}"
-                    }
-
-        return jsonify({
-            'correlations': correlations,
-            'trends': trends,
-            'period': f"{min(climate_data['years'])}-{max(climate_data['years'])}" if climate_data['years'] else None,
-            'total_years': len(climate_data['years']) if climate_data['years'] else 0
-        })
+        # Either bound may be omitted for an open-ended range
+        try:
+            start_year = int(start_year) if start_year is not None else None
+            end_year = int(end_year) if end_year is not None else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'start_year and end_year must be integers'}), 400
+
+        # Standard windows are answered from the results precomputed for the published data
+        precomputed = find_precomputed_analysis(datasets, start_year, end_year)
+        if precomputed is not None:
+            return jsonify(precomputed)
+
+        # Ad-hoc windows are constant-time lookups in the in-memory prefix-sum index
+        index = get_prefix_index()
+        if index is not None:
+            return jsonify(index.analyze(datasets, start_year, end_year))
+
+        # The index could not be built (a database error); read the window directly, with the
+        # year range applied in the query. Published datasets without rows in the window are
+        # kept as empty columns so the response has the same shape as the index's
+        try:
+            frame = db_manager.get_climate_frame(datasets, start_year, end_year)
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to retrieve climate data: {e}")
+            return jsonify({'error': str(e)}), 500
+        published = db_manager.get_published_versions()
+        frame = frame.reindex(columns=[dataset for dataset in datasets if dataset in published])
+
+        # All correlations and trends come from one NaN-masked (years x datasets) array
+        return jsonify(analyze_frame(frame, datasets))
 
     except ImportError:
         return jsonify({'error': 'scipy not available for advanced statistics'}), 500
@@ -226,6 +308,372 @@ def analyze_datasets():
         logger.error(f"Error in statistical analysis: {e}")
         return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
 
+def as_list(values, digits):
+    """Rounded floats for JSON, with None for missing values."""
+    return [round(float(v), digits) if np.isfinite(v) else None for v in values]
+
+def build_grid_store(dataset):
+    """Load the published gridded product of a dataset into memory, or None if there is none."""
+    from gridded import GridStore
+
+    rows = db_manager.get_gridded_anomalies(dataset)
+    if not rows:
+        return None
+    store = GridStore(rows, db_manager.get_grid_cell_countries(dataset))
+    logger.info(f"Built grid store for {dataset}: {len(store.years)} years x {len(store.cells)} cells")
+    return store
+
+def get_grid_store(dataset):
+    """Gridded product held in memory until the next processing run completes."""
+    return response_cache.get_or_build_value(f'grid:{dataset}', lambda: build_grid_store(dataset))
+
+def grid_etag(dataset, *parts):
+    """ETag of a response derived from the published version of a gridded dataset."""
+    return make_etag('grid', dataset, db_manager.get_published_versions().get(dataset), *parts)
+
+@app.get('/grid')
+def year_grid():
+    """Anomaly of every grid cell with data in one year (annual mean, or one month)."""
+    try:
+        if db_manager is None:
+            return jsonify({'error': 'Database not initialized'}), 503
+
+        dataset = request.args.get('dataset', 'ghcn')
+        try:
+            year = int(request.args['year'])
+            month = int(request.args['month']) if request.args.get('month') else None
+        except (KeyError, ValueError):
+            return jsonify({'error': 'year (and optional month) must be integers'}), 400
+        if month is not None and not 1 <= month <= 12:
+            return jsonify({'error': 'month must be between 1 and 12'}), 400
+
+        store = get_grid_store(dataset)
+        if store is None:
+            return jsonify({'error': f'No gridded data for dataset {dataset}'}), 404
+
+        def build():
+            grid = store.year_grid(year, month)
+            if grid is None:
+                return None
+            return {
+                'dataset': dataset,
+                'grid_size': store.grid_size,
+                'year': year,
+                'month': month,
+                'cells': grid['cells'].tolist(),
+                'lat': grid['lat'].tolist(),
+                'lon': grid['lon'].tolist(),
+                'anomaly': as_list(grid['anomaly'], 3),
+                'weight': as_list(grid['weight'], 5)
+            }, grid_etag(dataset, year, month)
+
+        entry = response_cache.get_or_build(f'grid:{dataset}:{year}:{month or 0}', build)
+        if entry is None:
+            return jsonify({'error': f'No gridded data for {dataset} in {year}'}), 404
+        return cached_response(entry)
+
+    except Exception as e:
+        logger.error(f"Error in /grid endpoint: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.get('/grid/cell')
+def cell_series():
+    """Annual and monthly anomalies of one grid cell, by cell id or by coordinate."""
+    try:
+        if db_manager is None:
+            return jsonify({'error': 'Database not initialized'}), 503
+
+        dataset = request.args.get('dataset', 'ghcn')
+        store = get_grid_store(dataset)
+        if store is None:
+            return jsonify({'error': f'No gridded data for dataset {dataset}'}), 404
+
+        try:
+            if 'cell' in request.args:
+                cell = int(request.args['cell'])
+            else:
+                cell = store.cell_at(float(request.args['lat']), float(request.args['lon']))
+        except (KeyError, ValueError):
+            return jsonify({'error': 'Specify an integer cell or numeric lat and lon'}), 400
+
+        def build():
+            series = store.cell_series(cell)
+            if series is None:
+                return None
+            return {
+                'dataset': dataset,
+                'grid_size': store.grid_size,
+                'cell': cell,
+                'lat': series['lat'],
+                'lon': series['lon'],
+                'weight': round(series['weight'], 5),
+                'years': series['years'].tolist(),
+                'annual': as_list(series['annual'], 3),
+                'monthly': [as_list(months, 3) for months in series['monthly']]
+            }, grid_etag(dataset, 'cell', cell)
+
+        entry = response_cache.get_or_build(f'grid:{dataset}:cell:{cell}', build)
+        if entry is None:
+            return jsonify({'error': f'No gridded data for cell {cell} of {dataset}'}), 404
+        return cached_response(entry)
+
+    except Exception as e:
+        logger.error(f"Error in /grid/cell endpoint: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.get('/monthly')
+def monthly_series():
+    """Global mean anomaly of every month of a gridded dataset."""
+    try:
+        if db_manager is None:
+            return jsonify({'error': 'Database not initialized'}), 503
+
+        dataset = request.args.get('dataset', 'ghcn')
+        store = get_grid_store(dataset)
+        if store is None:
+            return jsonify({'error': f'No gridded data for dataset {dataset}'}), 404
+
+        entry = response_cache.get_or_build(f'grid:{dataset}:monthly', lambda: ({
+            'dataset': dataset,
+            'years': store.years.tolist(),
+            'monthly': [as_list(months, 3) for months in store.monthly]
+        }, grid_etag(dataset, 'monthly')))
+        return cached_response(entry)
+
+    except Exception as e:
+        logger.error(f"Error in /monthly endpoint: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def parse_region(args):
+    """Bounding box, latitude band and country codes of a /region request."""
+    bbox = lat_band = countries = None
+    if args.get('bbox'):
+        bbox = [float(value) for value in args['bbox'].split(',')]
+        if len(bbox) != 4:
+            raise ValueError('bbox must be west,south,east,north')
+    if args.get('lat_min') or args.get('lat_max'):
+        lat_band = (float(args.get('lat_min', -90)), float(args.get('lat_max', 90)))
+    if args.get('country'):
+        countries = [code.strip().upper() for code in args['country'].split(',')]
+    return bbox, lat_band, countries
+
+@app.get('/region')
+def regional_series():
+    """Weighted annual anomaly series of a bounding box, latitude band and/or set of countries."""
+    try:
+        if db_manager is None:
+            return jsonify({'error': 'Database not initialized'}), 503
+
+        dataset = request.args.get('dataset', 'ghcn')
+        try:
+            bbox, lat_band, countries = parse_region(request.args)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid region: {e}'}), 400
+
+        store = get_grid_store(dataset)
+        if store is None:
+            return jsonify({'error': f'No gridded data for dataset {dataset}'}), 404
+
+        # The per-cell weighted sums make any region one masked reduction
+        mask = store.region_mask(bbox, lat_band, countries)
+        if not mask.any():
+            return jsonify({'error': 'No grid cells with data in the requested region'}), 404
+        series = store.region_series(mask)
+
+        return jsonify({
+            'dataset': dataset,
+            'grid_size': store.grid_size,
+            'bbox': bbox,
+            'lat_band': lat_band,
+            'countries': countries,
+            'region_cells': int(mask.sum()),
+            'years': series['years'].tolist(),
+            'anomaly': as_list(series['anomaly'], 3),
+            'cells': series['cells'].tolist()
+        })
+
+    except Exception as e:
+        logger.error(f"Error in /region endpoint: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def build_station_index():
+    """Spatial index over the GHCN station metadata, or None if there is none."""
+    from stations import StationIndex
+    from scripts.transform_ghcn_raw import find_ghcn_files, read_station_metadata
+
+    try:
+        _, inv_path = find_ghcn_files(str(config.RAW_DATA_DIR))
+    except IndexError:
+        logger.error("No GHCN station metadata to index")
+        return None
+    index = StationIndex(read_station_metadata(inv_path))
+    logger.info(f"Built station index over {len(index.meta)} stations")
+    return index
+
+def build_station_records():
+    """GHCN station records grouped by station, with the configured QC policy applied."""
+    from stations import StationRecords
+    from scripts.clean_store import read_columns
+    from scripts.ghcn_reader import read_ghcn_dat
+    from scripts.transform_ghcn_raw import find_ghcn_files
+
+    # The station-level table written by the last GHCN transform, memory-mapped
+    columns = read_columns('ghcn_records', str(config.CLEAN_DATA_DIR))
+    if columns is not None:
+        records = StationRecords(columns, presorted=True)
+        logger.info(f"Loaded records of {len(records.stations)} stations from the clean store")
+        return records
+
+    try:
+        dat_path, _ = find_ghcn_files(str(config.RAW_DATA_DIR))
+        columns = read_ghcn_dat(dat_path, cache_dir=str(config.CACHE_DIR), qc_policy=config.GHCN_QC_POLICY)
+    except (IndexError, FileNotFoundError) as e:
+        logger.error(f"No GHCN station records to load: {e}")
+        return None
+    records = StationRecords(columns)
+    logger.info(f"Loaded records of {len(records.stations)} stations")
+    return records
+
+def station_list(rows):
+    """Station metadata rows as JSON-ready dicts."""
+    stations = []
+    for row in rows.itertuples(index=False):
+        station = {
+            'station': row.station,
+            'name': row.name,
+            'country_code': row.country_code,
+            'lat': float(row.lat),
+            'lon': float(row.lon),
+            'elev': float(row.elev) if np.isfinite(row.elev) else None
+        }
+        if hasattr(row, 'distance_km'):
+            station['distance_km'] = round(float(row.distance_km), 1)
+        stations.append(station)
+    return stations
+
+def parse_point(args):
+    """Latitude and longitude of a station query."""
+    lat, lon = float(args['lat']), float(args['lon'])
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('lat must be within [-90, 90] and lon within [-180, 180]')
+    return lat, lon
+
+@app.get('/stations/nearest')
+def nearest_stations():
+    """The N stations closest to a point."""
+    try:
+        try:
+            lat, lon = parse_point(request.args)
+            n = int(request.args.get('n', 10))
+        except (KeyError, ValueError) as e:
+            return jsonify({'error': f'lat, lon and optional integer n required: {e}'}), 400
+        if not 1 <= n <= 1000:
+            return jsonify({'error': 'n must be between 1 and 1000'}), 400
+
+        index = response_cache.get_or_build_value('station_index', build_station_index)
+        if index is None:
+            return jsonify({'error': 'No station metadata available'}), 404
+
+        return jsonify({'lat': lat, 'lon': lon, 'stations': station_list(index.nearest(lat, lon, n))})
+
+    except Exception as e:
+        logger.error(f"Error in /stations/nearest endpoint: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.get('/stations/within')
+def stations_within():
+    """Every station within a radius (km) of a point."""
+    try:
+        try:
+            lat, lon = parse_point(request.args)
+            radius_km = float(request.args['radius_km'])
+        except (KeyError, ValueError) as e:
+            return jsonify({'error': f'lat, lon and radius_km required: {e}'}), 400
+        if radius_km <= 0:
+            return jsonify({'error': 'radius_km must be positive'}), 400
+
+        index = response_cache.get_or_build_value('station_index', build_station_index)
+        if index is None:
+            return jsonify({'error': 'No station metadata available'}), 404
+
+        rows = index.within(lat, lon, radius_km)
+        return jsonify({'lat': lat, 'lon': lon, 'radius_km': radius_km, 'stations': station_list(rows)})
+
+    except Exception as e:
+        logger.error(f"Error in /stations/within endpoint: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.get('/stations/<station_id>/series')
+def station_series(station_id):
+    """A station's raw monthly values and anomalies from its 1961-1990 baselines."""
+    try:
+        index = response_cache.get_or_build_value('station_index', build_station_index)
+        meta = index.station(station_id) if index is not None else None
+        if meta is None:
+            return jsonify({'error': f'Unknown station {station_id}'}), 404
+
+        records = response_cache.get_or_build_value('station_records', build_station_records)
+        series = records.series(station_id) if records is not None else None
+        if series is None:
+            return jsonify({'error': f'No records for station {station_id}'}), 404
+
+        return jsonify({
+            **station_list(meta)[0],
+            'years': series['years'].tolist(),
+            'values': [as_list(months, 2) for months in series['values']],
+            'baselines': as_list(series['baselines'], 3),
+            'anomalies': [as_list(months, 3) for months in series['anomalies']],
+            'annual_anomaly': as_list(series['annual_anomaly'], 3)
+        })
+
+    except Exception as e:
+        logger.error(f"Error in /stations/{station_id}/series endpoint: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.get('/rolling-trend')
+def rolling_trend():
+    """Trend of every window of N consecutive years for the selected datasets."""
+    try:
+        if db_manager is None:
+            return jsonify({'error': 'Database not initialized'}), 503
+
+        try:
+            window = int(request.args.get('window', 30))
+        except ValueError:
+            return jsonify({'error': 'window must be an integer'}), 400
+        if window < 3:
+            return jsonify({'error': 'window must be at least 3 years'}), 400
+
+        index = get_prefix_index()
+        if index is None:
+            return jsonify({'error': 'Failed to retrieve data'}), 500
+
+        requested = request.args.get('datasets')
+        datasets = requested.split(',') if requested else index.datasets
+        columns = [index.datasets.index(d) for d in datasets if d in index.datasets]
+
+        # Every window comes out of one vectorized difference of prefix sums
+        rolling = index.rolling_trends(window)
+
+        trends = {}
+        for i in columns:
+            trends[index.datasets[i]] = {
+                'slope_per_decade': as_list(rolling['slope'][:, i] * 10, 4),
+                'r_squared': as_list(rolling['r_squared'][:, i], 4),
+                'n_samples': rolling['n_samples'][:, i].tolist()
+            }
+
+        return jsonify({
+            'window': window,
+            'start_years': rolling['start_years'],
+            'end_years': rolling['end_years'],
+            'trends': trends
+        })
+
+    except Exception as e:
+        logger.error(f"Error in rolling trend analysis: {e}")
+        return jsonify({'error': f'Rolling trend failed: {str(e)}'}), 500
+
 
 if __name__ == '__main__':
     app.run(debug=True)
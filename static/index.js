@@ -3,6 +3,37 @@
  * Interactive features: dataset toggles, time range selection, trend analysis, exports
  */
 
+// Packed binary /data format: 'CLF1', header length (uint32 LE), JSON header
+// padded to 4 bytes, then years (int32 LE) and one float32 LE column per dataset
+const PACKED_MIMETYPE = 'application/vnd.climate.f32';
+const PACKED_MAGIC = 'CLF1';
+
+// Missing values are null in JSON responses and NaN in packed ones
+function isMissing(value) {
+  return value === null || value === undefined || Number.isNaN(value);
+}
+
+function decodePackedData(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== PACKED_MAGIC) {
+    throw new Error('Unrecognized binary data format');
+  }
+
+  const headerLength = view.getUint32(4, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+  let offset = 8 + headerLength;
+
+  // Views over the response buffer; nothing is copied
+  const data = { years: new Int32Array(buffer, offset, header.n) };
+  offset += header.n * 4;
+  header.columns.forEach(column => {
+    data[column] = new Float32Array(buffer, offset, header.n);
+    offset += header.n * 4;
+  });
+  return data;
+}
+
 class ClimateVisualization {
   constructor() {
     this.chart = null;
@@ -134,8 +165,14 @@ class ClimateVisualization {
 
   async loadData() {
     try {
-      const response = await fetch('/data');
-      const data = await response.json();
+      // Ask for packed float32 columns; the server falls back to JSON
+      const response = await fetch('/data', {
+        headers: { 'Accept': `${PACKED_MIMETYPE}, application/json;q=0.5` }
+      });
+      const contentType = response.headers.get('Content-Type') || '';
+      const data = contentType.startsWith(PACKED_MIMETYPE)
+        ? decodePackedData(await response.arrayBuffer())
+        : await response.json();
       
       if (data.error) {
         throw new Error(data.error);
@@ -289,7 +326,7 @@ class ClimateVisualization {
     const gridColor = isDark ? 'rgba(255,255,255,0.1)' : 'rgba(0,0,0,0.1)';
     
     const chartData = {
-      labels: this.filteredData.years,
+      labels: Array.from(this.filteredData.years),
       datasets: this.buildChartDatasets()
     };
 
@@ -368,7 +405,7 @@ class ClimateVisualization {
           
           datasets.push({
             label: this.datasets[key].label,
-            data: this.filteredData[key],
+            data: Array.from(this.filteredData[key]),
             borderColor: this.datasets[key].color,
             backgroundColor: this.datasets[key].color + '20',
             borderWidth: seriesLineWidth,
@@ -450,9 +487,9 @@ class ClimateVisualization {
   }
 
   calculateLinearTrend(years, values) {
-    // Filter out null values
-    const validData = years.map((year, i) => ({ x: year, y: values[i] }))
-                           .filter(point => point.y !== null && point.y !== undefined);
+    // Filter out missing values (years and values may be typed arrays)
+    const validData = Array.from(years, (year, i) => ({ x: year, y: values[i] }))
+                           .filter(point => !isMissing(point.y));
     
     if (validData.length < 2) return null;
     
@@ -473,7 +510,7 @@ class ClimateVisualization {
     const rSquared = ssTot !== 0 ? 1 - (ssRes / ssTot) : 0;
     
     return {
-      data: years.map(year => slope * year + intercept),
+      data: Array.from(years, year => slope * year + intercept),
       slope: slope,
       rSquared: rSquared
     };
@@ -490,7 +527,7 @@ class ClimateVisualization {
         result.push(null);
       } else {
         const window = values.slice(i - halfWindow, i + halfWindow + 1);
-        const validValues = window.filter(v => v !== null && v !== undefined);
+        const validValues = window.filter(v => !isMissing(v));
         if (validValues.length > 0) {
           const avg = validValues.reduce((sum, val) => sum + val, 0) / validValues.length;
           result.push(avg);
@@ -505,7 +542,7 @@ class ClimateVisualization {
 
   updateChart() {
     if (this.chart) {
-      this.chart.data.labels = this.filteredData.years;
+      this.chart.data.labels = Array.from(this.filteredData.years);
       this.chart.data.datasets = this.buildChartDatasets();
       this.chart.update();
       this.updateStatistics();
@@ -591,7 +628,7 @@ class ClimateVisualization {
   }
 
   calculateStatistics(values) {
-    const validValues = values.filter(v => v !== null && v !== undefined);
+    const validValues = values.filter(v => !isMissing(v));
     
     if (validValues.length === 0) {
       return { mean: 'N/A', stdDev: 'N/A', min: 'N/A', max: 'N/A' };
@@ -629,7 +666,8 @@ class ClimateVisualization {
       csv += year;
       visibleDatasets.forEach(key => {
         const value = this.filteredData[key][index];
-        csv += `,${value !== null && value !== undefined ? value : ''}`;
+        // Float32 values carry about 7 significant digits
+        csv += `,${isMissing(value) ? '' : Number(value.toPrecision(7))}`;
       });
       csv += '\n';
     });
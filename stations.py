@@ -0,0 +1,103 @@
+"""
+Spatial index over GHCN station metadata and per-station series lookups.
+Stations are placed on the unit sphere and indexed with a k-d tree, so
+nearest-station and radius queries are chord-distance searches that are
+exact for great-circle distances. Station records are sorted by station
+once, so a station's series is a slice of the decoded columns.
+"""
+
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from scripts.ghcn_wide import station_baselines
+
+# Mean Earth radius used to convert chord lengths to great-circle distances
+EARTH_RADIUS_KM = 6371.0
+
+def unit_vectors(lat, lon) -> np.ndarray:
+    """(n, 3) Cartesian coordinates of latitude/longitude points on the unit sphere."""
+    lat = np.deg2rad(np.asarray(lat, dtype=np.float64))
+    lon = np.deg2rad(np.asarray(lon, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    """Great-circle distance in km of a chord length on the unit sphere."""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0.0, 1.0))
+
+def km_to_chord(distance_km: float) -> float:
+    """Chord length on the unit sphere of a great-circle distance in km."""
+    return 2 * np.sin(min(distance_km / EARTH_RADIUS_KM, np.pi) / 2)
+
+class StationIndex:
+    """k-d tree over the unit-sphere positions of the stations in an .inv file."""
+
+    def __init__(self, meta: pd.DataFrame):
+        meta = meta.dropna(subset=['lat', 'lon']).reset_index(drop=True)
+        self.meta = meta
+        self.tree = cKDTree(unit_vectors(meta['lat'], meta['lon']))
+        self.positions = pd.Index(meta['station'])
+
+    def _rows(self, positions: np.ndarray, chords: np.ndarray) -> pd.DataFrame:
+        rows = self.meta.iloc[positions].copy()
+        rows['distance_km'] = chord_to_km(chords)
+        return rows
+
+    def nearest(self, lat: float, lon: float, n: int = 10) -> pd.DataFrame:
+        """The n stations closest to a point, nearest first."""
+        n = min(n, len(self.meta))
+        chords, positions = self.tree.query(unit_vectors([lat], [lon])[0], k=n)
+        return self._rows(np.atleast_1d(positions), np.atleast_1d(chords))
+
+    def within(self, lat: float, lon: float, radius_km: float) -> pd.DataFrame:
+        """Every station within radius_km of a point, nearest first."""
+        point = unit_vectors([lat], [lon])[0]
+        positions = np.array(self.tree.query_ball_point(point, km_to_chord(radius_km)), dtype=np.int64)
+        chords = np.linalg.norm(self.tree.data[positions] - point, axis=1)
+        order = np.argsort(chords, kind='stable')
+        return self._rows(positions[order], chords[order])
+
+    def station(self, station_id: str) -> Optional[pd.DataFrame]:
+        """One-row metadata frame of a station, or None if it is not in the index."""
+        position = self.positions.get_indexer([station_id])[0]
+        if position < 0:
+            return None
+        return self.meta.iloc[[position]]
+
+class StationRecords:
+    """Decoded .dat columns grouped by station for per-station series."""
+
+    def __init__(self, columns: Dict[str, np.ndarray], presorted: bool = False):
+        # Columns from the clean store's ghcn_records table are already sorted by station and year
+        order = slice(None) if presorted else np.lexsort((columns['year'], columns['station']))
+        self.station = columns['station'][order]
+        self.year = columns['year'][order].astype(np.int64)
+        self.values = columns['values'][order]
+        self.stations, self.starts = np.unique(self.station, return_index=True)
+        self.ends = np.r_[self.starts[1:], len(self.station)]
+
+    def series(self, station_id: str) -> Optional[Dict]:
+        """A station's monthly values and their anomalies from its own 1961-1990 baselines."""
+        key = station_id.encode()
+        i = np.searchsorted(self.stations, key)
+        if i >= len(self.stations) or self.stations[i] != key:
+            return None
+
+        years = self.year[self.starts[i]:self.ends[i]]
+        values = self.values[self.starts[i]:self.ends[i]]
+        baselines = station_baselines(np.zeros(len(years), dtype=np.int64), years, values, 1)[0]
+        anomalies = values - baselines
+
+        # Annual anomaly over the months with an anomaly, NaN where there are none
+        present = ~np.isnan(anomalies)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            annual = np.where(present, anomalies, 0.0).sum(axis=1) / present.sum(axis=1)
+        return {
+            'years': years,
+            'values': values,
+            'baselines': baselines,
+            'anomalies': anomalies,
+            'annual_anomaly': annual,
+        }
@@ -0,0 +1,141 @@
+import io
+import os
+import sys
+import tarfile
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Make the application modules and the scripts package importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing the app modules reads the configuration, creates its folders and opens the log file;
+# keep all of that out of the working tree (tests point the folders they use at tmp_path)
+os.environ.setdefault('FLASK_ENV', 'testing')
+os.environ.setdefault('DATA_DIR', os.path.join(tempfile.gettempdir(), 'climate-tests-data'))
+os.environ.setdefault('LOG_FILE', os.devnull)
+
+FIXTURE_RELEASE = 'ghcnm.v4.0.1.20240101'
+FIXTURE_DAT = 'ghcnm.tavg.v4.0.1.20240101.qcu.dat'
+FIXTURE_INV = 'ghcnm.tavg.v4.0.1.20240101.qcu.inv'
+
+
+def write_ghcn_raw(raw_dir, n_stations=40, years=range(1950, 2001), seed=0, shift=None, qc_rate=0.02):
+    """
+    Write a small synthetic GHCN-M v4 release, its .inv and a 5 degree landmask.
+
+    Values are whole hundredths of a degree, as in the real files, so most
+    are not exact in float32 and the engines' rounding shows. shift maps a year to an offset added to every value of
+    that year, to simulate a revised release. Returns the .dat path.
+    """
+    rng = np.random.default_rng(seed)
+    years = np.asarray(list(years))
+    release_dir = os.path.join(raw_dir, FIXTURE_RELEASE)
+    os.makedirs(release_dir, exist_ok=True)
+
+    countries = np.array(['US', 'CA', 'BR', 'AU'])
+    ids = [f"{countries[i % len(countries)]}{i:09d}" for i in range(n_stations)]
+    lat = rng.uniform(-60, 75, n_stations)
+    lon = rng.uniform(-180, 180, n_stations)
+    with open(os.path.join(release_dir, FIXTURE_INV), 'w') as f:
+        for station, station_lat, station_lon in zip(ids, lat, lon):
+            f.write(f"{station} {station_lat:8.4f} {station_lon:9.4f} {100.0:6.1f} STATION {station}\n")
+
+    # Every station carries a climatology, a shared trend and noise, with some months missing or flagged
+    climatology = rng.uniform(-10, 25, (n_stations, 12))
+    lines = []
+    for s, station in enumerate(ids):
+        for year in years:
+            values = climatology[s] + 0.01 * (year - years[0]) + rng.normal(0, 0.8, 12)
+            if shift is not None:
+                values = values + shift.get(int(year), 0.0)
+            hundredths = np.round(values * 100).astype(int)
+            missing = rng.random(12) < 0.05
+            flagged = rng.random(12) < qc_rate
+            fields = []
+            for value, is_missing, is_flagged in zip(hundredths, missing, flagged):
+                fields.append(f"{-9999 if is_missing else value:5d} {'D' if is_flagged else ' '}E")
+            lines.append(f"{station}{year:4d}TAVG" + ''.join(fields) + '\n')
+    # A station that is not in the metadata is ignored by every engine
+    lines.append('ZZ999999999' + f"{years[0]:4d}TAVG" + f"{100:5d}  E" * 12 + '\n')
+
+    dat_path = os.path.join(release_dir, FIXTURE_DAT)
+    with open(dat_path, 'w') as f:
+        f.writelines(lines)
+
+    # Land everywhere except one polar band, so stations there are dropped by the landmask join
+    lat_centers = np.arange(-87.5, 90, 5)
+    lon_centers = np.arange(-177.5, 180, 5)
+    cells = [(cell_lat, cell_lon) for cell_lat in lat_centers if cell_lat < 72.5 for cell_lon in lon_centers]
+    land = rng.uniform(0.1, 1.0, len(cells))
+    pd.DataFrame({
+        'gridbox': [f"{cell_lat} lat {cell_lon} lon" for cell_lat, cell_lon in cells],
+        'land_percent': land,
+        'ocean_percent': 1.0 - land,
+    }).to_stata(os.path.join(raw_dir, 'landmask.dta'), write_index=False)
+    return dat_path
+
+
+def gridded_products(years=range(1990, 2001), n_stations=60, seed=0, grid_size=5.0):
+    """
+    Gridded products of random station observations, shaped like the GHCN transform's stats['gridded'].
+
+    Two stations sit on either side of the antimeridian. Box weights are the
+    cells' relative areas, and the global annual series is under 'annual'.
+    """
+    from scripts.aggregation import grid_reduce
+    from scripts.gridding import band_weights, cell_id, grid_indices
+
+    rng = np.random.default_rng(seed)
+    lat = np.concatenate([[12.0, -33.0], rng.uniform(-85, 85, n_stations - 2)])
+    lon = np.concatenate([[178.0, -179.0], rng.uniform(-180, 180, n_stations - 2)])
+    countries = np.array(['US', 'CA', 'BR', 'AU'])[np.arange(n_stations) % 4]
+    lat_idx, lon_idx = grid_indices(lat, lon, grid_size)
+    station_cell = cell_id(lat_idx, lon_idx, grid_size)
+
+    # One observation per station, year and month, with some months missing
+    station, year, month = (a.ravel() for a in np.meshgrid(np.arange(n_stations), np.asarray(list(years)),
+                                                             np.arange(1, 13), indexing='ij'))
+    keep = rng.random(len(station)) > 0.1
+    station, year, month = station[keep], year[keep], month[keep]
+    values = rng.normal(0, 1, len(station)) + 0.02 * (year - year.min())
+    weights = band_weights(lat_idx[station], grid_size)
+
+    products = grid_reduce(station_cell[station], month, year, values, weights, grid_size)
+    return {
+        'boxes': products['boxes'],
+        'monthly': products['monthly'],
+        'annual': products['annual'],
+        'grid_size': float(grid_size),
+        'cell_countries': {country: np.unique(station_cell[countries == country]).tolist()
+                           for country in np.unique(countries)},
+    }
+
+
+def haversine_km(lat, lon, station_lat, station_lon):
+    """Great-circle distance in km computed directly, to check the station index against."""
+    from stations import EARTH_RADIUS_KM
+
+    lat, lon, station_lat, station_lon = map(np.deg2rad, (lat, lon, station_lat, station_lon))
+    a = (np.sin((station_lat - lat) / 2) ** 2
+         + np.cos(lat) * np.cos(station_lat) * np.sin((station_lon - lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def ghcn_archive(raw_dir):
+    # The release under raw_dir as a .tar.gz laid out like the NOAA one: a ghcnm.* folder with the .dat and .inv
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        archive.add(os.path.join(raw_dir, FIXTURE_RELEASE), arcname=FIXTURE_RELEASE)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def ghcn_raw(tmp_path, monkeypatch):
+    """A synthetic GHCN release under tmp_path/data/raw, with tmp_path as the working directory."""
+    monkeypatch.chdir(tmp_path)
+    raw_dir = tmp_path / 'data' / 'raw'
+    write_ghcn_raw(str(raw_dir))
+    return raw_dir
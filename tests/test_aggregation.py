@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from scripts.aggregation import box_sums, merge_box_sums, weighted_mean
+
+
+def test_weighted_mean_skips_missing_values_like_groupby():
+    frame = pd.DataFrame({
+        'year': [2000, 2000, 2000, 2001, 2001, 2002],
+        'value': [0.5, np.nan, 1.0, 0.25, 0.75, np.nan],
+    })
+    years, means, weight_sums = weighted_mean(frame['year'], frame['value'])
+
+    expected = frame.groupby('year')['value'].mean()
+    np.testing.assert_array_equal(years, expected.index)
+    np.testing.assert_allclose(means, expected.to_numpy(), equal_nan=True)
+    np.testing.assert_array_equal(weight_sums, [2, 2, 0])
+
+
+def test_weighted_mean_ignores_the_weight_of_missing_values():
+    years, means, weight_sums = weighted_mean([1, 1, 1], [1.0, np.nan, 3.0], [1.0, 5.0, 3.0])
+    np.testing.assert_allclose(means, [2.5])
+    np.testing.assert_allclose(weight_sums, [4.0])
+
+
+def test_merged_partial_box_sums_match_one_pass():
+    rng = np.random.default_rng(0)
+    n = 500
+    cell, month, year = rng.integers(0, 20, n), rng.integers(1, 13, n), rng.integers(1950, 1960, n)
+    values, weights = rng.normal(0, 1, n), rng.uniform(0.1, 1, n)
+
+    expected = box_sums(cell, month, year, values, weights)
+    merged = box_sums([], [], [], [], [])
+    for part in np.array_split(np.arange(n), 4):
+        merged = merge_box_sums([merged, box_sums(cell[part], month[part], year[part], values[part],
+                                                  weights[part])])
+    np.testing.assert_array_equal(merged['key'], expected['key'])
+    for column in ('sum', 'weight', 'count'):
+        np.testing.assert_allclose(merged[column], expected[column], rtol=1e-12)
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from analysis import (PrefixSumIndex, analyze_frame, linear_trends, pairwise_correlations, precompute_windows,
+                      select_precomputed)
+
+EMPTY_RESPONSE = {'correlations': {}, 'trends': {}, 'period': None, 'total_years': 0}
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    years = np.arange(1880, 2026)
+    values = {
+        'giss': 0.008 * (years - 1880) + rng.normal(0, 0.1, len(years)),
+        'crutem': 0.007 * (years - 1880) + rng.normal(0, 0.1, len(years)),
+        'ghcn': 0.009 * (years - 1880) + rng.normal(0, 0.1, len(years)),
+    }
+    frame = pd.DataFrame(values, index=pd.Index(years, name='year'))
+    # Series with gaps and different spans, as the published datasets have
+    frame.loc[:1899, 'crutem'] = np.nan
+    frame.loc[1950:1955, 'ghcn'] = np.nan
+    frame.loc[2024:, 'giss'] = np.nan
+    return frame
+
+
+@pytest.mark.parametrize('start, end', [(None, None), (1900, None), (1951, 1980), (1979, 2025), (1890, 1910),
+                                        (1800, 1885), (2020, 2100)])
+def test_windows_match_analyze_frame(frame, start, end):
+    datasets = ['giss', 'crutem', 'ghcn']
+    # What the database path analyzes: the years with data in the window
+    window = frame.loc[start:end].dropna(how='all')
+    expected = analyze_frame(window, datasets)
+    assert PrefixSumIndex(frame).analyze(datasets, start, end) == expected
+
+
+@pytest.mark.parametrize('start, end', [(2100, None), (2100, 2200), (None, 1700), (1990, 1980)])
+def test_windows_outside_the_data_are_empty(frame, start, end):
+    empty = {'correlation': None, 'p_value': None, 'n_samples': 0}
+    assert PrefixSumIndex(frame).analyze(['giss', 'ghcn'], start, end) == {
+        **EMPTY_RESPONSE, 'correlations': {'giss': {'ghcn': empty}, 'ghcn': {'giss': empty}}}
+    assert PrefixSumIndex(frame).analyze(['giss'], start, end) == EMPTY_RESPONSE
+
+
+def test_empty_index():
+    index = PrefixSumIndex(pd.DataFrame())
+    assert index.analyze(['giss', 'ghcn'], None, None) == EMPTY_RESPONSE
+    assert index.analyze(['giss', 'ghcn'], 2100, None) == EMPTY_RESPONSE
+    assert index.rolling_trends(30)['start_years'] == []
+
+
+def test_datasets_without_data_in_the_window_keep_their_entries(frame):
+    # crutem starts in 1900, so it has no data in 1880-1899
+    response = PrefixSumIndex(frame).analyze(['giss', 'crutem'], 1880, 1899)
+    assert response['correlations']['crutem'] == {'giss': {'correlation': None, 'p_value': None, 'n_samples': 0}}
+    assert response['correlations']['giss']['crutem']['n_samples'] == 0
+    assert list(response['trends']) == ['giss']
+
+    [window] = precompute_windows(frame, [(1880, 1899)])
+    assert select_precomputed(window['payload'], ['giss', 'crutem']) == response
+
+
+@pytest.fixture
+def gappy():
+    rng = np.random.default_rng(1)
+    years = np.arange(1950, 2000)
+    values = np.column_stack([0.02 * (years - 1950) + rng.normal(0, 0.2, len(years)) for _ in range(4)])
+    values[rng.random(values.shape) < 0.2] = np.nan
+    # Column 2 only overlaps column 3 in one year, and column 1 in two
+    values[:, 3] = np.nan
+    values[10, 3] = 0.5
+    values[:, 2] = np.nan
+    values[[10, 20, 30], 2] = [0.1, 0.4, 0.2]
+    values[[10, 20, 30], 1] = [np.nan, 0.3, 0.6]
+    return pd.DataFrame(values, index=pd.Index(years, name='year'), columns=['a', 'b', 'c', 'd'])
+
+
+def test_correlations_and_trends_match_scipy(gappy):
+    values = gappy.to_numpy()
+    r, p, n = pairwise_correlations(values)
+    for i in range(4):
+        for j in range(4):
+            both = ~np.isnan(values[:, i]) & ~np.isnan(values[:, j])
+            assert n[i, j] == both.sum()
+            if i == j or both.sum() <= 2:
+                continue
+            expected = stats.pearsonr(values[both, i], values[both, j])
+            np.testing.assert_allclose([r[i, j], p[i, j]], [expected[0], expected[1]], rtol=1e-9, atol=1e-12)
+
+    fit = linear_trends(gappy.index.to_numpy(), values)
+    for i in range(2):
+        present = ~np.isnan(values[:, i])
+        expected = stats.linregress(gappy.index.to_numpy()[present], values[present, i])
+        np.testing.assert_allclose([fit['slope'][i], fit['intercept'][i], fit['r_squared'][i]],
+                                   [expected.slope, expected.intercept, expected.rvalue ** 2], rtol=1e-9)
+
+
+def test_analyze_frame_reports_short_overlaps_without_statistics(gappy):
+    response = analyze_frame(gappy, ['a', 'b', 'c', 'd'])
+    none = {'correlation': None, 'p_value': None}
+    assert response['correlations']['c']['d'] == {**none, 'n_samples': 1}
+    assert response['correlations']['d']['c'] == {**none, 'n_samples': 1}
+    assert response['correlations']['c']['b']['correlation'] is None
+    assert response['correlations']['a']['b']['correlation'] is not None
+    # Series with fewer than three values have no trend
+    assert sorted(response['trends']) == ['a', 'b', 'c']
+    assert response['total_years'] == 50
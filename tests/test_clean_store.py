@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from scripts import clean_store
+from scripts.clean_store import read_columns, remove_table, table_path, write_table
+
+
+@pytest.fixture(params=['arrow', 'npz'])
+def store_format(request, monkeypatch):
+    if request.param == 'arrow':
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(clean_store, 'pa', None)
+    return request.param
+
+
+def test_station_records_roundtrip(tmp_path, store_format):
+    values = np.arange(36, dtype=np.float64).reshape(3, 12)
+    values[1, 4] = np.nan
+    write_table('ghcn_records', {'station': ['US000000001', 'US000000001', 'CA000000002'],
+                                 'year': [1950, 1951, 1950], 'values': values}, str(tmp_path))
+    assert table_path('ghcn_records', str(tmp_path)).endswith('.' + store_format)
+
+    columns = read_columns('ghcn_records', str(tmp_path))
+    np.testing.assert_array_equal(columns['station'], np.array([b'US000000001', b'US000000001', b'CA000000002']))
+    assert columns['year'].dtype == np.int16
+    assert columns['values'].dtype == np.float32
+    np.testing.assert_array_equal(columns['values'], values.astype(np.float32))
+
+    remove_table('ghcn_records', str(tmp_path))
+    assert read_columns('ghcn_records', str(tmp_path)) is None
+
+
+def test_missing_columns_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        write_table('giss', {'year': [2000]}, str(tmp_path))
@@ -0,0 +1,168 @@
+import logging
+import os
+
+import pytest
+
+import data_processor
+from conftest import gridded_products, write_ghcn_raw
+from data_processor import DataProcessor, config
+from database import DatabaseManager, ProcessingLog
+from gridded import pack_gridded_products
+from scripts import ghcn_reader, transform_ghcn_raw
+from scripts.clean_store import read_columns
+from scripts.ghcn_reader import file_digest
+from scripts.transform_ghcn_raw import STATION_TABLES
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    # Raw data outside the working directory, so only the configured folders can be found
+    monkeypatch.chdir(tmp_path)
+    for name in ('RAW_DATA_DIR', 'CLEAN_DATA_DIR', 'CACHE_DIR'):
+        monkeypatch.setattr(config, name, tmp_path / 'configured' / name.lower())
+    monkeypatch.setattr(config, 'GHCN_QC_POLICY', 'keep_all')
+    write_ghcn_raw(str(config.RAW_DATA_DIR), n_stations=10)
+
+    processor = DataProcessor()
+    processor.db_manager = DatabaseManager(f"sqlite:///{tmp_path / 'climate.db'}")
+    processor.db_manager.create_tables()
+    return processor
+
+
+def test_transforms_read_the_configured_raw_folder(processor):
+    results = processor.transform_and_store_data()
+    # Only the GHCN release is in the fixture
+    assert results == {'giss': False, 'crutem': False, 'ghcn': True}
+    assert processor.db_manager.get_published_versions() == {'ghcn': 1}
+
+    fingerprints = processor.db_manager.get_fingerprints('ghcn')
+    assert 'output' not in fingerprints
+    assert any(source.endswith('.dat') for source in fingerprints)
+
+
+def test_changing_the_engine_runs_the_transform_again(processor, monkeypatch):
+    def ghcn_statuses():
+        # Newest first
+        with processor.db_manager.get_session() as session:
+            runs = session.query(ProcessingLog).filter(ProcessingLog.process_type == 'transform',
+                                                       ProcessingLog.message.startswith('GHCN'))
+            return [run.status for run in runs.order_by(ProcessingLog.id.desc())]
+
+    processor.transform_and_store_data()
+    processor.transform_and_store_data()
+    assert ghcn_statuses()[0] == 'skipped'
+
+    monkeypatch.setattr(config, 'GHCN_ENGINE', 'chunked')
+    assert processor.transform_and_store_data()['ghcn']
+    assert ghcn_statuses()[0] == 'success'
+
+
+def test_station_tables_follow_the_engine(processor, monkeypatch, caplog):
+    import server
+
+    def station_records():
+        caplog.clear()
+        with caplog.at_level(logging.INFO, logger='server'):
+            records = server.build_station_records()
+        # Every station of the .dat, including the one missing from the metadata
+        assert len(records.stations) == 11
+        return 'from the clean store' in caplog.text
+
+    # The wide engine writes the station records where the server reads them
+    processor.transform_and_store_data()
+    clean_dir = str(config.CLEAN_DATA_DIR)
+    for name in STATION_TABLES:
+        assert read_columns(name, clean_dir) is not None
+    assert station_records()
+
+    # Other engines drop them, and the server falls back on the raw .dat
+    monkeypatch.setattr(config, 'GHCN_ENGINE', 'chunked')
+    processor.transform_and_store_data()
+    for name in STATION_TABLES:
+        assert read_columns(name, clean_dir) is None
+    assert not station_records()
+
+
+def test_failed_gridded_store_is_retried(processor, monkeypatch):
+    store_gridded_anomalies = processor.db_manager.store_gridded_anomalies
+    monkeypatch.setattr(processor.db_manager, 'store_gridded_anomalies', lambda *args, **kwargs: False)
+    assert processor.transform_and_store_data()['ghcn']
+    assert processor.db_manager.get_fingerprints('ghcn') == {}
+
+    # Unchanged inputs are transformed again, and this time the gridded products are stored
+    monkeypatch.setattr(processor.db_manager, 'store_gridded_anomalies', store_gridded_anomalies)
+    assert processor.transform_and_store_data()['ghcn']
+    assert processor.db_manager.get_gridded_anomalies('ghcn')
+    assert processor.db_manager.get_fingerprints('ghcn')
+
+
+def test_raw_files_are_hashed_once_per_run(processor, monkeypatch):
+    hashed = []
+
+    def counting_digest(path, *args):
+        hashed.append(os.path.normpath(path))
+        return file_digest(path, *args)
+
+    for module in (data_processor, ghcn_reader, transform_ghcn_raw):
+        monkeypatch.setattr(module, 'file_digest', counting_digest)
+    monkeypatch.setattr(config, 'GHCN_INCREMENTAL', True)
+    assert processor.transform_and_store_data()['ghcn']
+    assert len(hashed) == 3  # .dat, .inv and landmask
+    assert len(set(hashed)) == len(hashed)
+
+
+def test_incremental_gridded_store_copies_the_unchanged_years(processor):
+    db = processor.db_manager
+    full = gridded_products()
+    packed = pack_gridded_products(full['boxes'], full['monthly'], full['grid_size'])
+    assert db.store_climate_data('ghcn', full['annual'])
+    assert processor.store_gridded_products('ghcn', {'gridded': full}, None)
+    assert db.get_gridded_anomalies('ghcn') == packed
+    assert db.get_grid_cell_countries('ghcn') == full['cell_countries']
+
+    # An incremental run recomputes only 2000, and its annual update publishes version 2
+    revised = gridded_products(seed=1)
+    recomputed = {name: revised[name][revised[name]['year'] == 2000] for name in ('boxes', 'monthly')}
+    annual = full['annual'].copy()
+    annual.loc[annual['year'] == 2000] = revised['annual'][revised['annual']['year'] == 2000].to_numpy()
+    assert db.store_climate_updates('ghcn', annual, [2000])
+    assert db.get_published_versions() == {'ghcn': 2}
+
+    stats = {'gridded': {**revised, **recomputed}, 'changed_years': [2000]}
+    assert processor.store_gridded_products('ghcn', stats, previous_version=1)
+    assert db.get_gridded_anomalies('ghcn') == packed[:-1] + pack_gridded_products(
+        recomputed['boxes'], recomputed['monthly'], revised['grid_size'])
+    assert db.get_grid_cell_countries('ghcn') == revised['cell_countries']
+
+    # The previous version keeps its own grids
+    assert db.publish_version('ghcn', 1)
+    assert db.get_gridded_anomalies('ghcn') == packed
+
+
+def test_worker_processes_store_the_serial_results(processor, tmp_path, monkeypatch):
+    db = processor.db_manager
+    assert processor.transform_and_store_data() == {'giss': False, 'crutem': False, 'ghcn': True}
+
+    # A second database and output folders, filled by transforms running in worker processes
+    monkeypatch.setattr(config, 'CLEAN_DATA_DIR', tmp_path / 'parallel' / 'clean')
+    monkeypatch.setattr(config, 'CACHE_DIR', tmp_path / 'parallel' / 'cache')
+    parallel = DataProcessor()
+    parallel.db_manager = DatabaseManager(f"sqlite:///{tmp_path / 'parallel.db'}")
+    parallel.db_manager.create_tables()
+    assert parallel.transform_and_store_data(workers=2) == {'giss': False, 'crutem': False, 'ghcn': True}
+
+    assert parallel.db_manager.get_climate_frame().equals(db.get_climate_frame())
+    assert parallel.db_manager.get_gridded_anomalies('ghcn') == db.get_gridded_anomalies('ghcn')
+    assert parallel.db_manager.get_grid_cell_countries('ghcn') == db.get_grid_cell_countries('ghcn')
+    assert parallel.db_manager.get_fingerprints('ghcn') == db.get_fingerprints('ghcn')
+
+
+def test_a_failing_worker_fails_only_its_dataset(processor):
+    # The GISS and CRUTEM files are missing, so their transforms raise in the workers
+    assert processor.transform_and_store_data(workers=3) == {'giss': False, 'crutem': False, 'ghcn': True}
+    assert processor.db_manager.get_published_versions() == {'ghcn': 1}
+
+    with processor.db_manager.get_session() as session:
+        runs = {run.message.split()[0].rstrip(':'): run.status for run in
+                session.query(ProcessingLog).filter(ProcessingLog.process_type == 'transform')}
+    assert runs == {'GISS': 'failure', 'CRUTEM': 'failure', 'GHCN': 'success'}
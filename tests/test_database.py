@@ -0,0 +1,121 @@
+import pandas as pd
+import pytest
+from sqlalchemy import inspect, text
+
+from database import DatabaseManager
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(f"sqlite:///{tmp_path / 'climate.db'}")
+    manager.create_tables()
+    return manager
+
+
+def series(values, start=2000):
+    return pd.DataFrame({'year': range(start, start + len(values)), 'anomaly (deg C)': values})
+
+
+@pytest.mark.parametrize('bulk', [True, False])
+def test_every_changed_load_is_a_new_published_version(db, bulk):
+    assert db.store_climate_data('giss', series([0.1, 0.2, 0.3]), bulk=bulk)
+    assert db.store_climate_data('giss', series([0.1, 0.25]), bulk=bulk)
+
+    assert db.get_published_versions() == {'giss': 2}
+    assert db.get_climate_data(['giss']) == {'years': [2000, 2001], 'giss': [0.1, 0.25]}
+
+    assert db.rollback_dataset('giss')
+    assert db.get_climate_data(['giss']) == {'years': [2000, 2001, 2002], 'giss': [0.1, 0.2, 0.3]}
+
+
+def test_identical_load_keeps_the_published_version(db):
+    assert db.store_climate_data('giss', series([0.1, 0.2]))
+    assert db.store_climate_data('giss', series([0.1, 0.2, None]))
+    assert db.get_published_versions() == {'giss': 1}
+
+
+def test_updates_copy_the_untouched_years(db):
+    assert db.store_climate_data('ghcn', series([0.1, 0.2, 0.3]))
+    assert db.store_climate_updates('ghcn', series([0.1, 0.2, 0.35, 0.4]), years=[2002, 2003])
+
+    assert db.get_published_versions() == {'ghcn': 2}
+    assert db.get_climate_data(['ghcn']) == {'years': [2000, 2001, 2002, 2003], 'ghcn': [0.1, 0.2, 0.35, 0.4]}
+
+
+def test_old_versions_are_pruned(tmp_path):
+    db = DatabaseManager(f"sqlite:///{tmp_path / 'climate.db'}", keep_versions=2)
+    db.create_tables()
+    for value in (0.1, 0.2, 0.3):
+        assert db.store_climate_data('crutem', series([value]))
+    assert db.get_published_versions() == {'crutem': 3}
+    assert not db.rollback_dataset('crutem', 1)
+    assert db.rollback_dataset('crutem', 2)
+
+
+# climate_data as created before dataset versioning: a plain (dataset, year)
+# index, or the unique constraint of the bulk-upsert schema
+LEGACY_TABLES = {
+    'index': (
+        'CREATE TABLE climate_data (id INTEGER PRIMARY KEY, dataset VARCHAR(50) NOT NULL, year INTEGER NOT NULL, '
+        'anomaly FLOAT NOT NULL, created_at DATETIME, updated_at DATETIME)',
+        'CREATE INDEX idx_dataset_year ON climate_data (dataset, year)',
+    ),
+    'unique': (
+        'CREATE TABLE climate_data (id INTEGER PRIMARY KEY, dataset VARCHAR(50) NOT NULL, year INTEGER NOT NULL, '
+        'anomaly FLOAT NOT NULL, created_at DATETIME, updated_at DATETIME, '
+        'CONSTRAINT uq_dataset_year UNIQUE (dataset, year))',
+    ),
+}
+
+
+def legacy_database(tmp_path, schema):
+    manager = DatabaseManager(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with manager.engine.begin() as conn:
+        for statement in LEGACY_TABLES[schema]:
+            conn.execute(text(statement))
+        rows = [('giss', 2000, 0.1), ('giss', 2001, 0.2), ('ghcn', 2000, 0.3)]
+        if schema == 'index':
+            # An interrupted load could leave a duplicate year behind; the newest row wins
+            rows.append(('giss', 2001, 0.25))
+        for dataset, year, anomaly in rows:
+            conn.execute(text('INSERT INTO climate_data (dataset, year, anomaly) VALUES (:dataset, :year, :anomaly)'),
+                         {'dataset': dataset, 'year': year, 'anomaly': anomaly})
+    return manager
+
+
+def assert_migrated(manager, giss):
+    assert manager.get_published_versions() == {'ghcn': 1, 'giss': 1}
+    assert manager.get_climate_data(['giss']) == {'years': [2000, 2001], 'giss': giss}
+
+    # New versions get fresh ids next to the migrated rows
+    assert manager.store_climate_data('giss', series([0.1, 0.2, 0.3]))
+    assert manager.store_climate_data('ghcn', series([0.5]))
+    assert manager.get_published_versions() == {'ghcn': 2, 'giss': 2}
+    assert manager.rollback_dataset('giss')
+    assert manager.get_climate_data(['giss']) == {'years': [2000, 2001], 'giss': giss}
+
+
+@pytest.mark.parametrize('schema, giss', [('index', [0.1, 0.25]), ('unique', [0.1, 0.2])])
+def test_migration_of_unversioned_table(tmp_path, schema, giss):
+    manager = legacy_database(tmp_path, schema)
+    manager.create_tables()
+    assert_migrated(manager, giss)
+
+    # Creating the tables again leaves the migrated table alone
+    manager.create_tables()
+    assert manager.get_published_versions() == {'ghcn': 2, 'giss': 1}
+
+
+def test_in_place_migration(tmp_path, monkeypatch):
+    # The path taken on PostgreSQL, run here on a table whose index SQLite can drop
+    monkeypatch.setattr(DatabaseManager, '_rebuild_climate_data',
+                        staticmethod(DatabaseManager._alter_climate_data))
+    manager = legacy_database(tmp_path, 'index')
+    manager.create_tables()
+
+    with manager.engine.connect() as conn:
+        ids = conn.execute(text('SELECT id FROM climate_data ORDER BY id')).scalars().all()
+    assert ids == [1, 3, 4]
+    indexes = inspect(manager.engine).get_indexes('climate_data')
+    assert [(index['name'], index['unique']) for index in indexes] == [('uq_dataset_version_year', 1)]
+    assert_migrated(manager, [0.1, 0.25])
@@ -0,0 +1,186 @@
+import logging
+
+import numpy as np
+import pytest
+
+from conftest import FIXTURE_DAT, FIXTURE_RELEASE, write_ghcn_raw
+from scripts import ghcn_chunked
+from scripts.aggregation import merge_box_sums
+from scripts.ghcn_incremental import STATE_FILE, load_state, save_state
+from scripts.transform_ghcn_raw import transform_ghcn_data
+
+TOLERANCE = 1e-9
+
+
+def run_engine(engine, **kwargs):
+    stats = {}
+    annual = transform_ghcn_data(grid_size=5, engine=engine, qc_policy='keep_all', stats=stats, **kwargs)
+    gridded = stats['gridded']
+    boxes = gridded['boxes'].sort_values(['cell', 'year', 'month'], ignore_index=True)
+    monthly = gridded['monthly'].sort_values(['year', 'month'], ignore_index=True)
+    return annual, boxes, monthly
+
+
+def assert_products_match(actual, expected):
+    annual, boxes, monthly = actual
+    expected_annual, expected_boxes, expected_monthly = expected
+
+    np.testing.assert_array_equal(annual['year'], expected_annual['year'])
+    np.testing.assert_allclose(annual['anomaly (deg C)'], expected_annual['anomaly (deg C)'],
+                               rtol=0, atol=TOLERANCE)
+
+    np.testing.assert_array_equal(boxes[['cell', 'year', 'month']], expected_boxes[['cell', 'year', 'month']])
+    np.testing.assert_allclose(boxes[['anomaly', 'weight']], expected_boxes[['anomaly', 'weight']],
+                               rtol=0, atol=TOLERANCE)
+
+    np.testing.assert_array_equal(monthly[['year', 'month']], expected_monthly[['year', 'month']])
+    np.testing.assert_allclose(monthly['anomaly'], expected_monthly['anomaly'], rtol=0, atol=TOLERANCE)
+
+
+def test_fixture_covers_every_code_path(ghcn_raw):
+    annual, boxes, _ = run_engine('wide')
+
+    assert len(annual) == 51
+    assert annual['anomaly (deg C)'].notna().all()
+    # Several stations share some cells, and the polar band outside the landmask is dropped
+    assert boxes['cell'].nunique() > 10
+    assert (boxes['cell'] // 72 < 32).all()
+
+
+@pytest.mark.parametrize('engine, kwargs', [
+    ('long', {}),
+    # A 1 MB budget splits the fixture into several chunks
+    ('chunked', {'memory_budget_mb': 1}),
+])
+def test_engines_agree_with_wide(ghcn_raw, engine, kwargs):
+    expected = run_engine('wide')
+    assert_products_match(run_engine(engine, **kwargs), expected)
+
+
+def test_chunked_engine_splits_the_file(ghcn_raw):
+    stats = {}
+    transform_ghcn_data(grid_size=5, engine='chunked', qc_policy='keep_all', stats=stats, memory_budget_mb=1)
+    assert stats['chunks'] > 1
+
+
+def test_long_engine_warns_that_it_keeps_flagged_values(ghcn_raw, caplog):
+    with caplog.at_level(logging.WARNING, logger='scripts.transform_ghcn_raw'):
+        transform_ghcn_data(grid_size=5, engine='long', qc_policy='drop_any')
+    assert 'not applied by the long engine' in caplog.text
+
+
+def test_malformed_qc_policy_fails_before_reading(ghcn_raw):
+    with pytest.raises(ValueError):
+        transform_ghcn_data(grid_size=5, engine='wide', qc_policy='drop-any')
+
+
+def test_chunked_totals_hold_only_occupied_boxes(tmp_path, monkeypatch):
+    # A record from 1880 and one from 2020 stretch the year span far beyond the years with data
+    monkeypatch.chdir(tmp_path)
+    write_ghcn_raw(str(tmp_path / 'data' / 'raw'), years=[1880, *range(1951, 1981), 2020])
+    sizes = []
+
+    def recording_merge(parts):
+        merged = merge_box_sums(parts)
+        sizes.append(len(merged['key']))
+        return merged
+
+    monkeypatch.setattr(ghcn_chunked, 'merge_box_sums', recording_merge)
+    _, boxes, _ = run_engine('chunked', memory_budget_mb=1)
+    assert len(sizes) > 1
+    # The totals only grow with new boxes, far below a dense (cell, month, year) array over 1880-2020
+    assert max(sizes) == sizes[-1]
+    assert sizes[-1] * 3 < boxes['cell'].nunique() * 12 * (2020 - 1880 + 1)
+
+
+def test_incremental_run_matches_a_full_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    raw_dir = str(tmp_path / 'data' / 'raw')
+    write_ghcn_raw(raw_dir)
+    transform_ghcn_data(grid_size=5, qc_policy='keep_all', incremental=True, cache_dir=str(tmp_path / 'cache'),
+                        raw_dir=raw_dir)
+
+    # A revised release that changes one year outside the baseline period
+    write_ghcn_raw(raw_dir, shift={1995: 0.5})
+    stats = {}
+    incremental = transform_ghcn_data(grid_size=5, qc_policy='keep_all', stats=stats, incremental=True,
+                                      cache_dir=str(tmp_path / 'cache'), raw_dir=raw_dir)
+    assert stats['changed_years'] == [1995]
+
+    full_stats = {}
+    full = transform_ghcn_data(grid_size=5, qc_policy='keep_all', stats=full_stats,
+                               cache_dir=str(tmp_path / 'full_cache'), raw_dir=raw_dir)
+    assert 'changed_years' not in full_stats
+    np.testing.assert_array_equal(incremental['year'], full['year'])
+    np.testing.assert_allclose(incremental['anomaly (deg C)'], full['anomaly (deg C)'], rtol=0, atol=TOLERANCE)
+
+    # The gridded products of the changed year match those of the full run
+    boxes = stats['gridded']['boxes'].sort_values(['cell', 'month'], ignore_index=True)
+    full_boxes = full_stats['gridded']['boxes']
+    full_boxes = full_boxes[full_boxes['year'] == 1995].sort_values(['cell', 'month'], ignore_index=True)
+    assert (boxes['year'] == 1995).all()
+    np.testing.assert_array_equal(boxes[['cell', 'month']], full_boxes[['cell', 'month']])
+    np.testing.assert_allclose(boxes['anomaly'], full_boxes['anomaly'], rtol=0, atol=TOLERANCE)
+
+
+def test_baseline_change_falls_back_to_a_full_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    raw_dir = str(tmp_path / 'data' / 'raw')
+    write_ghcn_raw(raw_dir)
+    transform_ghcn_data(grid_size=5, qc_policy='keep_all', incremental=True, cache_dir=str(tmp_path / 'cache'),
+                        raw_dir=raw_dir)
+
+    write_ghcn_raw(raw_dir, shift={1970: 0.5})
+    stats = {}
+    transform_ghcn_data(grid_size=5, qc_policy='keep_all', stats=stats, incremental=True,
+                        cache_dir=str(tmp_path / 'cache'), raw_dir=raw_dir)
+    assert 'changed_years' not in stats
+
+
+def test_incremental_run_publishes_newly_complete_years(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    raw_dir = str(tmp_path / 'data' / 'raw')
+    write_ghcn_raw(raw_dir)
+    full = transform_ghcn_data(grid_size=5, qc_policy='keep_all', incremental=True,
+                               cache_dir=str(tmp_path / 'cache'), raw_dir=raw_dir)
+
+    # As if the previous run happened while 1999 and 2000 were still incomplete
+    state_path = tmp_path / 'cache' / STATE_FILE
+    state = load_state(str(state_path))
+    state['latest_year'] = np.array(1998)
+    save_state(str(state_path), **state)
+
+    stats = {}
+    incremental = transform_ghcn_data(grid_size=5, qc_policy='keep_all', stats=stats, incremental=True,
+                                      cache_dir=str(tmp_path / 'cache'), raw_dir=raw_dir)
+    assert stats['changed_years'] == [1999, 2000]
+    assert sorted(stats['gridded']['boxes']['year'].unique()) == [1999, 2000]
+    np.testing.assert_array_equal(incremental.to_numpy(), full.to_numpy())
+
+
+def test_incremental_run_after_an_empty_release(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    raw_dir = str(tmp_path / 'data' / 'raw')
+    dat_path = write_ghcn_raw(raw_dir)
+    open(dat_path, 'w').close()
+    empty = transform_ghcn_data(grid_size=5, qc_policy='keep_all', incremental=True,
+                                cache_dir=str(tmp_path / 'cache'), raw_dir=raw_dir)
+    assert empty.empty
+
+    # A state without stations is no previous run: the next release is processed in full
+    write_ghcn_raw(raw_dir)
+    stats = {}
+    annual = transform_ghcn_data(grid_size=5, qc_policy='keep_all', stats=stats, incremental=True,
+                                 cache_dir=str(tmp_path / 'cache'), raw_dir=raw_dir)
+    assert 'changed_years' not in stats
+    assert len(annual) == 51
+
+
+def test_chunked_engine_without_gridded_stations(ghcn_raw):
+    dat_path = str(ghcn_raw / FIXTURE_RELEASE / FIXTURE_DAT)
+    stats = {}
+    products = ghcn_chunked.chunked_anomalies(dat_path, np.array([], dtype='S11'), np.array([], dtype=np.int64),
+                                              np.array([]), qc_policy='keep_all', stats=stats, memory_budget_mb=1)
+    assert products['annual'].empty
+    assert products['boxes'].empty
+    assert stats['chunks'] > 1
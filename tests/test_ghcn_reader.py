@@ -0,0 +1,123 @@
+import io
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import FIXTURE_DAT, FIXTURE_RELEASE, ghcn_archive, write_ghcn_raw
+from scripts import ghcn_reader
+from scripts.ghcn_reader import (DIGEST_SUFFIX, DROP_ANY, KEEP_ALL, exact_degrees, parse_dat, parse_qc_policy,
+                                 read_ghcn_dat, read_ghcn_tar)
+from scripts.ghcn_incremental import STATE_FILE
+
+
+def test_cache_keeps_only_the_current_release(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    (cache_dir / STATE_FILE).write_bytes(b'state')
+
+    dat_path = write_ghcn_raw(str(tmp_path / 'raw'), n_stations=5, seed=1)
+    first = read_ghcn_dat(dat_path, cache_dir=str(cache_dir))
+    first_files = sorted(os.listdir(cache_dir))
+    assert len(first_files) == 2
+
+    # A new release replaces the cached columns of the previous one
+    dat_path = write_ghcn_raw(str(tmp_path / 'raw'), n_stations=5, seed=2)
+    second = read_ghcn_dat(dat_path, cache_dir=str(cache_dir))
+    second_files = sorted(os.listdir(cache_dir))
+    assert len(second_files) == 2
+    assert STATE_FILE in second_files
+    assert second_files != first_files
+    assert not np.array_equal(first['values'], second['values'], equal_nan=True)
+
+    # A cache hit returns the parsed columns
+    cached = read_ghcn_dat(dat_path, cache_dir=str(cache_dir))
+    np.testing.assert_array_equal(cached['values'], parse_dat(dat_path)['values'])
+    assert sorted(os.listdir(cache_dir)) == second_files
+
+
+@pytest.mark.parametrize('policy, expected', [
+    (None, KEEP_ALL),
+    ('keep_all', KEEP_ALL),
+    ('drop_any', DROP_ANY),
+    ('D,K, O', frozenset('DKO')),
+    ('DK', frozenset('DK')),
+    (['D', 'K'], frozenset('DK')),
+])
+def test_parse_qc_policy(policy, expected):
+    assert parse_qc_policy(policy) == expected
+
+
+@pytest.mark.parametrize('policy', ['drop-any', 'keepall', 'Drop_Any', 'd,k', '', 'D,KO1', ['DK']])
+def test_parse_qc_policy_rejects_mistyped_policies(policy):
+    with pytest.raises(ValueError):
+        parse_qc_policy(policy)
+
+
+def test_qc_policy_masks_flagged_values(tmp_path):
+    dat_path = write_ghcn_raw(str(tmp_path), n_stations=5, qc_rate=0.2)
+    flagged = read_ghcn_dat(dat_path, keep_flags=True)['qcflag'] == ord('D')
+
+    stats = {}
+    kept = read_ghcn_dat(dat_path)['values']
+    dropped = read_ghcn_dat(dat_path, qc_policy='D', stats=stats)['values']
+    assert np.isnan(dropped[flagged]).all()
+    np.testing.assert_array_equal(dropped[~flagged], kept[~flagged])
+    assert stats['qc_dropped'] == {'D': int((flagged & ~np.isnan(kept)).sum())}
+
+
+def prefetch_threads():
+    return [thread for thread in threading.enumerate() if thread.name == 'ghcn-prefetch']
+
+
+def test_prefetcher_close_stops_a_blocked_reader():
+    prefetcher = ghcn_reader._Prefetcher(io.BytesIO(b'x' * 10000), block_size=10, depth=2)
+    assert prefetcher.read(15) == b'x' * 15
+    prefetcher.close()
+    assert not prefetcher._thread.is_alive()
+
+
+def test_failed_archive_ingest_leaves_no_reader_thread(tmp_path, monkeypatch):
+    write_ghcn_raw(str(tmp_path / 'source'), n_stations=5)
+    archive = ghcn_archive(str(tmp_path / 'source'))
+
+    # Small blocks and a one-block queue keep the reader blocked while the .dat is decoded
+    prefetcher = ghcn_reader._Prefetcher
+    monkeypatch.setattr(ghcn_reader, '_Prefetcher', lambda raw: prefetcher(raw, block_size=64, depth=1))
+
+    def failing_chunks(*args):
+        raise RuntimeError('decoding failed')
+        yield
+
+    monkeypatch.setattr(ghcn_reader, 'iter_dat_chunks', failing_chunks)
+    with pytest.raises(RuntimeError):
+        read_ghcn_tar(io.BytesIO(archive), str(tmp_path / 'out'), str(tmp_path / 'cache'))
+    assert prefetch_threads() == []
+
+
+def test_archive_with_an_empty_dat(tmp_path):
+    release = tmp_path / 'source' / FIXTURE_RELEASE
+    write_ghcn_raw(str(tmp_path / 'source'), n_stations=5)
+    (release / FIXTURE_DAT).write_bytes(b'')
+
+    pointer = read_ghcn_tar(io.BytesIO(ghcn_archive(str(tmp_path / 'source'))), str(tmp_path / 'out'),
+                            str(tmp_path / 'cache'))
+    assert pointer.endswith(FIXTURE_DAT + DIGEST_SUFFIX)
+    columns = read_ghcn_dat(pointer, cache_dir=str(tmp_path / 'cache'))
+    assert columns['station'].dtype == np.dtype('S11')
+    assert columns['values'].shape == (0, 12)
+    assert prefetch_threads() == []
+
+
+def test_exact_degrees_match_a_float64_parse(tmp_path):
+    dat_path = write_ghcn_raw(str(tmp_path / 'raw'), n_stations=5)
+    values = parse_dat(dat_path)['values']
+    assert values.dtype == np.float32
+
+    # The hundredths as written, divided in float64 as a pandas parse of the file would
+    with open(dat_path) as f:
+        hundredths = np.array([[int(line[19 + 8 * m:24 + 8 * m]) for m in range(12)] for line in f], dtype=float)
+    expected = np.where(hundredths == -9999, np.nan, hundredths / 100)
+    np.testing.assert_array_equal(exact_degrees(values), expected)
+    assert not np.array_equal(values.astype(np.float64), expected, equal_nan=True)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from conftest import gridded_products
+from gridded import CELL_DTYPE, VALUE_DTYPE, GridStore, pack_gridded_products
+
+
+def test_packed_rows_hold_every_box_of_their_year():
+    products = gridded_products()
+    boxes, monthly = products['boxes'], products['monthly']
+    rows = pack_gridded_products(boxes, monthly, products['grid_size'])
+    assert [row['year'] for row in rows] == sorted(boxes['year'].unique())
+
+    for row in rows:
+        assert row['grid_size'] == 5.0
+        year_boxes = boxes[boxes['year'] == row['year']]
+        cells = np.frombuffer(row['cells'], dtype=CELL_DTYPE)
+        np.testing.assert_array_equal(cells, np.unique(year_boxes['cell']))
+
+        # Boxes without data in a month are NaN
+        values = np.frombuffer(row['values'], dtype=VALUE_DTYPE).reshape(len(cells), 12)
+        expected = np.full((len(cells), 12), np.nan, dtype=np.float32)
+        expected[np.searchsorted(cells, year_boxes['cell']), year_boxes['month'] - 1] = year_boxes['anomaly']
+        np.testing.assert_array_equal(values, expected)
+
+        weights = np.frombuffer(row['weights'], dtype=VALUE_DTYPE)
+        cell_weights = year_boxes.groupby('cell')['weight'].first()
+        np.testing.assert_array_equal(weights, cell_weights.to_numpy(dtype=np.float32))
+
+        year_monthly = monthly[monthly['year'] == row['year']]
+        np.testing.assert_array_equal(np.frombuffer(row['monthly'], dtype=VALUE_DTYPE)[year_monthly['month'] - 1],
+                                      year_monthly['anomaly'].to_numpy(dtype=np.float32))
+
+
+def box_series(boxes):
+    # Weighted annual mean of the boxes, as grid_reduce computes the global series
+    weighted = boxes.assign(product=boxes['anomaly'] * boxes['weight']).groupby('year')
+    return (weighted['product'].sum() / weighted['weight'].sum()).to_numpy()
+
+
+@pytest.fixture(scope='module')
+def products():
+    return gridded_products()
+
+
+@pytest.fixture(scope='module')
+def store(products):
+    rows = pack_gridded_products(products['boxes'], products['monthly'], products['grid_size'])
+    return GridStore(rows, products['cell_countries'])
+
+
+def test_the_globe_reproduces_the_annual_series(products, store):
+    mask = store.region_mask(bbox=(-180, -90, 180, 90))
+    assert mask.all()
+    series = store.region_series(mask)
+    np.testing.assert_array_equal(series['years'], products['annual']['year'])
+    np.testing.assert_allclose(series['anomaly'], products['annual']['anomaly (deg C)'], rtol=1e-5, atol=1e-6)
+    np.testing.assert_array_equal(series['cells'], products['boxes'].groupby('year')['cell'].nunique())
+
+
+def test_a_box_across_the_antimeridian(products, store):
+    # Centres at 172.5 and 177.5 east and 177.5 and 172.5 west
+    mask = store.region_mask(bbox=(170, -90, -170, 90))
+    lon_idx = store.cells % 72
+    np.testing.assert_array_equal(mask, np.isin(lon_idx, [0, 1, 70, 71]))
+    assert {-177.5, 177.5} <= set(store.lon[mask])  # the fixture has a station on each side
+
+    boxes = products['boxes'][np.isin(products['boxes']['cell'], store.cells[mask])]
+    series = store.region_series(mask)
+    np.testing.assert_allclose(series['anomaly'], box_series(boxes), rtol=1e-5, atol=1e-6)
+
+    # An ordinary box excludes the antimeridian cells
+    assert not (store.region_mask(bbox=(-170, -90, 170, 90)) & mask).any()
+
+
+def test_countries_select_the_cells_of_their_stations(products, store):
+    cells = products['cell_countries']
+    mask = store.region_mask(countries=['BR'])
+    np.testing.assert_array_equal(store.cells[mask], cells['BR'])
+
+    mask = store.region_mask(countries=['BR', 'AU'])
+    np.testing.assert_array_equal(store.cells[mask], np.union1d(cells['BR'], cells['AU']))
+
+    # Criteria combine, and unknown countries select nothing
+    north = store.region_mask(bbox=(-180, 0, 180, 90), countries=['BR'])
+    np.testing.assert_array_equal(store.cells[north], [cell for cell in cells['BR'] if cell // 72 >= 18])
+    assert not store.region_mask(countries=['XX']).any()
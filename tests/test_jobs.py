@@ -0,0 +1,45 @@
+import pytest
+
+import data_processor
+from data_processor import DataProcessor
+from database import DatabaseManager
+from jobs import run_processing_job
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    manager = DatabaseManager(f"sqlite:///{tmp_path / 'climate.db'}")
+    manager.create_tables()
+    monkeypatch.setattr(data_processor, 'get_db_manager', lambda database_url=None: manager)
+    return manager
+
+
+def run_job(db, monkeypatch, results):
+    monkeypatch.setattr(DataProcessor, 'download_data', lambda self, force=False: True)
+    monkeypatch.setattr(DataProcessor, 'transform_and_store_data', lambda self, workers=1, force=False: results)
+    monkeypatch.setattr(DataProcessor, 'precompute_analysis', lambda self, force=False: True)
+
+    # Another process finishes a pipeline run right after this one
+    log_processing_run = db.log_processing_run
+
+    def racing_log(process_type, status, message=None, **kwargs):
+        logged = log_processing_run(process_type, status, message, **kwargs)
+        if process_type == 'complete':
+            log_processing_run('complete', 'success', 'Run of another process')
+        return logged
+
+    monkeypatch.setattr(db, 'log_processing_run', racing_log)
+    job = db.claim_job('job-1')
+    run_processing_job(db, job['job_id'])
+    return db.get_job(job['job_id'])
+
+
+@pytest.mark.parametrize('results, status', [
+    ({'giss': True, 'ghcn': True}, 'success'),
+    ({'giss': True, 'ghcn': False}, 'partial'),
+    ({'giss': False, 'ghcn': False}, 'failure'),
+])
+def test_job_status_comes_from_its_own_run(db, monkeypatch, results, status):
+    job = run_job(db, monkeypatch, results)
+    assert job['status'] == status
+    assert job['message'] != 'Run of another process'
@@ -0,0 +1,137 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+from conftest import FIXTURE_DAT, FIXTURE_INV, FIXTURE_RELEASE, ghcn_archive, write_ghcn_raw
+from scripts.ghcn_reader import DIGEST_SUFFIX, parse_dat, read_ghcn_dat
+from scripts.raw_data_extract import DOWNLOADED, FAILED, NOT_MODIFIED, DownloadError, download_all_data
+
+
+class StandIn:
+    """Files served by the local HTTP stand-in, with ETags and injected failures."""
+
+    def __init__(self):
+        self.files = {}  # path -> (body, etag)
+        self.failures = {}  # path -> number of 503 responses before the file is served
+        self.requests = []  # (path, If-None-Match) of every request
+
+
+@pytest.fixture
+def stand_in():
+    files = StandIn()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            files.requests.append((self.path, self.headers.get('If-None-Match')))
+            if files.failures.get(self.path, 0) > 0:
+                files.failures[self.path] -= 1
+                self.send_error(503)
+                return
+            if self.path not in files.files:
+                self.send_error(404)
+                return
+            body, etag = files.files[self.path]
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    files.url = f"http://127.0.0.1:{server.server_port}"
+    yield files
+    server.shutdown()
+    server.server_close()
+
+
+def release_archive(tmp_path):
+    dat_path = write_ghcn_raw(str(tmp_path / 'source'), n_stations=5)
+    return ghcn_archive(str(tmp_path / 'source')), dat_path
+
+
+def sources(stand_in):
+    return {
+        'giss': (stand_in.url + '/giss.csv', 'giss_temp_data.csv'),
+        'ghcn': (stand_in.url + '/ghcn.tar.gz', 'ghcn_latest.qcu.tar.gz'),
+    }
+
+
+def download(stand_in, raw_dir, **kwargs):
+    return download_all_data(sources(stand_in), raw_dir=str(raw_dir), include_landmask=False, backoff=0.01,
+                             cache_dir=str(raw_dir.parent / 'cache'), **kwargs)
+
+
+def test_conditional_gets_skip_unchanged_sources(tmp_path, stand_in):
+    archive, dat_path = release_archive(tmp_path)
+    stand_in.files['/giss.csv'] = (b'giss v1\n', '"g1"')
+    stand_in.files['/ghcn.tar.gz'] = (archive, '"a1"')
+    raw_dir = tmp_path / 'raw'
+
+    assert download(stand_in, raw_dir) == {'giss': DOWNLOADED, 'ghcn': DOWNLOADED}
+    assert (raw_dir / 'giss_temp_data.csv').read_bytes() == b'giss v1\n'
+    extracted = raw_dir / FIXTURE_RELEASE / FIXTURE_DAT
+    assert extracted.read_bytes() == open(dat_path, 'rb').read()
+
+    # The second run sends the stored ETags and keeps the files
+    assert download(stand_in, raw_dir) == {'giss': NOT_MODIFIED, 'ghcn': NOT_MODIFIED}
+    assert ('/giss.csv', '"g1"') in stand_in.requests
+
+    # A changed source is fetched again; force ignores the validators
+    stand_in.files['/giss.csv'] = (b'giss v2\n', '"g2"')
+    assert download(stand_in, raw_dir) == {'giss': DOWNLOADED, 'ghcn': NOT_MODIFIED}
+    assert (raw_dir / 'giss_temp_data.csv').read_bytes() == b'giss v2\n'
+    assert download(stand_in, raw_dir, force=True) == {'giss': DOWNLOADED, 'ghcn': DOWNLOADED}
+    assert not [name for name in os.listdir(raw_dir) if name.endswith('.part')]
+
+
+def test_transient_errors_are_retried(tmp_path, stand_in):
+    stand_in.files['/giss.csv'] = (b'giss\n', '"g1"')
+    stand_in.failures['/giss.csv'] = 2
+    results = download_all_data({'giss': sources(stand_in)['giss']}, raw_dir=str(tmp_path), include_landmask=False,
+                                backoff=0.01, retries=3)
+    assert results == {'giss': DOWNLOADED}
+    assert [path for path, _ in stand_in.requests] == ['/giss.csv'] * 3
+
+
+def test_failed_source_falls_back_on_its_previous_copy(tmp_path, stand_in):
+    giss = {'giss': sources(stand_in)['giss']}
+    with pytest.raises(DownloadError):
+        download_all_data(giss, raw_dir=str(tmp_path), include_landmask=False, backoff=0.01, retries=0)
+
+    stand_in.files['/giss.csv'] = (b'giss\n', '"g1"')
+    download_all_data(giss, raw_dir=str(tmp_path), include_landmask=False, backoff=0.01, retries=0)
+    stand_in.failures['/giss.csv'] = 1
+    results = download_all_data(giss, raw_dir=str(tmp_path), include_landmask=False, force=True,
+                                backoff=0.01, retries=0)
+    assert results == {'giss': FAILED}
+    assert (tmp_path / 'giss_temp_data.csv').read_bytes() == b'giss\n'
+
+
+def test_streamed_archive_is_parsed_without_extracting_the_dat(tmp_path, stand_in):
+    archive, dat_path = release_archive(tmp_path)
+    stand_in.files['/ghcn.tar.gz'] = (archive, '"a1"')
+    raw_dir = tmp_path / 'raw'
+
+    results = download_all_data({'ghcn': sources(stand_in)['ghcn']}, raw_dir=str(raw_dir), include_landmask=False,
+                                ghcn_stream=True, cache_dir=str(tmp_path / 'cache'))
+    assert results == {'ghcn': DOWNLOADED}
+    assert not (raw_dir / 'ghcn_latest.qcu.tar.gz').exists()
+    release = raw_dir / FIXTURE_RELEASE
+    assert sorted(os.listdir(release)) == sorted([FIXTURE_DAT + DIGEST_SUFFIX, FIXTURE_INV])
+
+    streamed = read_ghcn_dat(str(release / (FIXTURE_DAT + DIGEST_SUFFIX)), cache_dir=str(tmp_path / 'cache'))
+    expected = parse_dat(dat_path)
+    np.testing.assert_array_equal(streamed['station'], expected['station'])
+    np.testing.assert_array_equal(streamed['values'], expected['values'])
@@ -0,0 +1,57 @@
+import threading
+
+from response_cache import ResponseCache
+
+
+def test_slow_build_does_not_block_other_keys():
+    cache = ResponseCache()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_builder():
+        started.set()
+        release.wait(5)
+        return {'slow': True}, 'slow-etag'
+
+    slow = threading.Thread(target=cache.get_or_build, args=('slow', slow_builder))
+    slow.start()
+    try:
+        assert started.wait(5)
+        # Other keys are built and served while the slow build is in progress
+        assert cache.get_or_build('fast', lambda: ({'fast': True}, 'fast-etag')).etag == 'fast-etag'
+        assert cache.get_or_build_value('index', lambda: 'value') == 'value'
+        assert cache.get('slow') is None
+    finally:
+        release.set()
+        slow.join()
+    assert cache.get('slow').etag == 'slow-etag'
+
+
+def test_each_key_is_built_once():
+    cache = ResponseCache()
+    builds = []
+    release = threading.Event()
+
+    def builder():
+        builds.append(1)
+        release.wait(5)
+        return 'value'
+
+    threads = [threading.Thread(target=cache.get_or_build_value, args=('index', builder)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+
+
+def test_build_started_before_invalidate_is_not_kept():
+    cache = ResponseCache()
+
+    def builder():
+        # A processing run completes while the old data is being serialized
+        cache.invalidate()
+        return {'stale': True}, 'stale-etag'
+
+    assert cache.get_or_build('data', builder).etag == 'stale-etag'
+    assert cache.get('data') is None
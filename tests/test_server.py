@@ -0,0 +1,242 @@
+import gzip
+import json
+import os
+import shutil
+import struct
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import server
+from conftest import gridded_products, haversine_km, write_ghcn_raw
+from analysis import parse_windows, precompute_windows
+from database import DatabaseManager
+from gridded import pack_gridded_products
+from response_cache import response_cache
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    manager = DatabaseManager(f"sqlite:///{tmp_path / 'climate.db'}")
+    manager.create_tables()
+    monkeypatch.setattr(server, 'db_manager', manager)
+    response_cache.invalidate()
+    yield manager
+    response_cache.invalidate()
+
+
+@pytest.fixture
+def client(db):
+    return server.app.test_client()
+
+
+def store_series(db):
+    rng = np.random.default_rng(0)
+    years = np.arange(1900, 2021)
+    for dataset, start in (('giss', 1900), ('crutem', 1950), ('ghcn', 1900)):
+        kept = years >= start
+        values = 0.01 * (years[kept] - 1900) + rng.normal(0, 0.1, kept.sum())
+        db.store_climate_data(dataset, pd.DataFrame({'year': years[kept], 'anomaly (deg C)': values}))
+
+
+def analyze(client, datasets, start=None, end=None):
+    response = client.post('/analyze', json={'datasets': datasets, 'start_year': start, 'end_year': end})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_precomputed_windows_are_loaded_once(client, db, monkeypatch):
+    store_series(db)
+    results = precompute_windows(db.get_climate_frame(), parse_windows('1900-,1951-1980'))
+    db.store_analysis_results(db.get_data_version(), results)
+
+    loads = []
+    get_analysis_results = db.get_analysis_results
+    monkeypatch.setattr(db, 'get_analysis_results', lambda version: loads.append(version) or
+                        get_analysis_results(version))
+
+    datasets = ['giss', 'crutem', 'ghcn']
+    precomputed = [analyze(client, datasets, 1951, 1980), analyze(client, datasets), analyze(client, datasets, 1800)]
+    assert loads == [db.get_data_version()]
+
+    # Windows that were not precomputed come from the prefix index; both agree
+    index = server.get_prefix_index()
+    assert precomputed == [index.analyze(datasets, 1951, 1980)] + [index.analyze(datasets)] * 2
+    assert analyze(client, datasets, 1960, 1970) == index.analyze(datasets, 1960, 1970)
+    assert loads == [db.get_data_version()]
+
+
+@pytest.mark.parametrize('start, end', [(None, None), (1900, 1949), (1960, 1970), (2100, None)])
+def test_analysis_without_the_prefix_index(client, db, monkeypatch, start, end):
+    store_series(db)
+    datasets = ['giss', 'crutem', 'ghcn', 'unknown']
+    expected = server.get_prefix_index().analyze(datasets, start, end)
+
+    # The index could not be built: the window is read from the database instead, with the same response
+    monkeypatch.setattr(server, 'get_prefix_index', lambda: None)
+    assert analyze(client, datasets, start, end) == expected
+
+
+def test_data_is_revalidated_with_its_etag(client, db, monkeypatch):
+    import data_processor
+
+    store_series(db)
+    first = client.get('/data')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.get_json()['years'][0] == 1900
+
+    # A revalidation is answered without a body, compressed bodies decode to the same JSON
+    assert client.get('/data', headers={'If-None-Match': etag}).status_code == 304
+    compressed = client.get('/data', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(compressed.data)) == first.get_json()
+
+    # A processing run that publishes a new version invalidates the cache and changes the ETag
+    def transform(self, workers=1, force=False):
+        db.store_climate_data('giss', pd.DataFrame({'year': [1900], 'anomaly (deg C)': [1.5]}))
+        return {'giss': True}
+
+    monkeypatch.setattr(data_processor, 'get_db_manager', lambda database_url=None: db)
+    monkeypatch.setattr(data_processor.DataProcessor, 'download_data', lambda self, force=False: True)
+    monkeypatch.setattr(data_processor.DataProcessor, 'transform_and_store_data', transform)
+    assert data_processor.DataProcessor().process_all()
+
+    second = client.get('/data', headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
+    assert second.get_json()['giss'][0] == 1.5
+
+
+PACKED_ACCEPT = f'{server.PACKED_MIMETYPE}, application/json;q=0.5'  # What static/index.js sends
+
+# Runs the browser's decodePackedData on a packed body read from stdin and prints the columns
+# as JSON, with NaN (missing) as null
+NODE_DECODER = r"""
+const fs = require('fs');
+const source = fs.readFileSync(process.argv[1], 'utf8');
+const PACKED_MAGIC = source.match(/const PACKED_MAGIC = '([^']+)'/)[1];
+eval(source.match(/function decodePackedData\(buffer\) \{[\s\S]*?\n\}/)[0]);
+const body = fs.readFileSync(0);
+const data = decodePackedData(body.buffer.slice(body.byteOffset, body.byteOffset + body.length));
+const out = {};
+for (const [column, values] of Object.entries(data)) {
+  out[column] = Array.from(values, value => Number.isNaN(value) ? null : value);
+}
+console.log(JSON.stringify(out));
+"""
+
+
+def decode_packed(body):
+    # The layout documented in server.py
+    assert body[:4] == server.PACKED_MAGIC
+    header_length = struct.unpack('<I', body[4:8])[0]
+    assert (8 + header_length) % 4 == 0
+    header = json.loads(body[8:8 + header_length])
+    offset = 8 + header_length
+    data = {'years': np.frombuffer(body, dtype='<i4', count=header['n'], offset=offset)}
+    for column in header['columns']:
+        offset += header['n'] * 4
+        data[column] = np.frombuffer(body, dtype='<f4', count=header['n'], offset=offset)
+    assert offset + header['n'] * 4 == len(body)
+    return data
+
+
+def assert_matches_json(data, expected):
+    assert list(data['years']) == expected['years']
+    for dataset in server.DATA_DATASETS:
+        values = np.array([np.nan if value is None else value for value in expected[dataset]], dtype=np.float32)
+        np.testing.assert_array_equal(np.asarray(data[dataset], dtype=np.float32), values)
+
+
+def test_packed_data_round_trips_to_the_json_response(client, db):
+    store_series(db)
+    expected = client.get('/data').get_json()
+    assert expected['crutem'][0] is None  # crutem starts in 1950
+
+    response = client.get('/data', headers={'Accept': PACKED_ACCEPT})
+    assert response.mimetype == server.PACKED_MIMETYPE
+    assert 'Accept' in response.headers['Vary']
+    assert_matches_json(decode_packed(response.data), expected)
+
+    # Clients that do not ask for a binary format get JSON
+    for accept in ('text/html', '*/*', 'application/json'):
+        fallback = client.get('/data', headers={'Accept': accept})
+        assert fallback.mimetype == 'application/json'
+        assert fallback.get_json() == expected
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node is not installed')
+def test_browser_decoder_reads_the_packed_data(client, db):
+    store_series(db)
+    expected = client.get('/data').get_json()
+    body = client.get('/data', headers={'Accept': PACKED_ACCEPT}).data
+
+    script = os.path.join(os.path.dirname(server.__file__), 'static', 'index.js')
+    decoded = subprocess.run(['node', '-e', NODE_DECODER, script], input=body, capture_output=True, check=True)
+    assert_matches_json(json.loads(decoded.stdout), expected)
+
+
+def test_arrow_data_matches_the_json_response(client, db):
+    pa = pytest.importorskip('pyarrow')
+    store_series(db)
+    expected = client.get('/data').get_json()
+
+    response = client.get('/data', headers={'Accept': server.ARROW_MIMETYPE})
+    assert response.mimetype == server.ARROW_MIMETYPE
+    table = pa.ipc.open_stream(response.data).read_all()
+    data = {'years': table.column('year').to_pylist()}
+    data.update({dataset: table.column(dataset).to_numpy(zero_copy_only=False)
+                 for dataset in server.DATA_DATASETS})
+    assert_matches_json(data, expected)
+
+
+def test_region_series(client, db):
+    products = gridded_products()
+    db.store_climate_data('ghcn', products['annual'])
+    rows = pack_gridded_products(products['boxes'], products['monthly'], products['grid_size'])
+    db.store_gridded_anomalies('ghcn', 1, rows, cell_countries=products['cell_countries'])
+
+    # The whole globe is the published annual series
+    region = client.get('/region?bbox=-180,-90,180,90').get_json()
+    published = db.get_climate_frame(['ghcn'])['ghcn']
+    assert region['years'] == published.index.tolist()
+    np.testing.assert_allclose(region['anomaly'], published, atol=1e-3)
+    assert region['region_cells'] == products['boxes']['cell'].nunique()
+
+    # Centres at 172.5 and 177.5 east and west
+    region = client.get('/region?bbox=170,-90,-170,90').get_json()
+    cells = products['boxes']['cell'].unique()
+    assert region['region_cells'] == np.isin(cells % 72, [0, 1, 70, 71]).sum()
+
+    region = client.get('/region?country=br').get_json()
+    assert region['countries'] == ['BR']
+    assert region['region_cells'] == len(products['cell_countries']['BR'])
+
+    assert client.get('/region?country=XX').status_code == 404
+    assert client.get('/region?bbox=1,2,3').status_code == 400
+
+
+def test_station_queries_match_haversine(client, tmp_path, monkeypatch):
+    from scripts.transform_ghcn_raw import read_station_metadata
+
+    monkeypatch.setattr(server.config, 'RAW_DATA_DIR', tmp_path / 'raw')
+    dat_path = write_ghcn_raw(str(tmp_path / 'raw'))
+    meta = read_station_metadata(dat_path.replace('.dat', '.inv'))
+
+    for lat, lon in ((89.0, 10.0), (-70.0, 60.0), (20.0, 180.0), (0.0, -179.5)):
+        distances = haversine_km(lat, lon, meta['lat'], meta['lon']).to_numpy()
+        expected = np.argsort(distances)
+
+        nearest = client.get(f'/stations/nearest?lat={lat}&lon={lon}&n=3').get_json()['stations']
+        assert [station['station'] for station in nearest] == meta['station'].iloc[expected[:3]].tolist()
+        np.testing.assert_allclose([station['distance_km'] for station in nearest], distances[expected[:3]], atol=0.05)
+
+        radius_km = distances[expected[4]] + 1
+        within = client.get(f'/stations/within?lat={lat}&lon={lon}&radius_km={radius_km}').get_json()['stations']
+        assert [station['station'] for station in within] == meta['station'].iloc[expected[:5]].tolist()
+
+    assert client.get('/stations/nearest?lat=91&lon=0').status_code == 400
+    assert client.get('/stations/within?lat=0&lon=0&radius_km=0').status_code == 400
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import haversine_km
+from stations import StationIndex, StationRecords
+
+# Points near both poles, on both sides of the antimeridian and in between
+QUERY_POINTS = [(0.0, 0.0), (89.9, 45.0), (-89.5, -120.0), (10.0, 180.0), (-20.0, -179.95), (65.0, 179.0)]
+
+
+@pytest.fixture(scope='module')
+def meta():
+    rng = np.random.default_rng(0)
+    n = 300
+    # Random stations plus clusters at the poles and at the antimeridian
+    lat = np.concatenate([rng.uniform(-90, 90, n), rng.uniform(85, 90, 10), rng.uniform(-90, -85, 10),
+                          rng.uniform(-30, 70, 20)])
+    lon = np.concatenate([rng.uniform(-180, 180, n + 20), rng.choice([-1, 1], 20) * rng.uniform(178, 180, 20)])
+    stations = [f"US{i:09d}" for i in range(len(lat))]
+    return pd.DataFrame({'country_code': 'US', 'station': stations, 'lat': lat, 'lon': lon,
+                         'elev': 100.0, 'name': stations})
+
+
+@pytest.mark.parametrize('lat, lon', QUERY_POINTS)
+def test_nearest_stations_match_haversine(meta, lat, lon):
+    index = StationIndex(meta)
+    distances = haversine_km(lat, lon, meta['lat'], meta['lon']).to_numpy()
+    expected = np.argsort(distances)[:8]
+
+    nearest = index.nearest(lat, lon, n=8)
+    assert nearest['station'].tolist() == meta['station'].iloc[expected].tolist()
+    np.testing.assert_allclose(nearest['distance_km'], distances[expected], rtol=1e-9, atol=1e-6)
+
+
+@pytest.mark.parametrize('lat, lon', QUERY_POINTS)
+def test_stations_within_a_radius_match_haversine(meta, lat, lon):
+    index = StationIndex(meta)
+    distances = haversine_km(lat, lon, meta['lat'], meta['lon']).to_numpy()
+    expected = np.argsort(distances)
+    expected = expected[distances[expected] <= 1500]
+
+    within = index.within(lat, lon, 1500)
+    assert len(within) > 0
+    assert within['station'].tolist() == meta['station'].iloc[expected].tolist()
+    np.testing.assert_allclose(within['distance_km'], distances[expected], rtol=1e-9, atol=1e-6)
+    if abs(lon) >= 179:
+        # The circle reaches across the antimeridian
+        assert (within['lon'] > 0).any() and (within['lon'] < 0).any()
+
+
+def test_station_lookup(meta):
+    index = StationIndex(meta)
+    assert index.station('US000000007')['lat'].item() == meta['lat'].iloc[7]
+    assert index.station('ZZ999999999') is None
+    assert len(index.nearest(0, 0, n=10_000)) == len(meta)
+
+
+def test_station_records_are_grouped_by_station():
+    rng = np.random.default_rng(1)
+    station = np.repeat([b'AA000000001', b'BB000000002'], 40)
+    year = np.tile(np.arange(1951, 1991), 2)
+    values = rng.normal(10, 3, (80, 12))
+    values[rng.random((80, 12)) < 0.1] = np.nan
+    shuffled = rng.permutation(80)
+    records = StationRecords({'station': station[shuffled], 'year': year[shuffled], 'values': values[shuffled]})
+
+    series = records.series('BB000000002')
+    np.testing.assert_array_equal(series['years'], np.arange(1951, 1991))
+    np.testing.assert_array_equal(series['values'], values[40:])
+
+    # Anomalies from the station's own 1961-1990 monthly means
+    baselines = np.nanmean(values[50:], axis=0)
+    np.testing.assert_allclose(series['baselines'], baselines)
+    np.testing.assert_allclose(series['anomalies'], values[40:] - baselines)
+    np.testing.assert_allclose(series['annual_anomaly'], np.nanmean(values[40:] - baselines, axis=1))
+
+    presorted = StationRecords({'station': station, 'year': year, 'values': values}, presorted=True)
+    np.testing.assert_array_equal(presorted.series('BB000000002')['anomalies'], series['anomalies'])
+    assert records.series('CC000000003') is None